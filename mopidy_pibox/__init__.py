@@ -9,13 +9,29 @@ import time
 
 from . import api
 from . import socket
+from .cache import PersistentCache
+from .search import SearchCache
 from .routing import ClientRoutingHandler, ClientRoutingWithAnalyticsHandler
 
 __version__ = pkg_resources.get_distribution("Mopidy-Pibox").version
 
+# Artwork lookups kept, in memory and on disk
+IMAGE_CACHE_SIZE = 2048
+# Seconds after which cached artwork is looked up again
+IMAGE_CACHE_TTL = 30 * 24 * 60 * 60
 
-def get_http_handlers(core, config, frontend, static_directory_path):
+# Distinct searches whose results are kept; see pibox/search_cache_ttl
+SEARCH_CACHE_SIZE = 256
+
+
+def get_http_handlers(core, config, frontend, static_directory_path, images=None):
     disable_analytics = config.get("pibox").get("disable_analytics", False)
+    if images is None:
+        images = PersistentCache(maxsize=IMAGE_CACHE_SIZE, ttl=IMAGE_CACHE_TTL)
+    searches = SearchCache(
+        maxsize=SEARCH_CACHE_SIZE,
+        ttl=config.get("pibox").get("search_cache_ttl"),
+    )
 
     return [
         (
@@ -39,6 +55,26 @@ def get_http_handlers(core, config, frontend, static_directory_path):
             api.SuggestionsHandler,
             {"core": core, "frontend": frontend},
         ),
+        (
+            r"/api/images/?",
+            api.ImagesHandler,
+            {"core": core, "frontend": frontend, "images": images},
+        ),
+        (
+            r"/api/search/?",
+            api.SearchHandler,
+            {"core": core, "frontend": frontend, "searches": searches},
+        ),
+        (
+            r"/api/stats/?",
+            api.StatsHandler,
+            {
+                "core": core,
+                "frontend": frontend,
+                "images": images,
+                "searches": searches,
+            },
+        ),
         (
             r"/config/?",
             api.ConfigHandler,
@@ -89,12 +125,28 @@ def my_app_factory(config, core):
     if not actors:
         raise RuntimeError("PiboxFrontend actor not started")
     frontend = actors[0].proxy()
+    pibox_config = config.get("pibox") or {}
 
     static_directory_path = os.path.join(os.path.dirname(__file__), "static")
+    # artwork URIs rarely change, so they are kept on disk across restarts
+    images = PersistentCache(
+        path=Extension.get_data_dir(config) / "pibox-images.sqlite",
+        maxsize=IMAGE_CACHE_SIZE,
+        ttl=IMAGE_CACHE_TTL,
+    )
 
     return [
-        (r"/ws/?", socket.PiboxWebSocket),
-        *get_http_handlers(core, config, frontend, static_directory_path),
+        (
+            r"/ws/?",
+            socket.PiboxWebSocket,
+            {
+                "frontend": frontend,
+                "ping_interval_ms": pibox_config.get("ws_ping_interval_ms") or 0,
+                "pong_timeout_ms": pibox_config.get("ws_pong_timeout_ms") or 4000,
+                "coalesce_ms": pibox_config.get("ws_coalesce_ms") or 0,
+            },
+        ),
+        *get_http_handlers(core, config, frontend, static_directory_path, images),
         (r"/api/reboot/?", api.RebootHandler, {"config": config}),
     ]
 
@@ -123,6 +175,15 @@ class Extension(ext.Extension):
         schema["queue_limit_per_user"] = config.Integer(optional=True, minimum=0)
         schema["reboot_command"] = config.String(optional=True)
         schema["ws_pong_timeout_ms"] = config.Integer(optional=True, minimum=1000)
+        schema["ws_ping_interval_ms"] = config.Integer(optional=True, minimum=0)
+        schema["ws_coalesce_ms"] = config.Integer(optional=True, minimum=0)
+        schema["playlist_cache_ttl"] = config.Integer(optional=True, minimum=0)
+        schema["lookahead"] = config.Boolean(optional=True)
+        schema["probe_depth"] = config.Integer(optional=True, minimum=0)
+        schema["position_heartbeat_ms"] = config.Integer(optional=True, minimum=0)
+        schema["search_cache_ttl"] = config.Integer(optional=True, minimum=0)
+        schema["track_cache_ttl"] = config.Integer(optional=True, minimum=0)
+        schema["journal_flush_ms"] = config.Integer(optional=True, minimum=0)
         return schema
 
     def setup(self, registry):
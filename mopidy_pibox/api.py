@@ -1,9 +1,12 @@
 from __future__ import absolute_import, unicode_literals
 
+from concurrent.futures import ThreadPoolExecutor
+import functools
 import json
 
 from mopidy import config
 import socket
+import tornado.ioloop
 import tornado.web
 
 import logging
@@ -11,6 +14,7 @@ import logging
 from mopidy.models import ModelJSONEncoder, Track
 from . import socket
 from .pibox import RateLimitExceeded
+from .search import normalise_query
 import os
 import json
 import re
@@ -18,6 +22,18 @@ import re
 # Default timeout for actor calls (in seconds)
 API_CALL_TIMEOUT = 15
 
+# Worker threads that wait on actor futures for the async handlers, so a slow
+# actor call never blocks Mopidy's shared IOLoop
+API_CALL_WORKERS = 16
+
+_actor_call_executor = ThreadPoolExecutor(
+    max_workers=API_CALL_WORKERS, thread_name_prefix="pibox-api"
+)
+
+# Runs the image cache's SQLite reads and writes off the IOLoop. A single
+# thread, so the cache is never used by two threads at once.
+_cache_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pibox-cache")
+
 
 class PiboxHandler(tornado.web.RequestHandler):
     def initialize(self, core, frontend):
@@ -31,65 +47,56 @@ class PiboxHandler(tornado.web.RequestHandler):
     def _get_user_fingerprint(self):
         return self.request.headers["X-Pibox-Fingerprint"]
 
+    async def _resolve(self, future, timeout=API_CALL_TIMEOUT):
+        """Wait for an actor future without blocking the IOLoop.
+
+        pykka futures can only be waited on by blocking, so the wait is
+        handed to a worker thread and the handler resumes once it is done.
+        """
+        return await tornado.ioloop.IOLoop.current().run_in_executor(
+            _actor_call_executor, functools.partial(future.get, timeout=timeout)
+        )
+
 
 class TracklistHandler(PiboxHandler):
     def initialize(self, core, frontend):
         super(TracklistHandler, self).initialize(core, frontend)
 
-    def post(self):
+    async def post(self):
         data = self._get_body()
         fingerprint = self._get_user_fingerprint()
         track_uri = data["track"]
-        (_success, error) = self.frontend.add_track_to_queue(track_uri, fingerprint).get(timeout=API_CALL_TIMEOUT)
-        tracklist = self.frontend.get_queued_tracks(fingerprint).get(timeout=API_CALL_TIMEOUT)
-        # include any per-user vote cooldown so clients can display it
-        try:
-            retry_seconds = self.frontend.pibox.get_vote_cooldown_seconds(fingerprint).get(timeout=API_CALL_TIMEOUT)
-        except Exception:
-            retry_seconds = None
-        self.set_header("Content-Type", "application/json")
-        self.write(
-            json.dumps({"tracklist": tracklist, "error": error, "retry_after_seconds": retry_seconds}, cls=ModelJSONEncoder)
-        )
+        view = await self._resolve(self.frontend.get_tracklist_view(fingerprint, "add", track_uri))
+        self._write_view(view)
 
-    def get(self):
+    async def get(self):
         fingerprint = self._get_user_fingerprint()
-        tracklist = self.frontend.get_queued_tracks(fingerprint).get(timeout=API_CALL_TIMEOUT)
-        try:
-            retry_seconds = self.frontend.pibox.get_vote_cooldown_seconds(fingerprint).get(timeout=API_CALL_TIMEOUT)
-        except Exception:
-            retry_seconds = None
-        self.set_header("Content-Type", "application/json")
-        self.write(
-            json.dumps({"tracklist": tracklist, "retry_after_seconds": retry_seconds}, cls=ModelJSONEncoder)
-        )
+        view = await self._resolve(self.frontend.get_tracklist_view(fingerprint))
+        self._write_view(view)
 
-    def delete(self):
+    async def delete(self):
         data = self._get_body()
         fingerprint = self._get_user_fingerprint()
         track_uri = data.get("track")
-        (_success, error) = self.frontend.remove_user_added_track(fingerprint, track_uri).get(timeout=API_CALL_TIMEOUT)
-        tracklist = self.frontend.get_queued_tracks(fingerprint).get(timeout=API_CALL_TIMEOUT)
-        try:
-            retry_seconds = self.frontend.pibox.get_vote_cooldown_seconds(fingerprint).get(timeout=API_CALL_TIMEOUT)
-        except Exception:
-            retry_seconds = None
+        view = await self._resolve(self.frontend.get_tracklist_view(fingerprint, "remove", track_uri))
+        self._write_view(view)
+
+    def _write_view(self, view):
+        # the frontend returns the view already encoded
         self.set_header("Content-Type", "application/json")
-        self.write(
-            json.dumps({"tracklist": tracklist, "error": error, "retry_after_seconds": retry_seconds}, cls=ModelJSONEncoder)
-        )
+        self.write(view)
 
 
 class VoteHandler(PiboxHandler):
     def initialize(self, core, frontend):
         super(VoteHandler, self).initialize(core, frontend)
 
-    def post(self):
+    async def post(self):
         data = self._get_body()
         fingerprint = self._get_user_fingerprint()
         track = Track(uri=data["uri"])
 
-        if self.frontend.pibox.has_user_voted_on_track(fingerprint, track).get(timeout=API_CALL_TIMEOUT):
+        if await self._resolve(self.frontend.pibox.has_user_voted_on_track(fingerprint, track)):
             self.set_status(400)
             response = {
                 "code": "15",
@@ -99,7 +106,9 @@ class VoteHandler(PiboxHandler):
             self.write(response)
         else:
             try:
-                self.frontend.add_vote_for_user_on_queued_track(fingerprint, track)
+                await self._resolve(
+                    self.frontend.add_vote_for_user_on_queued_track(fingerprint, track)
+                )
 
                 socket.PiboxWebSocket.send(
                     "VOTE_ADDED",
@@ -122,7 +131,7 @@ class SessionHandler(PiboxHandler):
     def initialize(self, core, frontend):
         super(SessionHandler, self).initialize(core, frontend)
 
-    def post(self):
+    async def post(self):
         data = self._get_body()
         skip_threshold = data["skipThreshold"]
         playlists = data.get("playlists", [])
@@ -130,21 +139,22 @@ class SessionHandler(PiboxHandler):
         shuffle = data.get("shuffle", True)
 
         self.frontend.start_session(int(skip_threshold), playlists, auto_start, shuffle)
-        session = self.frontend.pibox.to_json().get(timeout=API_CALL_TIMEOUT)
+        session = await self._resolve(self.frontend.pibox.to_json())
 
         socket.PiboxWebSocket.send(
             "SESSION_STARTED",
             session,
+            immediate=True,
         )
         self.set_status(200)
 
-    def get(self):
-        session = self.frontend.pibox.to_json().get(timeout=API_CALL_TIMEOUT)
+    async def get(self):
+        session = await self._resolve(self.frontend.pibox.to_json())
         self.write(session)
 
-    def delete(self):
-        self.frontend.end_session().get(timeout=API_CALL_TIMEOUT)
-        socket.PiboxWebSocket.send("SESSION_ENDED", {})
+    async def delete(self):
+        await self._resolve(self.frontend.end_session())
+        socket.PiboxWebSocket.send("SESSION_ENDED", {}, immediate=True)
         self.set_status(200)
 
 
@@ -154,9 +164,9 @@ class SessionPlaylistsHandler(PiboxHandler):
     def initialize(self, core, frontend):
         super(SessionPlaylistsHandler, self).initialize(core, frontend)
 
-    def post(self):
+    async def post(self):
         """Update the selected playlists for the current session."""
-        if not self.frontend.pibox.started.get(timeout=API_CALL_TIMEOUT):
+        if not await self._resolve(self.frontend.pibox.started):
             self.set_status(400)
             self.write({"error": "NO_ACTIVE_SESSION", "message": "No active session to update"})
             return
@@ -170,7 +180,7 @@ class SessionPlaylistsHandler(PiboxHandler):
             return
 
         self.frontend.update_session_playlists(playlists)
-        session = self.frontend.pibox.to_json().get(timeout=API_CALL_TIMEOUT)
+        session = await self._resolve(self.frontend.pibox.to_json())
 
         socket.PiboxWebSocket.send(
             "SESSION_PLAYLISTS_UPDATED",
@@ -185,12 +195,89 @@ class SuggestionsHandler(PiboxHandler):
     def initialize(self, core, frontend):
         super(SuggestionsHandler, self).initialize(core, frontend)
 
-    def get(self):
-        suggestions = self.frontend.get_suggestions(3).get(timeout=API_CALL_TIMEOUT)
+    async def get(self):
+        suggestions = await self._resolve(self.frontend.get_suggestions(3))
         self.set_header("Content-Type", "application/json")
         self.write(json.dumps({"suggestions": suggestions}, cls=ModelJSONEncoder))
 
 
+class ImagesHandler(PiboxHandler):
+    def initialize(self, core, frontend, images):
+        super(ImagesHandler, self).initialize(core, frontend)
+        self.images = images
+
+    async def post(self):
+        data = self._get_body()
+        uris = list(dict.fromkeys(data.get("uris") or []))
+        found, missing = await self._on_cache_thread(self.images.get_many, uris)
+
+        if missing:
+            # everything not cached is resolved in a single core call
+            result = await self._resolve(self.core.library.get_images(missing))
+            fetched = {
+                uri: [
+                    {"uri": image.uri, "width": image.width, "height": image.height}
+                    for image in (result or {}).get(uri, ())
+                ]
+                for uri in missing
+            }
+            # no artwork may only mean the backend failed this time, so it
+            # is asked again next time rather than remembered
+            await self._on_cache_thread(
+                self.images.put_many,
+                {uri: images for uri, images in fetched.items() if images},
+            )
+            found.update(fetched)
+
+        self.set_header("Content-Type", "application/json")
+        self.write({"images": found})
+
+    async def _on_cache_thread(self, fn, *args):
+        """Run a cache call on the cache thread, as it may wait on the disk."""
+        return await tornado.ioloop.IOLoop.current().run_in_executor(
+            _cache_executor, fn, *args
+        )
+
+
+class SearchHandler(PiboxHandler):
+    def initialize(self, core, frontend, searches):
+        super(SearchHandler, self).initialize(core, frontend)
+        self.searches = searches
+
+    async def get(self):
+        query = normalise_query(self.get_argument("q", ""))
+        if not query:
+            self.set_status(400)
+            self.write({"code": "NO_QUERY", "message": "Missing search query"})
+            return
+
+        body = await self.searches.search(query, self._search_library)
+        self.set_header("Content-Type", "application/json")
+        self.write(body)
+
+    async def _search_library(self, query):
+        return await self._resolve(
+            self.core.library.search(query={"any": [query]}, exact=False)
+        )
+
+
+class StatsHandler(PiboxHandler):
+    def initialize(self, core, frontend, images=None, searches=None):
+        super(StatsHandler, self).initialize(core, frontend)
+        self.images = images
+        self.searches = searches
+
+    async def get(self):
+        stats = await self._resolve(self.frontend.get_stats())
+        stats["webSocket"] = socket.PiboxWebSocket.stats()
+        if self.images is not None:
+            stats["images"] = self.images.stats()
+        if self.searches is not None:
+            stats["search"] = self.searches.stats()
+        self.set_header("Content-Type", "application/json")
+        self.write(stats)
+
+
 class ConfigHandler(tornado.web.RequestHandler):
     def initialize(self, config: config.Proxy):
         self.config = config
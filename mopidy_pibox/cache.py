@@ -0,0 +1,197 @@
+from collections import OrderedDict
+import json
+import logging
+import sqlite3
+import time
+
+from mopidy.models import ModelJSONEncoder, model_json_decoder
+
+_MISSING = object()
+
+
+class LRUCache:
+    """In-memory cache with optional size bound and expiry.
+
+    Entries are evicted least-recently-used first once ``maxsize`` is
+    reached, and treated as missing once older than ``ttl`` seconds. Either
+    limit may be None to disable it. Hit and miss counts are kept so callers
+    can report how effective the cache is.
+    """
+
+    def __init__(self, maxsize=None, ttl=None, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl or None
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        # mapping key -> (stored_at, value)
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self._lookup(key) is not _MISSING
+
+    def get(self, key, default=None):
+        value = self._lookup(key)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value, stored_at=None):
+        if stored_at is None:
+            stored_at = self.clock()
+        self._entries[key] = (stored_at, value)
+        self._entries.move_to_end(key)
+        if self.maxsize is not None:
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": (self.hits / lookups) if lookups else None,
+        }
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+        stored_at, value = entry
+        if self.ttl is not None and self.clock() - stored_at > self.ttl:
+            del self._entries[key]
+            return _MISSING
+        return value
+
+
+class PersistentCache:
+    """LRUCache in front of an SQLite table, so entries survive restarts.
+
+    Values must be JSON serialisable; Mopidy models are supported. Lookups
+    are answered from memory first, and the keys missing there are read
+    from disk in one query and promoted; writes go to both. Entries older
+    than ``ttl`` seconds are treated as missing in either. Each write also
+    deletes expired rows and all but the ``maxsize`` most recently stored,
+    so the table stays bounded. Without a ``path`` it behaves as a plain
+    in-memory cache.
+    """
+
+    def __init__(self, path=None, maxsize=None, ttl=None, clock=time.time):
+        # wall clock time, so expiry still holds across restarts
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl, clock=clock)
+        self.maxsize = maxsize
+        self.ttl = ttl or None
+        self.clock = clock
+        self.disk_hits = 0
+        self.logger = logging.getLogger(__name__)
+        self._db = None
+        if path is not None:
+            try:
+                self._db = sqlite3.connect(str(path), check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS cache "
+                    "(key TEXT PRIMARY KEY, stored_at REAL, value TEXT)"
+                )
+                self._db.execute(
+                    "CREATE INDEX IF NOT EXISTS cache_stored_at ON cache (stored_at)"
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                self.logger.warning(f"Could not open cache {path}, not persisting: {e}")
+                self._db = None
+
+    def get_many(self, keys):
+        """Return ``(found, missing)``: a dict of the cached keys and a list
+        of the others, in the order given."""
+        found = {}
+        unknown = []
+        for key in keys:
+            value = self.memory.get(key, _MISSING)
+            if value is _MISSING:
+                unknown.append(key)
+            else:
+                found[key] = value
+
+        for key, (stored_at, value) in self._read(unknown).items():
+            self.disk_hits += 1
+            self.memory.put(key, value, stored_at=stored_at)
+            found[key] = value
+        return found, [key for key in unknown if key not in found]
+
+    def put_many(self, items):
+        now = self.clock()
+        for key, value in items.items():
+            self.memory.put(key, value, stored_at=now)
+        if self._db is None or not items:
+            return
+        try:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO cache (key, stored_at, value) VALUES (?, ?, ?)",
+                [
+                    (key, now, json.dumps(value, cls=ModelJSONEncoder))
+                    for key, value in items.items()
+                ],
+            )
+            self._evict(now)
+            self._db.commit()
+        except sqlite3.Error as e:
+            self.logger.warning(f"Could not write to cache: {e}")
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def stats(self):
+        return dict(
+            self.memory.stats(),
+            diskHits=self.disk_hits,
+            persistent=self._db is not None,
+        )
+
+    def _evict(self, now):
+        if self.ttl is not None:
+            self._db.execute("DELETE FROM cache WHERE stored_at < ?", (now - self.ttl,))
+        if self.maxsize is not None:
+            self._db.execute(
+                "DELETE FROM cache WHERE key NOT IN "
+                "(SELECT key FROM cache ORDER BY stored_at DESC LIMIT ?)",
+                (self.maxsize,),
+            )
+
+    def _read(self, keys):
+        if self._db is None or not keys:
+            return {}
+        entries = {}
+        try:
+            # stay under SQLite's limit on query parameters
+            for start in range(0, len(keys), 500):
+                chunk = keys[start : start + 500]
+                rows = self._db.execute(
+                    "SELECT key, stored_at, value FROM cache WHERE key IN "
+                    f"({', '.join('?' * len(chunk))})",
+                    chunk,
+                )
+                for key, stored_at, value in rows:
+                    if self.ttl is not None and self.clock() - stored_at > self.ttl:
+                        continue
+                    entries[key] = (
+                        stored_at,
+                        json.loads(value, object_hook=model_json_decoder),
+                    )
+        except sqlite3.Error as e:
+            self.logger.warning(f"Could not read from cache: {e}")
+        return entries
@@ -1,16 +1,36 @@
 import pykka
 import logging
-from random import sample, shuffle
+import threading
+import time
 
 from mopidy import core
 
 from mopidy_pibox import Extension
+from mopidy_pibox.cache import LRUCache
+from mopidy_pibox.journal import Journal
 from mopidy_pibox.pibox import Pibox
+from mopidy_pibox.snapshot import TracklistSnapshot
+from mopidy_pibox.socket import PiboxWebSocket
+from mopidy_pibox.state import TracklistMirror
+from mopidy_pibox.tracks import TrackCache
 
 # Default timeout for Mopidy core API calls (in seconds)
 # This prevents blocking indefinitely if Mopidy or a backend stalls
 MOPIDY_CALL_TIMEOUT = 15
 
+# How long to wait for Mopidy to report that playback started before
+# checking on it directly (in seconds)
+PLAYBACK_START_TIMEOUT = 2.0
+
+# How many playlist tracks to try in a row before giving up on queueing or
+# starting playback
+MAX_START_ATTEMPTS = 5
+
+# Tracks whose looked-up metadata is kept, in memory and on disk; see TrackCache
+TRACK_CACHE_SIZE = 2048
+
+LOCAL_LIBRARY = {"name": "Local Library", "uri": "local:directory?type=track"}
+
 PUSSYCAT_LIST = [
     "spotify:track:0asT0RDbe4Vrf6pxLHgpkn",
     "spotify:track:2HkHE4EeZyx9AncSN042q3",
@@ -26,7 +46,15 @@ class PiboxFrontend(pykka.ThreadingActor, core.CoreListener):
         self.logger = logging.getLogger(__name__)
 
         data_dir = Extension.get_data_dir(config)
-        self.pibox = pykka.traversable(Pibox(data_dir=data_dir))
+        # session changes are journalled so a crash or power cut doesn't
+        # lose the party; see on_start
+        journal_flush_ms = self.config.get("journal_flush_ms") or 0
+        self.journal = (
+            Journal(data_dir, flush_interval=journal_flush_ms / 1000)
+            if journal_flush_ms
+            else None
+        )
+        self.pibox = pykka.traversable(Pibox(data_dir=data_dir, journal=self.journal))
 
         # apply vote limit config if provided
         try:
@@ -43,45 +71,121 @@ class PiboxFrontend(pykka.ThreadingActor, core.CoreListener):
         except Exception:
             pass
 
+        # hidden look-ahead track kept at the end of the tracklist so Mopidy
+        # can move on to it without a gap; see __prequeue_next_track
+        self.lookahead = bool(self.config.get("lookahead", False))
+        self.prequeued_tl_track = None
+        self.prequeued_entry = None
+
+        # pending confirmation that playback started; see __start_playing
+        self.start_token = 0
+        self.start_attempt = 0
+        self.start_timer = None
+
+        # background availability probe of the upcoming playlist tracks; see
+        # __probe_upcoming_tracks
+        self.probe_depth = self.config.get("probe_depth") or 0
+        self.probe_in_flight = False
+        self.probed_uris = set()
+        self.probe_stats = {
+            "batches": 0,
+            "probed": 0,
+            "unavailable": 0,
+            "picks": 0,
+            "probedPicks": 0,
+        }
+
+        # playlist item refs keyed by playlist URI; invalidated by the
+        # playlist_changed / playlists_loaded core events
+        self.playlist_items_cache = LRUCache(
+            ttl=self.config.get("playlist_cache_ttl")
+        )
+
+        # track metadata shared by the suggestion and probe lookups, kept on
+        # disk so a restart starts warm
+        self.track_cache = TrackCache(
+            core,
+            path=data_dir / "pibox-tracks.sqlite",
+            maxsize=TRACK_CACHE_SIZE,
+            ttl=self.config.get("track_cache_ttl"),
+            timeout=MOPIDY_CALL_TIMEOUT,
+        )
+        # the URIs drawn for the next suggestions request; see get_suggestions
+        self.next_suggestions = []
+
         self.core.tracklist.set_consume(value=True)
 
+        # local copy of the tracklist, refreshed on tracklist_changed, so
+        # queue queries don't each need a core round trip
+        self.tracklist = TracklistMirror()
+        self.__sync_tracklist()
+
+        # queue view shared by all users, rebuilt when the tracklist, the
+        # votes or the look-ahead track change; see __tracklist_snapshot
+        self.votes_version = 0
+        self.tracklist_version = 0
+        self.tracklist_snapshot = None
+        self.tracklist_snapshot_key = None
+        self.snapshot_builds = 0
+        # last snapshot version pushed to registered WebSocket clients
+        self.pushed_tracklist_version = None
+        self.tracklist_pushes = 0
+
+        # last known playback position, broadcast on the pibox socket so
+        # progress bars can extrapolate locally instead of polling core; see
+        # __broadcast_position
+        self.position_heartbeat_ms = self.config.get("position_heartbeat_ms") or 0
+        self.playback_position = None
+        self.position_anchored_at = None
+        self.position_timer = None
+        self.position_broadcasts = 0
+
+        self.pibox.restore()
+
+    def on_start(self):
+        if self.pibox.started and len(self.tracklist) == 0:
+            # a restored session: carry on from where the play order was
+            self.logger.info("Resuming restored Pibox session")
+            self.__requeue_restored_tracks()
+            if len(self.tracklist) > 0 or self.__queue_song_from_session_playlists():
+                self.__start_playing()
+            self.__push_tracklist_views()
+
     def start_session(self, skip_threshold, playlists, auto_start, shuffle):
         self.pibox.start_session(skip_threshold, playlists, shuffle)
-        if auto_start:
-            self.__queue_song_from_session_playlists()
+        self.votes_version += 1
+        self.pibox.set_playlist_items(self.__get_session_playlist_items())
+        self.probed_uris.clear()
+        if auto_start and self.__queue_song_from_session_playlists():
             self.__start_playing()
+        else:
+            self.__probe_upcoming_tracks()
+        self.__push_tracklist_views()
 
     def update_session_playlists(self, playlists):
         """Update the selected playlists during an active session.
-        
-        This recalculates the remaining playlist tracks based on the new
-        playlists while preserving played_tracks and denylist state.
+
+        Only newly added playlists are fetched; tracks of removed playlists
+        are dropped from the session play order in place, so the shuffle
+        position and attribution of unchanged playlists are preserved along
+        with played_tracks and denylist state.
         """
-        self.pibox.update_playlists(playlists)
-        
-        # Recalculate remaining playlist tracks with new playlist selection
-        # This uses the same logic as __queue_song_from_session_playlists
-        # but only updates the remaining_playlist_tracks list
-        playlist_items = self.__get_session_playlist_items()
-        
-        if self.pibox.shuffle:
-            shuffle(playlist_items)
-        
-        seen = set()
-        remaining_playlist = [
-            ref
-            for (ref, playlist_name) in playlist_items
-            if (
-                self.__can_play(ref.uri)
-                and ref.uri not in seen
-                and not seen.add(ref.uri)
-            )
-        ]
-        
-        self.__update_remaining_playlist_tracks(remaining_playlist)
-        
+        old_uris = {playlist["uri"] for playlist in self.pibox.playlists}
+        if not self.pibox.update_playlists(playlists):
+            return
+
+        if not self.config.get("offline", False):
+            new_uris = {playlist["uri"] for playlist in playlists}
+            for uri in old_uris - new_uris:
+                self.pibox.remove_playlist_items(uri)
+
+            added = [playlist for playlist in playlists if playlist["uri"] not in old_uris]
+            items = self.__fetch_playlist_items(added)
+            for playlist in added:
+                self.pibox.add_playlist_items(playlist, items.get(playlist["uri"], []))
+
         self.logger.info(
-            f"Updated session playlists. {len(remaining_playlist)} tracks remaining."
+            f"Updated session playlists. {len(self.pibox.remaining_playlist_tracks)} tracks remaining."
         )
 
     def track_playback_ended(self, tl_track, time_position=None):
@@ -93,9 +197,14 @@ class PiboxFrontend(pykka.ThreadingActor, core.CoreListener):
         # to play (e.g., unavailable on Tidal). However, don't treat quick manual
         # skips as failures - only auto-transitions. We detect this by checking
         # if there are still tracks in the tracklist (manual skip leaves queue intact).
+        # with consume enabled core drops the ended track from the tracklist,
+        # but its tracklist_changed event may not have reached us yet
+        if tl_track and tl_track.track:
+            self.tracklist.discard(tl_track)
+
         is_playback_failure = False
         track_length = getattr(tl_track.track, 'length', None) if tl_track and tl_track.track else None
-        tracklist_len = self.core.tracklist.get_length().get(timeout=MOPIDY_CALL_TIMEOUT)
+        tracklist_len = self.__queued_length()
         
         if time_position is not None and time_position < 2000 and tracklist_len == 0:
             # Track barely played AND tracklist is empty = automatic failure, not manual skip
@@ -108,7 +217,7 @@ class PiboxFrontend(pykka.ThreadingActor, core.CoreListener):
                 # Add to denylist so we don't try it again
                 try:
                     if tl_track.track.uri not in self.pibox.denylist:
-                        self.pibox.denylist.append(tl_track.track.uri)
+                        self.pibox.add_to_denylist(tl_track.track.uri)
                         self.logger.info(f"Added {tl_track.track.uri} to denylist")
                 except Exception:
                     pass
@@ -118,12 +227,14 @@ class PiboxFrontend(pykka.ThreadingActor, core.CoreListener):
             self.__update_played_tracks(tl_track)
 
         if self.__should_play_whats_new_pussycat(tl_track):
-            self.core.tracklist.add(uris=[self.pussycat_list[0]], at_position=0).get(timeout=MOPIDY_CALL_TIMEOUT)
+            self.__withdraw_prequeued_track()
+            self.__add_to_tracklist([self.pussycat_list[0]], at_position=0)
             self.logger.info("Meow")
             self.__start_playing()
-        elif self.core.tracklist.get_length().get(timeout=MOPIDY_CALL_TIMEOUT) == 0:
-            self.__queue_song_from_session_playlists()
-            self.__start_playing()
+        elif len(self.tracklist) == 0:
+            self.prequeued_tl_track = self.prequeued_entry = None
+            if self.__queue_song_from_session_playlists():
+                self.__start_playing()
 
     def track_playback_started(self, tl_track, time_position=None):
         try:
@@ -131,32 +242,210 @@ class PiboxFrontend(pykka.ThreadingActor, core.CoreListener):
         except Exception:
             uri = None
         self.logger.info(f"Track playback started: {uri}")
+        self.__confirm_playback_started()
+
+        if self.__is_prequeued(tl_track):
+            # the look-ahead track is now playing, so it is no longer hidden
+            self.prequeued_tl_track = self.prequeued_entry = None
+        if uri not in self.pussycat_list:
+            self.__prequeue_next_track()
+        self.__push_tracklist_views()
+        self.__broadcast_position(core.PlaybackState.PLAYING, time_position or 0, uri)
+
+    def track_playback_paused(self, tl_track, time_position):
+        self.__broadcast_position(
+            core.PlaybackState.PAUSED, time_position, tl_track.track.uri
+        )
+
+    def track_playback_resumed(self, tl_track, time_position):
+        self.__broadcast_position(
+            core.PlaybackState.PLAYING, time_position, tl_track.track.uri
+        )
+
+    def seeked(self, time_position):
+        if self.playback_position is None:
+            return
+        self.__broadcast_position(
+            self.playback_position["state"],
+            time_position,
+            self.playback_position["uri"],
+        )
+
+    def tracklist_changed(self):
+        self.__sync_tracklist()
+        self.__push_tracklist_views()
 
     def playback_state_changed(self, old_state, new_state):
         self.logger.info(f"Playback state changed: {old_state} -> {new_state}")
+        if new_state == core.PlaybackState.PLAYING:
+            self.__confirm_playback_started()
+        elif new_state == core.PlaybackState.STOPPED:
+            self.__broadcast_position(core.PlaybackState.STOPPED, 0, None)
+
+    def on_stop(self):
+        self.__cancel_start_timer()
+        self.__cancel_position_timer()
+        self.track_cache.close()
+        if self.journal is not None:
+            self.journal.close()
+
+    def get_playback_position(self):
+        """Return the last known position, extrapolated to now, or None.
+
+        Sent to each client as it connects so its progress bar starts in
+        the right place without asking core.
+        """
+        if self.playback_position is None:
+            return None
+        position = self.playback_position["position"]
+        if self.playback_position["state"] == core.PlaybackState.PLAYING:
+            position += (time.monotonic() - self.position_anchored_at) * 1000
+        return dict(self.playback_position, position=int(position))
+
+    def check_playback_position(self):
+        """Re-anchor the broadcast position from core.
+
+        Called from the position timer thread through the actor proxy every
+        position_heartbeat_ms while playing, so clients correct any drift.
+        Costs one core call per interval however many clients are connected.
+        """
+        self.position_timer = None
+        if not PiboxWebSocket.clients:
+            self.__schedule_position_heartbeat()
+            return
+        state = self.core.playback.get_state().get(timeout=MOPIDY_CALL_TIMEOUT)
+        position = self.core.playback.get_time_position().get(
+            timeout=MOPIDY_CALL_TIMEOUT
+        )
+        uri = self.playback_position["uri"] if self.playback_position else None
+        self.__broadcast_position(state, position or 0, uri)
+
+    def check_playback_started(self, token):
+        """Check on playback when no start event followed a play() in time.
+
+        Called from the start timer thread through the actor proxy. If
+        playback stopped and the tracklist emptied, the track failed to load
+        (e.g., ManifestDecodeError from Tidal), so the next playlist track
+        is tried, up to MAX_START_ATTEMPTS tracks in a row.
+        """
+        if token != self.start_token or not self.start_attempt:
+            return
+        attempt = self.start_attempt
+        self.start_attempt = 0
+        self.start_timer = None
+
+        if not self.pibox.started:
+            return
+
+        state = self.core.playback.get_state().get(timeout=MOPIDY_CALL_TIMEOUT)
+        if state != core.PlaybackState.STOPPED or self.__queued_length() > 0:
+            return
+
+        if attempt >= MAX_START_ATTEMPTS:
+            self.logger.error(f"Playback failed to start after {attempt} tracks. Giving up.")
+            return
+
+        self.logger.warning(
+            f"Playback failed to start (track may be unavailable). Trying next track "
+            f"(attempt {attempt + 1}/{MAX_START_ATTEMPTS})."
+        )
+        if self.__queue_song_from_session_playlists():
+            self.__start_playing(attempt + 1)
+
+    def apply_probe_results(self, uris, results):
+        """Record the outcome of a background lookup of upcoming tracks.
+
+        Called from the probe thread through the actor proxy. Tracks that
+        resolve to nothing are denylisted so they are never queued. If the
+        lookup itself failed, ``results`` is None and nothing is changed.
+        """
+        self.probe_in_flight = False
+        if results is None:
+            return
+        self.track_cache.put_many(results)
+        if not self.pibox.started:
+            return
+
+        unavailable = []
+        for uri in uris:
+            if results.get(uri):
+                self.probed_uris.add(uri)
+            else:
+                self.pibox.add_to_denylist(uri)
+                unavailable.append(uri)
+
+        self.probe_stats["batches"] += 1
+        self.probe_stats["probed"] += len(uris)
+        self.probe_stats["unavailable"] += len(unavailable)
+        for uri in unavailable:
+            self.logger.info(f"Added {uri} to denylist (unavailable)")
+        self.logger.info(
+            f"Probed {len(uris)} upcoming tracks (depth {self.probe_depth}): "
+            f"{len(unavailable)} unavailable, hit rate {self.__probe_hit_rate()}"
+        )
+
+    def playlist_changed(self, playlist):
+        self.playlist_items_cache.invalidate(playlist.uri)
+
+    def playlists_loaded(self):
+        self.playlist_items_cache.clear()
+
+    def get_stats(self):
+        picks = self.probe_stats["picks"]
+        return {
+            "playlistCache": self.playlist_items_cache.stats(),
+            "suggestions": dict(
+                self.track_cache.stats(),
+                indexed=len(self.pibox.suggestions),
+            ),
+            "tracklistSnapshot": {
+                "version": self.tracklist_version,
+                "builds": self.snapshot_builds,
+                "pushes": self.tracklist_pushes,
+            },
+            "playbackPosition": {
+                "broadcasts": self.position_broadcasts,
+                "heartbeatMs": self.position_heartbeat_ms,
+            },
+            "journal": self.journal.stats() if self.journal is not None else None,
+            "probe": dict(
+                self.probe_stats,
+                depth=self.probe_depth,
+                hitRate=(self.probe_stats["probedPicks"] / picks) if picks else None,
+            ),
+        }
 
     def get_queued_tracks(self, user_fingerprint):
-        tracks = self.core.tracklist.get_tracks().get(timeout=MOPIDY_CALL_TIMEOUT)
-        result = []
-        for track in tracks:
-            try:
-                votes = self.pibox.get_votes_for_track(track)
-            except Exception:
-                votes = 0
-            try:
-                voted = self.pibox.has_user_voted_on_track(user_fingerprint, track)
-            except Exception:
-                voted = False
-            # determine if this track was manually added by this user
-            try:
-                user_list = self.pibox.user_queued_tracks.get(user_fingerprint, [])
-            except Exception:
-                user_list = []
-            added_by_me = track.uri in user_list
-            result.append({"info": track, "votes": votes, "voted": voted, "added_by_me": added_by_me})
+        has_voted, owned_uris = self.__user_overlay(user_fingerprint)
+        return self.__tracklist_snapshot().items_for(has_voted, owned_uris)
+
+    def get_tracklist_view(self, user_fingerprint, action=None, track_uri=None):
+        """Apply an optional queue change and return the user's view of the queue.
+
+        ``action`` is "add" or "remove" for ``track_uri``, or None to only
+        read. Handling the change and reading the result in one actor
+        message means the returned tracklist always reflects the change,
+        and the tracklist endpoints need a single round trip.
+
+        The view is returned as an encoded JSON body. The tracklist part is
+        encoded once per tracklist version and shared by all users; only
+        their own voted / added_by_me flags and cooldown are added here.
+        """
+        error = None
+        if action == "add":
+            (_success, error) = self.add_track_to_queue(track_uri, user_fingerprint)
+        elif action == "remove":
+            (_success, error) = self.remove_user_added_track(user_fingerprint, track_uri)
+
+        if action is not None:
+            self.__push_tracklist_views()
+        return self.__encode_tracklist_view(self.__tracklist_snapshot(), user_fingerprint, error)
+
+    def push_tracklist_view(self, user_fingerprint):
+        """Send one user their current view of the queue over the WebSocket."""
+        view = self.__encode_tracklist_view(self.__tracklist_snapshot(), user_fingerprint)
+        PiboxWebSocket.send_to_users("TRACKLIST_UPDATED", {user_fingerprint: view})
 
-        return result
-    
     def add_track_to_queue(self, track_uri, user_fingerprint=None):
         if track_uri in self.pibox.played_tracks:
             return (False, "ALREADY_PLAYED")
@@ -174,9 +463,20 @@ class PiboxFrontend(pykka.ThreadingActor, core.CoreListener):
             # On error, fall back to allowing the add
             pass
 
-        self.core.tracklist.add(uris=[track_uri]).get(timeout=MOPIDY_CALL_TIMEOUT)
+        replaces_prequeued = (
+            self.prequeued_tl_track is not None
+            and self.prequeued_tl_track.track.uri == track_uri
+        )
+        if replaces_prequeued:
+            # the user asked for the hidden look-ahead track; queue it in
+            # their name instead and look ahead to the one after
+            self.__withdraw_prequeued_track(return_to_pool=False)
+
+        self.__add_to_tracklist([track_uri], at_position=self.__prequeued_position())
+        if replaces_prequeued:
+            self.__prequeue_next_track()
         try:
-            self.pibox.manually_queued_tracks.append(track_uri)
+            self.pibox.add_manually_queued_track(track_uri)
             # Track the source as user-queued with their fun nickname
             if user_fingerprint:
                 nickname = self.pibox.get_user_nickname(user_fingerprint)
@@ -188,17 +488,12 @@ class PiboxFrontend(pykka.ThreadingActor, core.CoreListener):
 
     def remove_user_added_track(self, user_fingerprint, track_uri):
         """Remove a track from the queue if it was added by the given user."""
-        try:
-            user_list = self.pibox.user_queued_tracks.get(user_fingerprint, [])
-        except Exception:
-            user_list = []
-
-        if track_uri not in user_list:
+        if not self.pibox.has_user_queued_track(user_fingerprint, track_uri):
             return (False, "NOT_OWNER")
 
         # remove from core tracklist
         try:
-            self.core.tracklist.remove({"uri": [track_uri]}).get(timeout=MOPIDY_CALL_TIMEOUT)
+            self.__remove_from_tracklist({"uri": [track_uri]})
         except Exception:
             pass
 
@@ -213,21 +508,29 @@ class PiboxFrontend(pykka.ThreadingActor, core.CoreListener):
 
     def add_vote_for_user_on_queued_track(self, user_fingerprint, track):
         vote_count = self.pibox.add_vote_for_user_on_track(user_fingerprint, track)
+        self.votes_version += 1
         self.logger.info(
             f"Vote added for {track.uri} by {user_fingerprint} ({vote_count}/{self.pibox.skip_threshold})"
         )
         if vote_count >= self.pibox.skip_threshold:
             self.logger.info(f"Skipping {track.uri} due to votes")
-            self.core.tracklist.remove({"uri": [track.uri]}).get(timeout=MOPIDY_CALL_TIMEOUT)
+            self.__remove_from_tracklist({"uri": [track.uri]})
 
             self.logger.info("Track removed from tracklist")
             self.pibox.skip_queued_track(track)
+        self.__push_tracklist_views()
 
     def end_session(self):
+        self.__cancel_start_timer()
+        self.prequeued_tl_track = self.prequeued_entry = None
+        self.probed_uris.clear()
         self.core.playback.stop()
         self.core.tracklist.clear()
+        self.tracklist.clear()
 
         self.pibox.end_session()
+        self.votes_version += 1
+        self.__push_tracklist_views()
 
         # Refresh playlists so new ones are available for the next session
         self._refresh_playlists()
@@ -242,126 +545,476 @@ class PiboxFrontend(pykka.ThreadingActor, core.CoreListener):
             self.logger.warning(f"Failed to refresh playlists: {e}")
 
     def get_suggestions(self, length):
-        suggestions = self.pibox.get_suggestions()
+        """Suggest up to ``length`` unplayed, unqueued tracks from history.
 
-        unqueued_suggestions = [
-            track for track in suggestions if not self.__is_queued(track)
-        ]
-        size = (
-            len(unqueued_suggestions) if len(unqueued_suggestions) < length else length
+        Tracks are drawn from the session's suggestion index, weighted by
+        how often and how recently they were requested. The tracks for the
+        next request are drawn straight away and looked up in the
+        background, so a request is usually answered from the suggestion
+        track cache without waiting on a backend.
+        """
+        uris = [uri for uri in self.next_suggestions if self.__can_suggest(uri)]
+        uris = uris[:length]
+        if len(uris) < length:
+            uris += self.pibox.sample_suggestions(
+                length - len(uris),
+                lambda uri: self.__can_suggest(uri) and uri not in uris,
+            )
+
+        tracks = self.track_cache.get_many(uris)
+        for uri in uris:
+            if not tracks.get(uri):
+                self.pibox.suggestions.discard(uri)
+        suggestions = [track for uri in uris for track in tracks.get(uri, [])]
+
+        self.next_suggestions = self.pibox.sample_suggestions(
+            length, lambda uri: self.__can_suggest(uri) and uri not in uris
         )
-        unplayed_tracks = [
-            track
-            for tracks in self.core.library.lookup(sample(unqueued_suggestions, size))
-            .get()
-            .values()
-            for track in tracks
-        ]
+        self.__prefetch_suggestion_tracks(self.next_suggestions)
+        return suggestions
 
-        return unplayed_tracks
+    def cache_suggestion_tracks(self, results):
+        """Keep the tracks looked up for suggested URIs.
+
+        Also called from the prefetch thread through the actor proxy. URIs
+        that resolve to nothing are dropped from the suggestion index.
+        """
+        for uri, tracks in self.track_cache.put_many(results).items():
+            if not tracks:
+                self.pibox.suggestions.discard(uri)
+
+    def __can_suggest(self, uri):
+        return uri in self.pibox.suggestions and not self.__is_queued(uri)
+
+    def __prefetch_suggestion_tracks(self, uris):
+        _, missing = self.track_cache.cached(uris)
+        if not missing:
+            return
+        future = self.track_cache.lookup(missing)
+        thread = threading.Thread(
+            target=self.__wait_for_suggestion_tracks, args=(future,), daemon=True
+        )
+        thread.start()
+
+    def __wait_for_suggestion_tracks(self, future):
+        # runs on the prefetch thread, so hand the result over to the actor
+        try:
+            results = future.get(timeout=MOPIDY_CALL_TIMEOUT)
+        except Exception as e:
+            self.logger.warning(f"Failed to look up suggested tracks: {e}")
+            return
+        try:
+            self.actor_ref.proxy().cache_suggestion_tracks(results)
+        except pykka.ActorDeadError:
+            pass
 
     def __queue_song_from_session_playlists(self):
         self.logger.info("Pibox is trying to queue a song")
 
-        # playlist_items is now list of tuples: (track_ref, playlist_name)
-        playlist_items = self.__get_session_playlist_items()
+        for _attempt in range(MAX_START_ATTEMPTS):
+            entry = self.pibox.next_playlist_track()
 
-        if self.pibox.shuffle:
-            shuffle(playlist_items)
+            if entry is None:
+                self.logger.info("No more tracks to play")
+                self.end_session()
+                return False
 
-        seen = set()
+            # Add the next track in the session play order. If it fails to
+            # play (e.g., unavailable on Tidal), track_playback_ended will
+            # handle it by adding it to the denylist and trying again.
+            next_track, source_playlist = entry
+            self.__record_pick(next_track.uri)
 
-        remaining_playlist = [
-            (ref, playlist_name)
-            for (ref, playlist_name) in playlist_items
-            if (
-                self.__can_play(ref.uri)
-                and ref.uri not in seen
-                and not seen.add(ref.uri)
-            )
-        ]
-        # Update remaining tracks (just the refs for compatibility)
-        self.__update_remaining_playlist_tracks([ref for (ref, _) in remaining_playlist])
-
-        if len(remaining_playlist) == 0:
-            self.logger.info("No more tracks to play")
-            self.end_session()
+            try:
+                self.__add_to_tracklist([next_track.uri], at_position=0)
+                # Track the source playlist for this track
+                self.pibox.set_track_source(next_track.uri, "playlist", source_playlist)
+                self.logger.info(f"Pibox auto-added {next_track.name} ({next_track.uri}) from '{source_playlist}' to tracklist")
+                self.__probe_upcoming_tracks()
+                return True
+            except Exception as e:
+                self.logger.warning(f"Failed to add {next_track.uri} to tracklist: {e}")
+                # Add to denylist and try next track
+                self.pibox.add_to_denylist(next_track.uri)
+
+        self.logger.error(f"Failed to queue any of the next {MAX_START_ATTEMPTS} playlist tracks")
+        return False
+
+    def __requeue_restored_tracks(self):
+        """Put the tracks users had queued back on core's tracklist.
+
+        The crash emptied the tracklist but the restored session still
+        counts these tracks against their owners' queue limits. Any that
+        can't be added again are dropped along with their votes.
+        """
+        uris = list(self.pibox.manually_queued_tracks)
+        uris.extend(
+            uri
+            for uri in self.pibox.queue_ownership.by_uri
+            if uri not in self.pibox.manually_queued_tracks
+        )
+        if not uris:
             return
 
-        # Add the first available track. If it fails to play (e.g., unavailable
-        # on Tidal), track_playback_ended will handle it by adding it to the
-        # denylist and trying again.
-        next_track, source_playlist = remaining_playlist[0]
-
         try:
-            self.core.tracklist.add(uris=[next_track.uri], at_position=0).get(timeout=MOPIDY_CALL_TIMEOUT)
-            # Track the source playlist for this track
-            self.pibox.set_track_source(next_track.uri, "playlist", source_playlist)
-            self.logger.info(f"Pibox auto-added {next_track.name} ({next_track.uri}) from '{source_playlist}' to tracklist")
+            added = {tl_track.track.uri for tl_track in self.__add_to_tracklist(uris)}
         except Exception as e:
-            self.logger.warning(f"Failed to add {next_track.uri} to tracklist: {e}")
-            # Add to denylist and try next track
-            if next_track.uri not in self.pibox.denylist:
-                self.pibox.denylist.append(next_track.uri)
-            # Recursively try next track
-            self.__queue_song_from_session_playlists()
+            self.logger.warning(f"Failed to requeue restored tracks: {e}")
+            added = set()
+        for uri in uris:
+            if uri not in added:
+                self.logger.info(f"Dropping restored queued track {uri}")
+                self.pibox.remove_queued_track(uri)
 
     def __get_session_playlist_items(self):
         """Get all tracks from session playlists with their source playlist info.
         
-        Returns list of tuples: (track_ref, playlist_name)
+        Returns list of tuples: (track_ref, playlist)
         """
         if self.config.get("offline", False):
-            tracks = self.core.library.browse(uri="local:directory?type=track").get(timeout=MOPIDY_CALL_TIMEOUT)
-            return [(track, "Local Library") for track in tracks]
+            tracks = self.core.library.browse(uri=LOCAL_LIBRARY["uri"]).get(timeout=MOPIDY_CALL_TIMEOUT)
+            return [(track, LOCAL_LIBRARY) for track in tracks]
         else:
+            items = self.__fetch_playlist_items(self.pibox.playlists)
             result = []
             for playlist in self.pibox.playlists:
-                tracks = self.core.playlists.get_items(playlist["uri"]).get(timeout=MOPIDY_CALL_TIMEOUT)
-                for track in tracks:
-                    result.append((track, playlist["name"]))
+                for track in items.get(playlist["uri"], []):
+                    result.append((track, playlist))
             return result
 
+    def __fetch_playlist_items(self, playlists):
+        """Get the item refs of several playlists, keyed by playlist URI.
+
+        Playlists missing from the cache are all requested at once and
+        gathered against a single shared deadline, so however many are slow
+        the wait is bounded by one MOPIDY_CALL_TIMEOUT. Core blocks on each
+        backend call, so it still fetches the playlists one after another;
+        those not fetched, or failed, by the deadline are skipped with a
+        warning.
+        """
+        items = {}
+        futures = {}
+        for playlist in playlists:
+            uri = playlist["uri"]
+            if uri in items or uri in futures:
+                continue
+            tracks = self.playlist_items_cache.get(uri)
+            if tracks is None:
+                futures[uri] = self.core.playlists.get_items(uri)
+            else:
+                items[uri] = tracks
+
+        deadline = time.monotonic() + MOPIDY_CALL_TIMEOUT
+        for uri, future in futures.items():
+            try:
+                tracks = future.get(timeout=max(0, deadline - time.monotonic()))
+            except pykka.Timeout:
+                self.logger.warning(f"Timed out fetching playlist {uri}; skipping it")
+                continue
+            except Exception as e:
+                self.logger.warning(f"Failed to fetch playlist {uri}; skipping it: {e}")
+                continue
+            if tracks is None:
+                self.logger.warning(f"Playlist {uri} not found; skipping it")
+                continue
+            self.playlist_items_cache.put(uri, tracks)
+            items[uri] = tracks
+
+        return items
+
+    def __sync_tracklist(self):
+        self.tracklist.refresh(
+            self.core.tracklist.get_tl_tracks().get(timeout=MOPIDY_CALL_TIMEOUT)
+        )
+
+    def __tracklist_snapshot(self):
+        """Return the shared queue view, rebuilding it if anything changed."""
+        prequeued_tlid = self.prequeued_tl_track.tlid if self.prequeued_tl_track else None
+        key = (self.tracklist.version, self.votes_version, prequeued_tlid)
+        if self.tracklist_snapshot is not None and key == self.tracklist_snapshot_key:
+            return self.tracklist_snapshot
+
+        entries = []
+        for tl_track in self.tracklist:
+            if self.__is_prequeued(tl_track):
+                continue
+            try:
+                votes = self.pibox.get_votes_for_track(tl_track.track)
+            except Exception:
+                votes = 0
+            entries.append((tl_track.track, votes))
+
+        self.tracklist_version += 1
+        self.tracklist_snapshot = TracklistSnapshot(self.tracklist_version, entries)
+        self.tracklist_snapshot_key = key
+        self.snapshot_builds += 1
+        return self.tracklist_snapshot
+
+    def __encode_tracklist_view(self, snapshot, user_fingerprint, error=None):
+        try:
+            retry_seconds = self.pibox.get_vote_cooldown_seconds(user_fingerprint)
+        except Exception:
+            retry_seconds = None
+
+        has_voted, owned_uris = self.__user_overlay(user_fingerprint)
+        return snapshot.encode_view(
+            has_voted, owned_uris, error=error, retry_after_seconds=retry_seconds
+        )
+
+    def __push_tracklist_views(self):
+        """Push every registered user their new view of the queue.
+
+        The shared snapshot is built at most once per change however many
+        clients are connected; each user only costs an overlay. Nothing is
+        sent if the snapshot has not changed since the last push.
+        """
+        fingerprints = PiboxWebSocket.registered_fingerprints()
+        if not fingerprints:
+            return
+        snapshot = self.__tracklist_snapshot()
+        if snapshot.version == self.pushed_tracklist_version:
+            return
+        self.pushed_tracklist_version = snapshot.version
+        self.tracklist_pushes += 1
+        PiboxWebSocket.send_to_users(
+            "TRACKLIST_UPDATED",
+            {
+                fingerprint: self.__encode_tracklist_view(snapshot, fingerprint)
+                for fingerprint in fingerprints
+            },
+        )
+
+    def __user_overlay(self, user_fingerprint):
+        """The per-user parts of the queue view: a voted check and owned URIs."""
+        def has_voted(track):
+            try:
+                return self.pibox.has_user_voted_on_track(user_fingerprint, track)
+            except Exception:
+                return False
+
+        # determine which tracks were manually added by this user
+        owned_uris = self.pibox.queue_ownership.tracks(user_fingerprint)
+        return has_voted, owned_uris
+
+    def __add_to_tracklist(self, uris, at_position=None):
+        tl_tracks = self.core.tracklist.add(uris=uris, at_position=at_position).get(timeout=MOPIDY_CALL_TIMEOUT)
+        self.tracklist.add(tl_tracks, at_position)
+        return tl_tracks
+
+    def __remove_from_tracklist(self, criteria):
+        tl_tracks = self.core.tracklist.remove(criteria).get(timeout=MOPIDY_CALL_TIMEOUT)
+        self.tracklist.remove(tl_tracks)
+        return tl_tracks
+
     def __update_played_tracks(self, tl_track):
-        self.pibox.played_tracks.append(tl_track.track.uri)
+        self.pibox.add_played_track(tl_track.track.uri)
         # Remove the played track from any user's manual queue entries
         try:
             self.pibox.remove_queued_track_for_all_users(tl_track.track.uri)
         except Exception:
             pass
 
-    def __update_remaining_playlist_tracks(self, remaining_playlist):
-        self.pibox.remaining_playlist_tracks = [
-            track.uri for track in remaining_playlist
+    def __is_queued(self, uri):
+        count = self.tracklist.count(uri)
+        if self.prequeued_tl_track is not None and self.prequeued_tl_track.track.uri == uri:
+            count -= 1
+        return count > 0
+
+    def __is_prequeued(self, tl_track):
+        return (
+            self.prequeued_tl_track is not None
+            and tl_track is not None
+            and tl_track.tlid == self.prequeued_tl_track.tlid
+        )
+
+    def __queued_length(self):
+        """Length of the tracklist, not counting the hidden look-ahead track."""
+        length = len(self.tracklist)
+        if self.prequeued_tl_track is not None:
+            length -= 1
+        return max(length, 0)
+
+    def __prequeued_position(self):
+        """Tracklist index user tracks are added at, ahead of the look-ahead track."""
+        if self.prequeued_tl_track is None:
+            return None
+        return self.tracklist.index(self.prequeued_tl_track.tlid)
+
+    def __prequeue_next_track(self):
+        """Queue the next playlist track behind everything else, hidden from users.
+
+        With the next track already in the tracklist when the current one
+        finishes, Mopidy moves on to it without waiting for pibox to react
+        to track_playback_ended. User-queued tracks are added ahead of it.
+        """
+        if not self.lookahead or not self.pibox.started or self.prequeued_tl_track is not None:
+            return
+
+        entry = self.pibox.next_playlist_track()
+        if entry is None:
+            return
+
+        next_track, source_playlist = entry
+        self.__record_pick(next_track.uri)
+        try:
+            tl_tracks = self.__add_to_tracklist([next_track.uri])
+        except Exception as e:
+            self.logger.warning(f"Failed to prequeue {next_track.uri}: {e}")
+            tl_tracks = []
+        if not tl_tracks:
+            self.pibox.add_to_denylist(next_track.uri)
+            return
+
+        self.prequeued_tl_track = tl_tracks[0]
+        self.prequeued_entry = entry
+        self.pibox.set_track_source(next_track.uri, "playlist", source_playlist)
+        self.logger.info(f"Pibox prequeued {next_track.name} ({next_track.uri}) from '{source_playlist}'")
+        self.__probe_upcoming_tracks()
+
+    def __record_pick(self, uri):
+        self.probe_stats["picks"] += 1
+        if uri in self.probed_uris:
+            self.probe_stats["probedPicks"] += 1
+            self.probed_uris.discard(uri)
+
+    def __probe_hit_rate(self):
+        picks = self.probe_stats["picks"]
+        if not picks:
+            return "n/a"
+        return f"{self.probe_stats['probedPicks'] / picks:.0%}"
+
+    def __probe_upcoming_tracks(self):
+        """Look up the next few playlist tracks ahead of time.
+
+        The next ``probe_depth`` unprobed tracks in the play order are
+        resolved in one batched library lookup. The lookup is waited on
+        from a background thread so the actor is free meanwhile, and the
+        result is handed back through apply_probe_results. Only one probe
+        runs at a time.
+        """
+        if not self.probe_depth or self.probe_in_flight or not self.pibox.started:
+            return
+
+        uris = [
+            ref.uri
+            for ref in self.pibox.upcoming_playlist_tracks(self.probe_depth)
+            if ref.uri not in self.probed_uris
         ]
+        # tracks resolved recently, e.g. before a restart, need no lookup
+        cached, uris = self.track_cache.cached(uris)
+        self.probed_uris.update(uri for uri, tracks in cached.items() if tracks)
+        if not uris:
+            return
 
-    def __can_play(self, uri):
-        return (uri not in self.pibox.played_tracks) and (
-            uri not in self.pibox.denylist
+        self.probe_in_flight = True
+        future = self.track_cache.lookup(uris)
+        thread = threading.Thread(
+            target=self.__wait_for_probe, args=(uris, future), daemon=True
         )
+        thread.start()
 
-    def __is_queued(self, uri):
-        return self.core.tracklist.filter({"uri": [uri]}).get(timeout=MOPIDY_CALL_TIMEOUT) != []
+    def __wait_for_probe(self, uris, future):
+        # runs on the probe thread, so hand the result over to the actor
+        try:
+            results = future.get(timeout=MOPIDY_CALL_TIMEOUT)
+        except Exception as e:
+            self.logger.warning(f"Failed to probe upcoming tracks: {e}")
+            results = None
+        try:
+            self.actor_ref.proxy().apply_probe_results(uris, results)
+        except pykka.ActorDeadError:
+            pass
+
+    def __withdraw_prequeued_track(self, return_to_pool=True):
+        """Take the look-ahead track out of the tracklist.
+
+        Unless ``return_to_pool`` is False it goes back into the play order
+        as the next track to be picked.
+        """
+        if self.prequeued_tl_track is None:
+            return
 
-    def __start_playing(self):
+        tl_track, entry = self.prequeued_tl_track, self.prequeued_entry
+        self.prequeued_tl_track = self.prequeued_entry = None
+        try:
+            self.__remove_from_tracklist({"tlid": [tl_track.tlid]})
+        except Exception as e:
+            self.logger.warning(f"Failed to remove prequeued track {tl_track.track.uri}: {e}")
+        if return_to_pool:
+            self.pibox.return_playlist_track(entry)
+
+    def __start_playing(self, attempt=1):
         if self.core.playback.get_state().get(timeout=MOPIDY_CALL_TIMEOUT) == core.PlaybackState.STOPPED:
             self.core.playback.play().get(timeout=MOPIDY_CALL_TIMEOUT)
             self.logger.info("Pibox started playback")
-            
-            # Check if playback actually started - tracks can fail to load
-            # (e.g., ManifestDecodeError from Tidal) and get removed from
-            # tracklist before playback begins. In that case, try next track.
-            import time
-            time.sleep(0.3)  # Brief delay to let Mopidy process the play command
-            
-            state = self.core.playback.get_state().get(timeout=MOPIDY_CALL_TIMEOUT)
-            tracklist_len = self.core.tracklist.get_length().get(timeout=MOPIDY_CALL_TIMEOUT)
-            
-            if state == core.PlaybackState.STOPPED and tracklist_len == 0:
-                self.logger.warning("Playback failed to start (track may be unavailable). Trying next track.")
-                self.__queue_song_from_session_playlists()
-                self.__start_playing()
+
+            # Tracks can fail to load (e.g., ManifestDecodeError from Tidal)
+            # and get removed from the tracklist before playback begins.
+            # Rather than block the actor waiting to find out, playback is
+            # confirmed by track_playback_started / playback_state_changed,
+            # with a timer to check on it if neither arrives in time.
+            self.__cancel_start_timer()
+            self.start_token += 1
+            self.start_attempt = attempt
+            self.start_timer = threading.Timer(
+                PLAYBACK_START_TIMEOUT, self.__on_start_timer, args=(self.start_token,)
+            )
+            self.start_timer.daemon = True
+            self.start_timer.start()
+
+    def __on_start_timer(self, token):
+        # runs on the timer thread, so hand the check over to the actor
+        try:
+            self.actor_ref.proxy().check_playback_started(token)
+        except pykka.ActorDeadError:
+            pass
+
+    def __confirm_playback_started(self):
+        self.__cancel_start_timer()
+        self.start_attempt = 0
+
+    def __cancel_start_timer(self):
+        if self.start_timer is not None:
+            self.start_timer.cancel()
+            self.start_timer = None
+
+    def __broadcast_position(self, state, position, uri):
+        self.playback_position = {
+            "state": state,
+            "position": int(position),
+            "uri": uri,
+        }
+        self.position_anchored_at = time.monotonic()
+        self.position_broadcasts += 1
+        # sent straight away: clients extrapolate from when it arrives
+        PiboxWebSocket.send("PLAYBACK_POSITION", self.playback_position, immediate=True)
+        self.__schedule_position_heartbeat()
+
+    def __schedule_position_heartbeat(self):
+        self.__cancel_position_timer()
+        if (
+            not self.position_heartbeat_ms
+            or self.playback_position is None
+            or self.playback_position["state"] != core.PlaybackState.PLAYING
+        ):
+            return
+        self.position_timer = threading.Timer(
+            self.position_heartbeat_ms / 1000, self.__on_position_timer
+        )
+        self.position_timer.daemon = True
+        self.position_timer.start()
+
+    def __on_position_timer(self):
+        # runs on the timer thread, so hand the check over to the actor
+        try:
+            self.actor_ref.proxy().check_playback_position()
+        except pykka.ActorDeadError:
+            pass
+
+    def __cancel_position_timer(self):
+        if self.position_timer is not None:
+            self.position_timer.cancel()
+            self.position_timer = None
 
     def __should_play_whats_new_pussycat(self, tl_track):
-        tracklist = self.core.tracklist.get_tracks().get(timeout=MOPIDY_CALL_TIMEOUT)
-        return tl_track.track.uri in self.pussycat_list and len(tracklist) == 0
+        return tl_track.track.uri in self.pussycat_list and self.__queued_length() == 0
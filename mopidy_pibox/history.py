@@ -0,0 +1,172 @@
+import json
+import logging
+import os
+import threading
+import time
+
+HISTORY_FILE = "pibox-history.jsonl"
+LEGACY_HISTORY_FILE = "pibox-queue-history.json"
+
+# Compact once the log holds this many times more lines than there are
+# distinct tracks (and at least MIN_COMPACT_LINES lines)
+COMPACT_RATIO = 2
+MIN_COMPACT_LINES = 1000
+
+# Days after which a past request counts half as much towards suggestions
+RECENCY_HALF_LIFE_DAYS = 90
+
+
+class HistoryStore:
+    """Every track requested at past parties, with how often and when.
+
+    Held in memory as one record per URI and persisted in the data dir as
+    an append-only JSON lines log of ``[uri, count, last_requested_at]``:
+    ending a session appends one line per track requested in it, and a
+    line's count is added to the record on load. Once the log has grown
+    well past one line per track it is compacted to exactly that in the
+    background. A legacy ``pibox-queue-history.json`` list is migrated on
+    first load.
+    """
+
+    def __init__(self, data_dir, clock=time.time):
+        self.path = data_dir.joinpath(HISTORY_FILE)
+        self.legacy_path = data_dir.joinpath(LEGACY_HISTORY_FILE)
+        self.clock = clock
+        self.logger = logging.getLogger(__name__)
+        # mapping uri -> (request_count, last_requested_at), oldest first
+        self.records = {}
+        # lines in the log file, compared with len(records) to decide when
+        # to compact
+        self.log_lines = 0
+        self.compactions = 0
+        self.compacting = None
+        # serialises changes to the records and the log between the actor
+        # and compaction
+        self._lock = threading.Lock()
+        self.load()
+
+    def __contains__(self, uri):
+        return uri in self.records
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def count(self, uri):
+        return self.records.get(uri, (0, None))[0]
+
+    def last_requested(self, uri):
+        return self.records.get(uri, (0, None))[1]
+
+    def weights(self):
+        """Yield ``(uri, weight)`` for suggesting each track.
+
+        A track's weight is its request count, halved for every
+        RECENCY_HALF_LIFE_DAYS since it was last requested.
+        """
+        now = self.clock()
+        half_life = RECENCY_HALF_LIFE_DAYS * 24 * 60 * 60
+        for uri, (count, last) in self.records.items():
+            age = max(0, now - last)
+            yield uri, count * 0.5 ** (age / half_life)
+
+    def load(self):
+        self.records = {}
+        self.log_lines = 0
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        uri, count, last = json.loads(line)
+                    except (TypeError, ValueError):
+                        # a line cut short by a crash mid-append
+                        continue
+                    self.__apply(uri, count, last)
+                    self.log_lines += 1
+        except FileNotFoundError:
+            self.__migrate_legacy_history()
+
+    def record(self, uris):
+        """Add a request for each of ``uris`` and append them to the log."""
+        now = int(self.clock())
+        counts = {}
+        for uri in uris:
+            counts[uri] = counts.get(uri, 0) + 1
+        if not counts:
+            return
+
+        with self._lock:
+            lines = []
+            for uri, count in counts.items():
+                self.__apply(uri, count, now)
+                lines.append(json.dumps([uri, count, now]))
+            with open(self.path, "a") as f:
+                f.write("\n".join(lines) + "\n")
+            self.log_lines += len(lines)
+
+        if self.__needs_compaction():
+            self.compact_in_background()
+
+    def compact_in_background(self):
+        if self.compacting is not None and self.compacting.is_alive():
+            return
+        self.compacting = threading.Thread(
+            target=self.compact, name="pibox-history-compact", daemon=True
+        )
+        self.compacting.start()
+
+    def compact(self):
+        """Rewrite the log with a single line per track.
+
+        Returns False if the log could not be written.
+        """
+        with self._lock:
+            records = list(self.records.items())
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            try:
+                with open(tmp_path, "w") as f:
+                    for uri, (count, last) in records:
+                        f.write(json.dumps([uri, count, last]))
+                        f.write("\n")
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                self.logger.warning(f"Failed to compact queue history: {e}")
+                return False
+            self.log_lines = len(records)
+            self.compactions += 1
+        self.logger.info(f"Compacted queue history to {len(records)} tracks")
+        return True
+
+    def __apply(self, uri, count, last):
+        previous_count, previous_last = self.records.get(uri, (0, None))
+        if previous_last is not None and previous_last > last:
+            last = previous_last
+        self.records[uri] = (previous_count + count, last)
+
+    def __needs_compaction(self):
+        return self.log_lines >= max(
+            MIN_COMPACT_LINES, COMPACT_RATIO * len(self.records)
+        )
+
+    def __migrate_legacy_history(self):
+        try:
+            with open(self.legacy_path) as f:
+                uris = json.load(f)
+            last = int(os.path.getmtime(self.legacy_path))
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            self.logger.warning(f"Could not read legacy queue history: {e}")
+            return
+
+        for uri in uris:
+            self.__apply(uri, 1, last)
+        if not self.compact():
+            # keep the legacy file to migrate from again next time
+            return
+        os.replace(self.legacy_path, self.legacy_path.with_suffix(".json.migrated"))
+        self.logger.info(
+            f"Migrated {len(uris)} queue history entries to {len(self.records)} tracks"
+        )
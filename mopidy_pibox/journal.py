@@ -0,0 +1,187 @@
+import json
+import logging
+import os
+import threading
+
+from mopidy.models import ModelJSONEncoder, model_json_decoder
+
+JOURNAL_FILE = "pibox-session.journal"
+SNAPSHOT_FILE = "pibox-session.json"
+
+# Replace the journal with a fresh snapshot once it holds this many entries
+SNAPSHOT_EVERY = 500
+
+
+class Journal:
+    """Write-ahead log of the changes made to a running session.
+
+    Pibox appends an entry for every change to its session state, and
+    writes a snapshot of the whole state when the play order is rebuilt or
+    the journal has grown to SNAPSHOT_EVERY entries; the journal is
+    truncated each time. After a crash or power cut the session is the
+    last snapshot with the journal replayed on top.
+
+    Entries are buffered and written in one batch at most every
+    ``flush_interval`` seconds, each batch followed by a single fsync, so
+    a busy party costs the SD card a bounded number of small writes. The
+    journal's first line names the snapshot generation it belongs to, so a
+    journal left over from before a snapshot is never replayed onto it.
+    """
+
+    def __init__(self, data_dir, flush_interval=2.0):
+        self.path = data_dir.joinpath(JOURNAL_FILE)
+        self.snapshot_path = data_dir.joinpath(SNAPSHOT_FILE)
+        self.flush_interval = flush_interval
+        self.logger = logging.getLogger(__name__)
+        self.generation = 0
+        # encoded entries not yet written
+        self.pending = []
+        # entries since the last snapshot
+        self.entries = 0
+        self.flushes = 0
+        self.snapshots = 0
+        self.flush_timer = None
+        # serialises the actor's appends and snapshots with timed flushes
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Read back ``(state, entries)``.
+
+        ``state`` is the last snapshot, or None if there is none, and
+        ``entries`` the ``[op, *args]`` lists journalled since.
+        """
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f, object_hook=model_json_decoder)
+        except FileNotFoundError:
+            return None, []
+        except ValueError as e:
+            self.logger.warning(f"Could not read session snapshot: {e}")
+            return None, []
+
+        self.generation = snapshot["generation"]
+        entries = []
+        try:
+            with open(self.path) as f:
+                header = self.__decode(f.readline())
+                if header == {"generation": self.generation}:
+                    for line in f:
+                        entry = self.__decode(line)
+                        if entry is None:
+                            # a line cut short by a crash mid-append
+                            break
+                        entries.append(entry)
+        except FileNotFoundError:
+            pass
+        self.entries = len(entries)
+        return snapshot["state"], entries
+
+    def append(self, op, *args):
+        with self._lock:
+            self.pending.append(json.dumps([op, *args]))
+            self.entries += 1
+            if self.flush_interval <= 0:
+                self.__flush()
+            elif self.flush_timer is None:
+                self.flush_timer = threading.Timer(self.flush_interval, self.flush)
+                self.flush_timer.daemon = True
+                self.flush_timer.start()
+
+    def needs_snapshot(self):
+        return self.entries >= SNAPSHOT_EVERY
+
+    def flush(self):
+        """Write and fsync the buffered entries."""
+        with self._lock:
+            self.flush_timer = None
+            self.__flush()
+
+    def snapshot(self, state):
+        """Replace the snapshot with ``state`` and empty the journal.
+
+        Buffered entries are dropped, as ``state`` already includes them.
+        """
+        with self._lock:
+            self.__cancel_flush_timer()
+            self.pending = []
+            generation = self.generation + 1
+            tmp_path = self.snapshot_path.with_name(self.snapshot_path.name + ".tmp")
+            try:
+                with open(tmp_path, "w") as f:
+                    json.dump(
+                        {"generation": generation, "state": state},
+                        f,
+                        cls=ModelJSONEncoder,
+                    )
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.snapshot_path)
+                with open(self.path, "w") as f:
+                    self.__write_header(f, generation)
+                    f.flush()
+                    os.fsync(f.fileno())
+            except OSError as e:
+                self.logger.warning(f"Failed to write session snapshot: {e}")
+                return
+            self.generation = generation
+            self.entries = 0
+            self.snapshots += 1
+
+    def clear(self):
+        """Forget the session, e.g. once it has ended."""
+        with self._lock:
+            self.__cancel_flush_timer()
+            self.pending = []
+            self.entries = 0
+            for path in (self.snapshot_path, self.path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    self.logger.warning(f"Failed to remove {path}: {e}")
+
+    def close(self):
+        with self._lock:
+            self.__cancel_flush_timer()
+            self.__flush()
+
+    def stats(self):
+        return {
+            "generation": self.generation,
+            "entries": self.entries,
+            "pending": len(self.pending),
+            "flushes": self.flushes,
+            "snapshots": self.snapshots,
+        }
+
+    def __flush(self):
+        if not self.pending:
+            return
+        lines, self.pending = self.pending, []
+        try:
+            with open(self.path, "a") as f:
+                if f.tell() == 0:
+                    self.__write_header(f, self.generation)
+                f.write("\n".join(lines) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError as e:
+            self.logger.warning(f"Failed to write session journal: {e}")
+            return
+        self.flushes += 1
+
+    def __write_header(self, f, generation):
+        f.write(json.dumps({"generation": generation}) + "\n")
+
+    def __cancel_flush_timer(self):
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+
+    @staticmethod
+    def __decode(line):
+        try:
+            return json.loads(line)
+        except ValueError:
+            return None
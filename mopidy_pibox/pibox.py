@@ -1,7 +1,16 @@
 from datetime import datetime, timezone, timedelta
-import json
 import logging
 import random
+import time
+
+from .history import HistoryStore
+from .state import (
+    OrderedSet,
+    PlaylistPool,
+    QueueOwnership,
+    SessionState,
+    SuggestionIndex,
+)
 
 
 # Word lists for generating fun nautical user nicknames
@@ -192,10 +201,14 @@ NOUNS = [
 ]
 
 class Pibox:
-    def __init__(self, data_dir):
+    def __init__(self, data_dir, journal=None):
         super().__init__()
         self.data_dir = data_dir
-        self.queued_history = []
+        # write-ahead log of session changes, so a crashed session can be
+        # restored; see restore
+        self.journal = journal
+        # loaded once here rather than on every start_session
+        self.history = HistoryStore(data_dir)
         # vote limits: defaults (can be overridden by frontend when creating Pibox)
         self.vote_limit_count = 2
         self.vote_limit_minutes = 60
@@ -204,6 +217,90 @@ class Pibox:
 
         self.logger = logging.getLogger(__name__)
 
+    @property
+    def queued_history(self):
+        return list(self.history)
+
+    @property
+    def played_tracks(self):
+        return self.state.played_tracks
+
+    @played_tracks.setter
+    def played_tracks(self, uris):
+        self.state.played_tracks = OrderedSet(uris)
+
+    @property
+    def denylist(self):
+        return self.state.denylist
+
+    @denylist.setter
+    def denylist(self, uris):
+        self.state.denylist = OrderedSet(uris)
+
+    @property
+    def manually_queued_tracks(self):
+        return self.state.manually_queued_tracks
+
+    @manually_queued_tracks.setter
+    def manually_queued_tracks(self, uris):
+        self.state.manually_queued_tracks = OrderedSet(uris)
+
+    @property
+    def user_queued_tracks(self):
+        """Mapping fingerprint -> list of the URIs that user queued."""
+        return self.queue_ownership.to_json()
+
+    @user_queued_tracks.setter
+    def user_queued_tracks(self, tracks_by_user):
+        self.queue_ownership = QueueOwnership(tracks_by_user)
+
+    @property
+    def has_voted(self):
+        return self.state.has_voted
+
+    @property
+    def remaining_playlist_tracks(self):
+        return self.pool.remaining(self.can_play)
+
+    def can_play(self, uri):
+        return self.state.can_play(uri)
+
+    def set_playlist_items(self, playlist_items):
+        """Build the session play order from ``(track_ref, playlist)`` tuples."""
+        self.pool = PlaylistPool(playlist_items, shuffle_items=self.shuffle)
+        self.checkpoint()
+
+    def upcoming_playlist_tracks(self, count):
+        """Peek at the next ``count`` playable tracks in the play order."""
+        return self.pool.upcoming(count, self.can_play)
+
+    def return_playlist_track(self, entry):
+        """Put a track taken with next_playlist_track back at the cursor."""
+        if self.pool.push_back(entry):
+            self.checkpoint()
+        else:
+            self.__log("cursor", self.pool.cursor)
+
+    def add_playlist_items(self, playlist, track_refs):
+        """Merge a newly selected playlist into the session play order."""
+        self.pool.add_playlist(playlist, track_refs)
+        self.checkpoint()
+
+    def remove_playlist_items(self, playlist_uri):
+        """Drop a deselected playlist's tracks from the session play order."""
+        self.pool.remove_playlist(playlist_uri)
+        self.checkpoint()
+
+    def next_playlist_track(self):
+        """Advance the play order to the next playable track.
+
+        Returns a ``(track_ref, playlist_name)`` tuple, or None once the
+        session playlists are exhausted.
+        """
+        entry = self.pool.next_entry(self.can_play)
+        self.__log("cursor", self.pool.cursor)
+        return entry
+
     def start_session(self, skip_threshold, playlists, shuffle):
         self.started = True
         self.start_time = datetime.now(timezone.utc)
@@ -211,9 +308,10 @@ class Pibox:
         self.skip_threshold = skip_threshold
         self.playlists = playlists
         self.shuffle = shuffle
+        self.suggestions.build(self.history.weights())
+        self.checkpoint()
 
         playlist_names = ",".join([playlist["name"] for playlist in playlists])
-        self.queued_history = self.__load_queued_history()
         self.logger.info(
             f"Started Pibox session with skip threshold {skip_threshold} and {len(playlists)} playlists: {playlist_names}"
         )
@@ -231,7 +329,8 @@ class Pibox:
         new_playlist_names = ",".join([p["name"] for p in playlists])
         
         self.playlists = playlists
-        
+        self.__log("playlists", playlists)
+
         self.logger.info(
             f"Updated Pibox session playlists from [{old_playlist_names}] to [{new_playlist_names}]"
         )
@@ -241,7 +340,7 @@ class Pibox:
         return self.votes.get(track.uri, 0)
 
     def has_user_voted_on_track(self, user_fingerprint, track):
-        return user_fingerprint in self.has_voted.get(track.uri, [])
+        return self.state.has_voted_on(user_fingerprint, track.uri)
 
     def add_vote_for_user_on_track(self, user_fingerprint, track):
         # Enforce per-user rate limit: max `vote_limit_count` votes within `vote_limit_minutes`
@@ -269,15 +368,16 @@ class Pibox:
         timestamps.append(now)
         self.user_vote_times[user_fingerprint] = timestamps
 
-        users_who_voted = self.has_voted.get(track.uri, [])
-        users_who_voted.append(user_fingerprint)
-        self.has_voted[track.uri] = users_who_voted
+        self.__log("vote", user_fingerprint, track.uri, now.isoformat())
+        return self.__add_vote(user_fingerprint, track.uri)
 
-        vote_count = self.votes.get(track.uri, 0) + 1
-        self.votes[track.uri] = vote_count
+    def __add_vote(self, user_fingerprint, track_uri):
+        self.state.add_voter(user_fingerprint, track_uri)
 
-        return vote_count
+        vote_count = self.votes.get(track_uri, 0) + 1
+        self.votes[track_uri] = vote_count
 
+        return vote_count
 
 
     def skip_queued_track(self, track):
@@ -287,11 +387,34 @@ class Pibox:
         # Remove from any user's queued lists when skipping/removing from queue
         self.remove_queued_track_for_all_users(track.uri)
 
-        self.denylist.append(track.uri)
+        self.denylist.add(track.uri)
+        self.__log("skip", track.uri)
+
+    def add_played_track(self, track_uri):
+        self.played_tracks.add(track_uri)
+        self.suggestions.discard(track_uri)
+        self.__log("played", track_uri)
+
+    def add_to_denylist(self, track_uri):
+        self.denylist.add(track_uri)
+        self.__log("deny", track_uri)
+
+    def add_manually_queued_track(self, track_uri):
+        self.manually_queued_tracks.add(track_uri)
+        self.__log("queued", track_uri)
+
+    def sample_suggestions(self, count, can_suggest=None):
+        """Draw up to ``count`` unplayed history tracks, weighted by how
+        often and how recently they were requested."""
+        return self.suggestions.sample(
+            count,
+            lambda uri: uri not in self.played_tracks
+            and (can_suggest is None or can_suggest(uri)),
+        )
 
     def get_suggestions(self):
         unplayed_queue_history = [
-            uri for uri in self.queued_history if uri not in self.played_tracks
+            uri for uri in self.history if uri not in self.played_tracks
         ]
 
         return unplayed_queue_history
@@ -299,6 +422,8 @@ class Pibox:
     def end_session(self):
         self.__save_queued_history()
         self.__initialise()
+        if self.journal is not None:
+            self.journal.clear()
 
         self.logger.info("Ended Pibox session")
 
@@ -308,7 +433,7 @@ class Pibox:
             "startTime": (self.start_time.isoformat() if self.start_time else None),
             "skipThreshold": self.skip_threshold,
             "playlists": self.playlists,
-            "playedTracks": self.played_tracks,
+            "playedTracks": self.played_tracks.to_list(),
             "remainingPlaylistTracks": self.remaining_playlist_tracks,
             "trackSources": self.track_sources,
         }
@@ -329,39 +454,146 @@ class Pibox:
             "type": source_type,
             "name": source_name,
         }
+        self.__log("source", track_uri, source_type, source_name)
+
+    def checkpoint(self):
+        """Snapshot the running session and truncate the journal."""
+        if self.journal is not None and self.started:
+            self.journal.snapshot(self.to_snapshot())
+
+    def to_snapshot(self):
+        return {
+            "startTime": self.start_time.isoformat(),
+            "skipThreshold": self.skip_threshold,
+            "playlists": self.playlists,
+            "shuffle": self.shuffle,
+            "pool": self.pool.to_json(),
+            "playedTracks": self.played_tracks.to_list(),
+            "denylist": self.denylist.to_list(),
+            "manuallyQueuedTracks": self.manually_queued_tracks.to_list(),
+            "votes": self.votes,
+            "hasVoted": {
+                uri: voters.to_list() for uri, voters in self.has_voted.items()
+            },
+            "userVoteTimes": {
+                fingerprint: [t.isoformat() for t in timestamps]
+                for fingerprint, timestamps in self.user_vote_times.items()
+            },
+            "userQueuedTracks": self.user_queued_tracks,
+            "trackSources": self.track_sources,
+        }
+
+    def restore(self):
+        """Bring back the session that was running when pibox last stopped.
 
-    def __load_queued_history(self):
+        Loads the last snapshot and replays the journal on top of it; no
+        backend is asked for anything. Returns True if a session was
+        restored.
+        """
+        if self.journal is None:
+            return False
+        started_at = time.monotonic()
+        state, entries = self.journal.load()
+        if state is None:
+            return False
+
+        journal, self.journal = self.journal, None
         try:
-            with open(self.data_dir.joinpath("pibox-queue-history.json")) as f:
-                history = json.load(f)
-                return history
-        except FileNotFoundError:
-            return []
+            self.__restore_snapshot(state)
+            for op, *args in entries:
+                self.__replay(op, args)
+        finally:
+            self.journal = journal
+        self.suggestions.build(self.history.weights())
+        # fold the replayed entries (and any torn last line) into a snapshot
+        self.checkpoint()
+
+        self.logger.info(
+            f"Restored Pibox session from snapshot and {len(entries)} journal "
+            f"entries in {(time.monotonic() - started_at) * 1000:.1f}ms"
+        )
+        return True
+
+    def __restore_snapshot(self, state):
+        self.started = True
+        self.start_time = datetime.fromisoformat(state["startTime"])
+        self.skip_threshold = state["skipThreshold"]
+        self.playlists = state["playlists"]
+        self.shuffle = state["shuffle"]
+        self.pool = PlaylistPool.from_json(state["pool"])
+        self.state = SessionState(denylist=state["denylist"])
+        self.played_tracks = state["playedTracks"]
+        self.manually_queued_tracks = state["manuallyQueuedTracks"]
+        self.state.has_voted = {
+            uri: OrderedSet(voters) for uri, voters in state["hasVoted"].items()
+        }
+        self.votes = state["votes"]
+        self.user_vote_times = {
+            fingerprint: [datetime.fromisoformat(t) for t in timestamps]
+            for fingerprint, timestamps in state["userVoteTimes"].items()
+        }
+        self.user_queued_tracks = state["userQueuedTracks"]
+        self.track_sources = state["trackSources"]
+
+    def __replay(self, op, args):
+        if op == "cursor":
+            self.pool.cursor = args[0]
+        elif op == "playlists":
+            self.playlists = args[0]
+        elif op == "vote":
+            user_fingerprint, track_uri, voted_at = args
+            self.user_vote_times.setdefault(user_fingerprint, []).append(
+                datetime.fromisoformat(voted_at)
+            )
+            self.__add_vote(user_fingerprint, track_uri)
+        elif op in ("skip", "remove"):
+            # the track was taken off the user queues by an earlier entry
+            self.votes.pop(args[0], None)
+            self.has_voted.pop(args[0], None)
+            if op == "skip":
+                self.denylist.add(args[0])
+        elif op == "played":
+            self.add_played_track(args[0])
+        elif op == "deny":
+            self.add_to_denylist(args[0])
+        elif op == "queued":
+            self.add_manually_queued_track(args[0])
+        elif op == "user_queued":
+            self.add_manually_queued_track_for_user(*args)
+        elif op == "unqueue":
+            self.remove_queued_track_for_all_users(args[0])
+        elif op == "source":
+            self.set_track_source(*args)
+        else:
+            self.logger.warning(f"Ignoring unknown session journal entry {op!r}")
+
+    def __log(self, op, *args):
+        if self.journal is None or not self.started:
+            return
+        self.journal.append(op, *args)
+        if self.journal.needs_snapshot():
+            self.checkpoint()
 
     def __save_queued_history(self):
-        existing_suggestions = self.queued_history
-        suggestions_to_add = [
+        self.history.record(
             uri for uri in self.manually_queued_tracks if uri not in self.denylist
-        ]
-        new_suggestions = existing_suggestions + suggestions_to_add
-        with open(self.data_dir.joinpath("pibox-queue-history.json"), "w+") as f:
-            json.dump(new_suggestions, f)
+        )
 
     def __initialise(self):
         self.started = False
         self.start_time = None
         self.skip_threshold = 1
         self.playlists = []
-        self.denylist = ["spotify:track:0afhq8XCExXpqazXczTSve"]
-        self.played_tracks = []
-        self.manually_queued_tracks = []
-        self.remaining_playlist_tracks = []
+        self.shuffle = True
+        self.pool = PlaylistPool()
+        # built from the queue history when a session starts
+        self.suggestions = SuggestionIndex()
+        self.state = SessionState(denylist=["spotify:track:0afhq8XCExXpqazXczTSve"])
         self.votes = {}
-        self.has_voted = {}
         # mapping fingerprint -> list[datetime] of recent vote timestamps
         self.user_vote_times = {}
-        # mapping fingerprint -> list[uris] of manually queued tracks for that user
-        self.user_queued_tracks = {}
+        # manually queued tracks by user and users by track
+        self.queue_ownership = QueueOwnership()
         # per-user queue limit (0 = unlimited)
         self.queue_limit_per_user = 0
         # mapping fingerprint -> fun nickname
@@ -383,34 +615,25 @@ class Pibox:
             pass
 
     def get_user_queue_count(self, user_fingerprint):
-        return len(self.user_queued_tracks.get(user_fingerprint, []))
+        return self.queue_ownership.count(user_fingerprint)
+
+    def has_user_queued_track(self, user_fingerprint, track_uri):
+        return self.queue_ownership.owns(user_fingerprint, track_uri)
 
     def add_manually_queued_track_for_user(self, user_fingerprint, track_uri):
         # Enforce per-user manual queue limit if configured (>0)
         if self.queue_limit_per_user and self.get_user_queue_count(user_fingerprint) >= self.queue_limit_per_user:
             return False
-        lst = self.user_queued_tracks.get(user_fingerprint, [])
-        lst.append(track_uri)
-        self.user_queued_tracks[user_fingerprint] = lst
+        self.queue_ownership.add(user_fingerprint, track_uri)
+        self.__log("user_queued", user_fingerprint, track_uri)
         return True
 
     def remove_queued_track_for_all_users(self, track_uri):
         # Remove the track from any user's manual queue lists
-        for user, lst in list(self.user_queued_tracks.items()):
-            if track_uri in lst:
-                try:
-                    lst = [u for u in lst if u != track_uri]
-                    if lst:
-                        self.user_queued_tracks[user] = lst
-                    else:
-                        del self.user_queued_tracks[user]
-                except Exception:
-                    pass
-        # Also remove from the flat manually_queued_tracks list if present
-        try:
-            self.manually_queued_tracks = [u for u in self.manually_queued_tracks if u != track_uri]
-        except Exception:
-            pass
+        self.queue_ownership.discard_track(track_uri)
+        # Also remove from the flat manually_queued_tracks set if present
+        self.manually_queued_tracks.discard(track_uri)
+        self.__log("unqueue", track_uri)
 
     def remove_queued_track(self, track_uri):
         """
@@ -430,6 +653,7 @@ class Pibox:
 
         # Remove from user-specific queued lists and the flat manually_queued_tracks list
         self.remove_queued_track_for_all_users(track_uri)
+        self.__log("remove", track_uri)
 
     def get_vote_cooldown_seconds(self, user_fingerprint):
         """
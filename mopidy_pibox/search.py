@@ -0,0 +1,78 @@
+import asyncio
+import json
+
+from mopidy.models import ModelJSONEncoder
+
+from mopidy_pibox.cache import LRUCache
+
+# Backends whose results are listed first, in this order; others follow
+BACKEND_PRIORITY_ORDER = ["spotify", "soundcloud"]
+
+
+def normalise_query(terms):
+    """Collapse whitespace and case so equivalent searches share a key."""
+    return " ".join(terms.split()).casefold()
+
+
+def flatten_results(results):
+    """Merge per-backend search results into one list of tracks.
+
+    Results are ordered by BACKEND_PRIORITY_ORDER; backends not in it keep
+    the order core returned them in, after the prioritised ones.
+    """
+
+    def priority(result):
+        backend = result.uri.split(":")[0] if result.uri else ""
+        if backend in BACKEND_PRIORITY_ORDER:
+            return BACKEND_PRIORITY_ORDER.index(backend)
+        return len(BACKEND_PRIORITY_ORDER)
+
+    return [
+        track
+        for result in sorted(results or [], key=priority)
+        for track in result.tracks
+    ]
+
+
+class SearchCache:
+    """Encoded search results keyed by normalised query.
+
+    Results are kept in a TTL-bounded LRU. Identical searches that arrive
+    while one is already running wait for it rather than querying the
+    backends again. All methods must be called on the IOLoop thread.
+    """
+
+    def __init__(self, maxsize=None, ttl=None):
+        self.results = LRUCache(maxsize=maxsize, ttl=ttl)
+        # mapping query -> task fetching its results
+        self.in_flight = {}
+        self.shared = 0
+
+    async def search(self, query, fetch):
+        """Return the encoded results for ``query``.
+
+        ``fetch`` is a coroutine function taking the query and returning
+        the raw per-backend results; it is only called on a cache miss
+        with no identical search in flight.
+        """
+        body = self.results.get(query)
+        if body is not None:
+            return body
+
+        task = self.in_flight.get(query)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(query, fetch))
+            self.in_flight[query] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(query, None))
+        else:
+            self.shared += 1
+        return await task
+
+    async def _fetch(self, query, fetch):
+        tracks = flatten_results(await fetch(query))
+        body = json.dumps({"tracks": tracks}, cls=ModelJSONEncoder)
+        self.results.put(query, body)
+        return body
+
+    def stats(self):
+        return dict(self.results.stats(), sharedSearches=self.shared)
@@ -0,0 +1,59 @@
+import json
+
+from mopidy.models import ModelJSONEncoder
+
+
+def _encode_bool(value):
+    return "true" if value else "false"
+
+
+class TracklistSnapshot:
+    """The part of the queue view that is the same for every user.
+
+    Built once per tracklist version. Each queued track is encoded to JSON
+    together with its vote count up front, so a user's view only has to
+    splice in their own ``voted`` and ``added_by_me`` flags.
+    """
+
+    def __init__(self, version, entries):
+        self.version = version
+        # list of (track, votes) tuples in queue order
+        self.entries = list(entries)
+        # each entry's JSON object without its closing brace
+        self._encoded = [
+            json.dumps({"info": track, "votes": votes}, cls=ModelJSONEncoder)[:-1]
+            for track, votes in self.entries
+        ]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def items_for(self, has_voted, owned_uris):
+        """Return the user's view of the queue as a list of dicts.
+
+        ``has_voted`` is called with each track; ``owned_uris`` holds the
+        URIs the user queued themselves.
+        """
+        return [
+            {
+                "info": track,
+                "votes": votes,
+                "voted": has_voted(track),
+                "added_by_me": track.uri in owned_uris,
+            }
+            for track, votes in self.entries
+        ]
+
+    def encode_for(self, has_voted, owned_uris):
+        """Encode the user's view of the queue as a JSON array."""
+        items = [
+            f'{encoded}, "voted": {_encode_bool(has_voted(track))}, '
+            f'"added_by_me": {_encode_bool(track.uri in owned_uris)}}}'
+            for encoded, (track, _votes) in zip(self._encoded, self.entries)
+        ]
+        return "[" + ", ".join(items) + "]"
+
+    def encode_view(self, has_voted, owned_uris, **fields):
+        """Encode a response body with the user's queue and extra ``fields``."""
+        head = json.dumps(dict(fields, version=self.version))[:-1]
+        return f'{head}, "tracklist": {self.encode_for(has_voted, owned_uris)}}}'
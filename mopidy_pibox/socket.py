@@ -1,21 +1,97 @@
+from collections import OrderedDict, deque
+import functools
 import logging
 import json
+import time
+import uuid
 
+from mopidy.models import ModelJSONEncoder
+import tornado.ioloop
 import tornado.websocket
 
+# Characters of unsent messages, beyond the largest one, a client may have
+# pending before it is treated as a slow consumer and disconnected
+MAX_OUTBOX_SIZE = 256 * 1024
+
+# How many recent events, and at most how many characters of them, are kept
+# for replay to reconnecting clients
+REPLAY_BUFFER_SIZE = 256
+MAX_REPLAY_BUFFER_CHARS = 512 * 1024
+
+# Seconds to wait for the frontend when a client registers
+FRONTEND_CALL_TIMEOUT = 10
+
+# Events carrying state a client is sent afresh when it registers. They are
+# not numbered or kept for replay, as replaying an old one after RESUME
+# would overwrite the newer state sent on REGISTER, and per-user views would
+# fill the buffer with copies only one client can use.
+STATE_SUBJECTS = frozenset({"PLAYBACK_POSITION", "TRACKLIST_UPDATED"})
+
 
 class PiboxWebSocket(tornado.websocket.WebSocketHandler):
     clients = set()
+    # IOLoop the sockets live on, so other threads can hand writes to it
+    io_loop = None
+    # messages replaced by a newer one of the same type before being sent
+    coalesced_messages = 0
+    # clients disconnected for falling too far behind
+    dropped_clients = 0
+    # server-side heartbeat shared by all clients; see check_clients
+    heartbeat = None
+    pong_timeout = None
+    # clients disconnected for not answering a ping
+    reaped_clients = 0
+    # broadcasts held back to merge bursts of the same type; see send
+    coalesce_window = 0
+    pending_broadcasts = OrderedDict()
+    flush_timeout = None
+    # events merged into a later one of the same type within the window
+    merged_events = 0
+    # sequence number of the last event sent, and the recent events kept
+    # for replay as (seq, subject, messages); see resume. Sequence numbers
+    # restart with the process, so events also carry its epoch.
+    epoch = uuid.uuid4().hex
+    seq = 0
+    replay_buffer = deque()
+    replay_buffer_size = 0
+    replayed_events = 0
+    resyncs = 0
     logger = logging.getLogger(__name__)
 
+    def initialize(
+        self, frontend=None, ping_interval_ms=0, pong_timeout_ms=4000, coalesce_ms=0
+    ):
+        self.frontend = frontend
+        self.ping_interval_ms = ping_interval_ms
+        self.pong_timeout_ms = pong_timeout_ms
+        self.coalesce_ms = coalesce_ms
+        # set when the client sends REGISTER; used for per-user pushes
+        self.fingerprint = None
+        # when the unanswered server ping was sent, if any
+        self.ping_sent_at = None
+        # unsent messages keyed by type, oldest first; see enqueue
+        self.outbox = OrderedDict()
+        self.outbox_size = 0
+        self.draining = False
+
     def check_origin(self, origin):
         return True
 
     def open(self):
+        PiboxWebSocket.io_loop = tornado.ioloop.IOLoop.current()
+        PiboxWebSocket.coalesce_window = self.coalesce_ms / 1000
         self.clients.add(self)
+        if self.ping_interval_ms and PiboxWebSocket.heartbeat is None:
+            self.start_heartbeat(self.ping_interval_ms, self.pong_timeout_ms)
         self.logger.debug("WebSocket opened")
 
-    def on_message(self, message):
+    def on_pong(self, data):
+        self.ping_sent_at = None
+
+    async def on_message(self, message):
+        # any message shows the client is still there
+        self.ping_sent_at = None
+
         # Expect JSON messages from clients; respond to PING with PONG
         try:
             data = json.loads(message)
@@ -32,14 +108,272 @@ class PiboxWebSocket(tornado.websocket.WebSocketHandler):
             except Exception:
                 pass
             return
+        if msg_type == "RESUME":
+            self.resume(data.get("lastSeq"), data.get("epoch"))
+            return
+        if msg_type == "REGISTER":
+            self.fingerprint = data.get("fingerprint") or None
+            if self.frontend is None:
+                return
+            # reply with the user's current view and the playback position;
+            # later changes are pushed
+            if self.fingerprint:
+                self.frontend.push_tracklist_view(self.fingerprint)
+            await self.send_playback_position()
+            return
         # otherwise log at info (useful messages other than PING)
         self.logger.info(message)
 
+    async def send_playback_position(self):
+        """Send this client alone the current playback position.
+
+        It only matters to this connection, so unlike broadcasts it is not
+        numbered or kept for replay.
+        """
+        future = self.frontend.get_playback_position()
+        try:
+            position = await tornado.ioloop.IOLoop.current().run_in_executor(
+                None, functools.partial(future.get, timeout=FRONTEND_CALL_TIMEOUT)
+            )
+        except Exception as e:
+            self.logger.debug(f"Could not get the playback position: {e}")
+            return
+        if position is not None:
+            self.enqueue(
+                "PLAYBACK_POSITION",
+                json.dumps(
+                    {"type": "PLAYBACK_POSITION", "payload": position},
+                    cls=ModelJSONEncoder,
+                ),
+            )
+
     def on_close(self):
-        self.clients.remove(self)
+        self.clients.discard(self)
+        self.outbox.clear()
+        self.outbox_size = 0
         self.logger.debug("WebSocket closed")
 
+    def enqueue(self, subject, message):
+        """Queue an encoded message for this client.
+
+        Every pibox message carries the latest state for its type, so an
+        unsent message is replaced by a newer one of the same type. A
+        client whose pending messages still grow past MAX_OUTBOX_SIZE is
+        disconnected rather than buffered without limit. The largest
+        pending message is not counted, so a single large message (such as
+        the remaining tracks of a big session) never disconnects anyone.
+        """
+        previous = self.outbox.pop(subject, None)
+        if previous is not None:
+            self.outbox_size -= len(previous)
+            PiboxWebSocket.coalesced_messages += 1
+        self.outbox[subject] = message
+        self.outbox_size += len(message)
+
+        if self.__backlog_size() > MAX_OUTBOX_SIZE:
+            self.logger.info("Disconnecting slow WebSocket client")
+            PiboxWebSocket.dropped_clients += 1
+            self.outbox.clear()
+            self.outbox_size = 0
+            self.close()
+            return
+
+        if not self.draining:
+            self.draining = True
+            tornado.ioloop.IOLoop.current().add_callback(self._drain)
+
+    def __backlog_size(self):
+        if len(self.outbox) < 2:
+            return 0
+        return self.outbox_size - max(len(message) for message in self.outbox.values())
+
+    async def _drain(self):
+        try:
+            while self.outbox:
+                _subject, message = self.outbox.popitem(last=False)
+                self.outbox_size -= len(message)
+                # wait for each write to be flushed so a slow client's
+                # backlog stays in the coalescing outbox
+                await self.write_message(message)
+        except tornado.websocket.WebSocketClosedError:
+            self.outbox.clear()
+            self.outbox_size = 0
+        finally:
+            self.draining = False
+
+    def resume(self, last_seq, epoch=None):
+        """Replay the events a reconnecting client missed after ``last_seq``.
+
+        If some of them are no longer in the replay buffer, or ``epoch`` is
+        not this process's (the server restarted since the client's last
+        event), the client is told to RESYNC and refetch everything instead.
+        """
+        oldest_seq = self.replay_buffer[0][0] if self.replay_buffer else self.seq + 1
+        if (
+            epoch != self.epoch
+            or not isinstance(last_seq, int)
+            or last_seq > self.seq
+            or last_seq < oldest_seq - 1
+        ):
+            PiboxWebSocket.resyncs += 1
+            self.enqueue(
+                "RESYNC",
+                json.dumps({"type": "RESYNC", "epoch": self.epoch, "seq": self.seq}),
+            )
+            return
+
+        for seq, subject, messages in self.replay_buffer:
+            if seq <= last_seq:
+                continue
+            message = messages.get(self.fingerprint, messages.get(None))
+            if message is not None:
+                PiboxWebSocket.replayed_events += 1
+                self.enqueue(subject, message)
+
     @classmethod
-    def send(cls, subject, message):
-        for conn in cls.clients:
-            conn.write_message({"type": subject, "payload": message})
+    def start_heartbeat(cls, ping_interval_ms, pong_timeout_ms):
+        """Ping every client each ``ping_interval_ms`` on the current IOLoop."""
+        cls.stop_heartbeat()
+        cls.pong_timeout = pong_timeout_ms / 1000
+        cls.heartbeat = tornado.ioloop.PeriodicCallback(
+            cls.check_clients, ping_interval_ms
+        )
+        cls.heartbeat.start()
+
+    @classmethod
+    def stop_heartbeat(cls):
+        if cls.heartbeat is not None:
+            cls.heartbeat.stop()
+            cls.heartbeat = None
+
+    @classmethod
+    def check_clients(cls):
+        """Reap clients that missed their last ping and ping the rest.
+
+        Phones that leave without closing the socket cleanly stop answering,
+        so they are closed here instead of being written to forever.
+        """
+        now = time.monotonic()
+        for conn in list(cls.clients):
+            if conn.ping_sent_at is not None:
+                if now - conn.ping_sent_at >= cls.pong_timeout:
+                    cls.logger.info("Closing unresponsive WebSocket client")
+                    cls.reaped_clients += 1
+                    cls.clients.discard(conn)
+                    conn.close()
+                continue
+            try:
+                conn.ping()
+                conn.ping_sent_at = now
+            except tornado.websocket.WebSocketClosedError:
+                cls.clients.discard(conn)
+
+    @classmethod
+    def stats(cls):
+        return {
+            "clients": len(cls.clients),
+            "coalescedMessages": cls.coalesced_messages,
+            "droppedClients": cls.dropped_clients,
+            "reapedClients": cls.reaped_clients,
+            "mergedEvents": cls.merged_events,
+            "seq": cls.seq,
+            "replayedEvents": cls.replayed_events,
+            "replayBufferSize": cls.replay_buffer_size,
+            "resyncs": cls.resyncs,
+        }
+
+    @classmethod
+    def send(cls, subject, message, immediate=False):
+        """Broadcast ``message`` to every client.
+
+        The message is encoded once for all clients. Broadcasts are held
+        for the coalescing window, and a burst of the same type within it
+        goes out once with the latest message. ``immediate`` skips the
+        window, sending anything already held first to keep the order.
+        Safe to call from any thread; the writes happen on the IOLoop.
+        """
+        if cls.io_loop is None or not cls.clients:
+            return
+        payload = json.dumps(message, cls=ModelJSONEncoder)
+        cls.io_loop.add_callback(
+            cls._queue_broadcast, subject, {None: payload}, immediate
+        )
+
+    @classmethod
+    def _queue_broadcast(cls, subject, payloads, immediate=False):
+        if immediate or not cls.coalesce_window:
+            cls.flush_broadcasts()
+            cls._write(subject, payloads)
+            return
+
+        pending = cls.pending_broadcasts.pop(subject, None)
+        if pending is not None:
+            cls.merged_events += 1
+            # a per-user push only replaces the held payloads of its users
+            if None not in payloads:
+                payloads = {**pending, **payloads}
+        cls.pending_broadcasts[subject] = payloads
+
+        if cls.flush_timeout is None:
+            cls.flush_timeout = cls.io_loop.call_later(
+                cls.coalesce_window, cls.flush_broadcasts
+            )
+
+    @classmethod
+    def flush_broadcasts(cls):
+        """Send all held broadcasts now."""
+        if cls.flush_timeout is not None:
+            cls.io_loop.remove_timeout(cls.flush_timeout)
+            cls.flush_timeout = None
+        pending, cls.pending_broadcasts = cls.pending_broadcasts, OrderedDict()
+        for subject, payloads in pending.items():
+            cls._write(subject, payloads)
+
+    @classmethod
+    def _write(cls, subject, payloads):
+        # ``payloads`` maps user fingerprints, or None for every client, to
+        # encoded payloads. Each event gets the next sequence number and is
+        # kept for replay, apart from the STATE_SUBJECTS.
+        if subject in STATE_SUBJECTS:
+            head = f'{{"type": {json.dumps(subject)}, "payload": '
+        else:
+            cls.seq += 1
+            head = (
+                f'{{"type": {json.dumps(subject)}, "epoch": "{cls.epoch}", '
+                f'"seq": {cls.seq}, "payload": '
+            )
+        messages = {key: f"{head}{payload}}}" for key, payload in payloads.items()}
+        if subject not in STATE_SUBJECTS:
+            cls.__keep_for_replay(subject, messages)
+
+        for conn in list(cls.clients):
+            message = messages.get(conn.fingerprint, messages.get(None))
+            if message is not None:
+                conn.enqueue(subject, message)
+
+    @classmethod
+    def __keep_for_replay(cls, subject, messages):
+        """Buffer an event, dropping the oldest beyond the buffer's limits."""
+        cls.replay_buffer.append((cls.seq, subject, messages))
+        cls.replay_buffer_size += sum(len(message) for message in messages.values())
+        while cls.replay_buffer and (
+            len(cls.replay_buffer) > REPLAY_BUFFER_SIZE
+            or cls.replay_buffer_size > MAX_REPLAY_BUFFER_CHARS
+        ):
+            _seq, _subject, dropped = cls.replay_buffer.popleft()
+            cls.replay_buffer_size -= sum(len(message) for message in dropped.values())
+
+    @classmethod
+    def registered_fingerprints(cls):
+        return {conn.fingerprint for conn in list(cls.clients) if conn.fingerprint}
+
+    @classmethod
+    def send_to_users(cls, subject, payloads):
+        """Send each registered client its own pre-encoded JSON payload.
+
+        ``payloads`` maps user fingerprint to an encoded payload. Safe to
+        call from any thread; the writes happen on the IOLoop.
+        """
+        if cls.io_loop is None or not payloads:
+            return
+        cls.io_loop.add_callback(cls._queue_broadcast, subject, dict(payloads))
@@ -0,0 +1,485 @@
+from collections import Counter
+from collections.abc import MutableSet
+import random
+
+
+class OrderedSet(MutableSet):
+    """A set that remembers insertion order.
+
+    Backed by a dict, so membership tests and removals are O(1) while
+    iteration still yields items in the order they were first added.
+    """
+
+    def __init__(self, iterable=()):
+        self._items = dict.fromkeys(iterable)
+
+    def __contains__(self, item):
+        return item in self._items
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __reversed__(self):
+        return reversed(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __eq__(self, other):
+        if isinstance(other, (OrderedSet, list, tuple)):
+            return list(self) == list(other)
+        if isinstance(other, (set, frozenset)):
+            return set(self._items) == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({list(self._items)!r})"
+
+    def add(self, item):
+        self._items[item] = None
+
+    # list-style alias so existing ``.append(uri)`` call sites keep working
+    append = add
+
+    def discard(self, item):
+        self._items.pop(item, None)
+
+    def clear(self):
+        self._items.clear()
+
+    def to_list(self):
+        return list(self._items)
+
+
+class SessionState:
+    """Indexed per-session collections used on every track change.
+
+    Play history, the denylist and manually queued tracks are kept as
+    ordered sets so membership checks are O(1) while their order is still
+    available for serialising. Voters are tracked per track URI.
+    """
+
+    def __init__(self, denylist=()):
+        self.played_tracks = OrderedSet()
+        self.denylist = OrderedSet(denylist)
+        self.manually_queued_tracks = OrderedSet()
+        # mapping track_uri -> OrderedSet of voter fingerprints
+        self.has_voted = {}
+
+    def can_play(self, uri):
+        return uri not in self.played_tracks and uri not in self.denylist
+
+    def has_voted_on(self, user_fingerprint, uri):
+        voters = self.has_voted.get(uri)
+        return voters is not None and user_fingerprint in voters
+
+    def add_voter(self, user_fingerprint, uri):
+        voters = self.has_voted.get(uri)
+        if voters is None:
+            voters = self.has_voted[uri] = OrderedSet()
+        voters.add(user_fingerprint)
+
+
+class QueueOwnership:
+    """Which users queued which tracks, indexed both ways.
+
+    Each user's tracks are kept in the order they were queued, and each
+    track's owners are kept alongside, so adding, ownership checks, a
+    user's queue count and dropping a track from every user's queue are
+    all O(1) in the number of users and queued tracks.
+    """
+
+    def __init__(self, tracks_by_user=None):
+        # mapping fingerprint -> OrderedSet of track URIs they queued
+        self.by_user = {}
+        # mapping track_uri -> OrderedSet of fingerprints that queued it
+        self.by_uri = {}
+        for user_fingerprint, uris in (tracks_by_user or {}).items():
+            for uri in uris:
+                self.add(user_fingerprint, uri)
+
+    def __contains__(self, uri):
+        return uri in self.by_uri
+
+    def add(self, user_fingerprint, uri):
+        uris = self.by_user.get(user_fingerprint)
+        if uris is None:
+            uris = self.by_user[user_fingerprint] = OrderedSet()
+        uris.add(uri)
+        owners = self.by_uri.get(uri)
+        if owners is None:
+            owners = self.by_uri[uri] = OrderedSet()
+        owners.add(user_fingerprint)
+
+    def discard_track(self, uri):
+        """Remove ``uri`` from the queue of every user that queued it."""
+        for user_fingerprint in self.by_uri.pop(uri, ()):
+            uris = self.by_user[user_fingerprint]
+            uris.discard(uri)
+            if not uris:
+                del self.by_user[user_fingerprint]
+
+    def owns(self, user_fingerprint, uri):
+        owners = self.by_uri.get(uri)
+        return owners is not None and user_fingerprint in owners
+
+    def owners(self, uri):
+        return self.by_uri.get(uri, OrderedSet())
+
+    def tracks(self, user_fingerprint):
+        return self.by_user.get(user_fingerprint, OrderedSet())
+
+    def count(self, user_fingerprint):
+        return len(self.tracks(user_fingerprint))
+
+    def to_json(self):
+        return {
+            user_fingerprint: uris.to_list()
+            for user_fingerprint, uris in self.by_user.items()
+        }
+
+
+class PlaylistPool:
+    """Play order for the tracks of the session playlists.
+
+    The order is shuffled and de-duplicated once when the pool is built.
+    Picking the next track advances a cursor, lazily skipping entries that
+    have been played or denylisted since the pool was built. Playlists can
+    be added or removed later without disturbing the order of the tracks
+    that are already in the pool.
+    """
+
+    def __init__(self, playlist_items=(), shuffle_items=False):
+        self.shuffle_items = shuffle_items
+        # list of (track_ref, playlist_name) tuples in play order
+        self.entries = []
+        self.cursor = 0
+        # mapping track_uri -> list of (playlist_uri, playlist_name) it is in
+        self.sources = {}
+
+        items = list(playlist_items)
+        if shuffle_items:
+            random.shuffle(items)
+
+        for ref, playlist in items:
+            if self.__add_source(ref.uri, playlist):
+                self.entries.append((ref, playlist["name"]))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def to_json(self):
+        return {
+            "shuffleItems": self.shuffle_items,
+            "entries": [[ref, playlist_name] for ref, playlist_name in self.entries],
+            "cursor": self.cursor,
+            "sources": self.sources,
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        """Rebuild a pool saved with to_json, keeping its play order."""
+        pool = cls(shuffle_items=data["shuffleItems"])
+        pool.entries = [(ref, playlist_name) for ref, playlist_name in data["entries"]]
+        pool.cursor = data["cursor"]
+        pool.sources = {
+            track_uri: [tuple(source) for source in sources]
+            for track_uri, sources in data["sources"].items()
+        }
+        return pool
+
+    def next_entry(self, can_play):
+        """Return the next playable ``(track_ref, playlist_name)`` or None."""
+        while self.cursor < len(self.entries):
+            entry = self.entries[self.cursor]
+            self.cursor += 1
+            if can_play(entry[0].uri):
+                return entry
+        return None
+
+    def upcoming(self, count, can_play):
+        """Return up to ``count`` playable refs ahead of the cursor.
+
+        Unlike next_entry this does not move the cursor.
+        """
+        refs = []
+        position = self.cursor
+        while position < len(self.entries) and len(refs) < count:
+            ref = self.entries[position][0]
+            if can_play(ref.uri):
+                refs.append(ref)
+            position += 1
+        return refs
+
+    def push_back(self, entry):
+        """Make ``entry`` the next one returned by next_entry.
+
+        Returns True if it was inserted rather than the cursor moved back.
+        """
+        if self.cursor > 0 and self.entries[self.cursor - 1] is entry:
+            self.cursor -= 1
+            return False
+        self.entries.insert(self.cursor, entry)
+        return True
+
+    def remaining(self, can_play):
+        return [ref.uri for ref, _ in self.entries[self.cursor :] if can_play(ref.uri)]
+
+    def add_playlist(self, playlist, refs):
+        """Merge the tracks of a newly selected playlist into the pool.
+
+        New tracks are spread at random through the part of the play order
+        that is still ahead of the cursor (or appended when not shuffling);
+        tracks already in the pool keep their position and attribution.
+        """
+        new_entries = [
+            (ref, playlist["name"])
+            for ref in refs
+            if self.__add_source(ref.uri, playlist)
+        ]
+        if not new_entries:
+            return
+
+        if not self.shuffle_items:
+            self.entries.extend(new_entries)
+            return
+
+        random.shuffle(new_entries)
+        upcoming = self.entries[self.cursor :]
+        total = len(upcoming) + len(new_entries)
+        new_positions = set(random.sample(range(total), len(new_entries)))
+        upcoming_iter = iter(upcoming)
+        new_iter = iter(new_entries)
+        self.entries[self.cursor :] = [
+            next(new_iter) if position in new_positions else next(upcoming_iter)
+            for position in range(total)
+        ]
+
+    def remove_playlist(self, playlist_uri):
+        """Drop the tracks that were only in the given playlist.
+
+        Tracks also found in another selected playlist stay where they are
+        and are attributed to that playlist instead.
+        """
+        removed = set()
+        renamed = {}
+        for track_uri, sources in list(self.sources.items()):
+            remaining = [source for source in sources if source[0] != playlist_uri]
+            if len(remaining) == len(sources):
+                continue
+            if remaining:
+                # the first source is the one the pool entry is attributed to
+                if sources[0][0] == playlist_uri:
+                    renamed[track_uri] = remaining[0][1]
+                self.sources[track_uri] = remaining
+            else:
+                del self.sources[track_uri]
+                removed.add(track_uri)
+
+        if not removed and not renamed:
+            return
+
+        upcoming = []
+        for ref, playlist_name in self.entries[self.cursor :]:
+            if ref.uri in removed:
+                continue
+            upcoming.append((ref, renamed.get(ref.uri, playlist_name)))
+        self.entries[self.cursor :] = upcoming
+
+    def __add_source(self, track_uri, playlist):
+        """Record that ``track_uri`` is in ``playlist``; True if it is new."""
+        source = (playlist["uri"], playlist["name"])
+        sources = self.sources.get(track_uri)
+        if sources is None:
+            self.sources[track_uri] = [source]
+            return True
+        if source not in sources:
+            sources.append(source)
+        return False
+
+
+class TracklistMirror:
+    """In-process copy of the Mopidy tracklist.
+
+    Holds the tl_tracks in tracklist order plus a count of queued URIs, so
+    membership, length and position queries are answered without a core
+    round trip. It is refreshed wholesale from core on tracklist_changed
+    and patched locally with the results of pibox's own tracklist calls in
+    between. ``version`` is bumped whenever the contents change.
+    """
+
+    def __init__(self, tl_tracks=()):
+        self.tl_tracks = []
+        self.uris = Counter()
+        self.version = 0
+        self.refresh(tl_tracks)
+
+    def __len__(self):
+        return len(self.tl_tracks)
+
+    def __iter__(self):
+        return iter(self.tl_tracks)
+
+    def __contains__(self, uri):
+        return self.uris[uri] > 0
+
+    def count(self, uri):
+        return self.uris[uri]
+
+    def refresh(self, tl_tracks):
+        tl_tracks = list(tl_tracks)
+        if tl_tracks == self.tl_tracks:
+            return
+        self.tl_tracks = tl_tracks
+        self.uris = Counter(tl_track.track.uri for tl_track in self.tl_tracks)
+        self.version += 1
+
+    def add(self, tl_tracks, at_position=None):
+        tl_tracks = list(tl_tracks)
+        if at_position is None:
+            self.tl_tracks.extend(tl_tracks)
+        else:
+            self.tl_tracks[at_position:at_position] = tl_tracks
+        self.uris.update(tl_track.track.uri for tl_track in tl_tracks)
+        self.version += 1
+
+    def remove(self, tl_tracks):
+        tlids = {tl_track.tlid for tl_track in tl_tracks}
+        if not tlids:
+            return
+        kept = []
+        for tl_track in self.tl_tracks:
+            if tl_track.tlid in tlids:
+                self.uris[tl_track.track.uri] -= 1
+            else:
+                kept.append(tl_track)
+        if len(kept) == len(self.tl_tracks):
+            return
+        self.tl_tracks = kept
+        self.uris += Counter()  # drop zero counts
+        self.version += 1
+
+    def discard(self, tl_track):
+        """Remove ``tl_track`` if an entry matches both its tlid and URI."""
+        self.remove(
+            [
+                queued
+                for queued in self.tl_tracks
+                if queued.tlid == tl_track.tlid
+                and queued.track.uri == tl_track.track.uri
+            ]
+        )
+
+    def clear(self):
+        if self.tl_tracks:
+            self.version += 1
+        self.tl_tracks = []
+        self.uris = Counter()
+
+    def index(self, tlid):
+        for position, tl_track in enumerate(self.tl_tracks):
+            if tl_track.tlid == tlid:
+                return position
+        return None
+
+
+class SuggestionIndex:
+    """Weighted random sampler over the tracks that can be suggested.
+
+    Built from ``(uri, weight)`` pairs into alias tables (Vose's method), so
+    each draw costs O(1) and sampling ``k`` tracks O(k) however long the
+    history is. Tracks that are played or queued during the session are
+    discarded and rejected when drawn; once they make up half of the
+    table it is rebuilt without them.
+    """
+
+    def __init__(self, weights=(), rng=random):
+        self.rng = rng
+        self.weights = {}
+        self.uris = []
+        self.probabilities = []
+        self.aliases = []
+        self.discarded = set()
+        self.rebuilds = 0
+        self.build(weights)
+
+    def __len__(self):
+        return len(self.uris) - len(self.discarded)
+
+    def __contains__(self, uri):
+        return uri in self.weights and uri not in self.discarded
+
+    def build(self, weights):
+        self.weights = {uri: weight for uri, weight in weights if weight > 0}
+        self.discarded = set()
+        self.__build_tables()
+
+    def discard(self, uri):
+        if uri in self.weights:
+            self.discarded.add(uri)
+
+    def sample(self, count, can_suggest=None):
+        """Return up to ``count`` distinct URIs, drawn by weight.
+
+        ``can_suggest`` may reject further URIs without discarding them.
+        """
+        if len(self.discarded) * 2 > len(self.uris):
+            for uri in self.discarded:
+                del self.weights[uri]
+            self.discarded = set()
+            self.__build_tables()
+
+        chosen = []
+        seen = set()
+        # give up on drawing once rejections dominate and pick from what
+        # is left instead
+        attempts = 4 * count + 16
+        while len(chosen) < count and attempts > 0 and self.uris:
+            attempts -= 1
+            position = self.rng.randrange(len(self.uris))
+            if self.rng.random() >= self.probabilities[position]:
+                position = self.aliases[position]
+            uri = self.uris[position]
+            if uri in seen:
+                continue
+            seen.add(uri)
+            if uri in self.discarded or (can_suggest and not can_suggest(uri)):
+                continue
+            chosen.append(uri)
+
+        if len(chosen) < count:
+            remaining = [
+                uri
+                for uri in self.uris
+                if uri not in seen
+                and uri not in self.discarded
+                and (not can_suggest or can_suggest(uri))
+            ]
+            self.rng.shuffle(remaining)
+            chosen.extend(remaining[: count - len(chosen)])
+        return chosen
+
+    def __build_tables(self):
+        self.uris = list(self.weights)
+        size = len(self.uris)
+        self.probabilities = [0.0] * size
+        self.aliases = list(range(size))
+        self.rebuilds += 1
+        if not size:
+            return
+
+        total = sum(self.weights.values())
+        scaled = [self.weights[uri] * size / total for uri in self.uris]
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            self.probabilities[less] = scaled[less]
+            self.aliases[less] = more
+            scaled[more] = scaled[more] + scaled[less] - 1
+            (small if scaled[more] < 1 else large).append(more)
+        for i in small + large:
+            self.probabilities[i] = 1.0
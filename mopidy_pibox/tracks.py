@@ -0,0 +1,54 @@
+from mopidy_pibox.cache import PersistentCache
+
+
+class TrackCache:
+    """Track metadata by URI, shared by everything in pibox that resolves it.
+
+    A size-bounded, expiring LRU persisted to SQLite in the data dir, so a
+    rebooted Pi starts warm. ``get_many`` answers what it can from the
+    cache and resolves the rest in a single ``core.library.lookup`` call.
+    Like ``lookup``, results map each URI to a list of tracks, empty when
+    the URI could not be resolved. Those are not cached: the backend may
+    just not be ready yet, so they are looked up again next time.
+    """
+
+    def __init__(self, core, path=None, maxsize=None, ttl=None, timeout=None):
+        self.core = core
+        self.timeout = timeout
+        self.cache = PersistentCache(path=path, maxsize=maxsize, ttl=ttl)
+        self.lookups = 0
+
+    def get_many(self, uris):
+        found, missing = self.cached(uris)
+        if missing:
+            results = self.lookup(missing).get(timeout=self.timeout) or {}
+            found.update(
+                self.put_many({uri: results.get(uri) or [] for uri in missing})
+            )
+        return found
+
+    def get(self, uri):
+        return self.get_many([uri]).get(uri, [])
+
+    def cached(self, uris):
+        """Return ``(found, missing)`` without looking anything up."""
+        return self.cache.get_many(list(dict.fromkeys(uris)))
+
+    def lookup(self, uris):
+        """Start a library lookup of ``uris``; returns the core future.
+
+        The result should be handed to put_many once it is in.
+        """
+        self.lookups += 1
+        return self.core.library.lookup(uris=uris)
+
+    def put_many(self, results):
+        tracks = {uri: list(result) for uri, result in (results or {}).items()}
+        self.cache.put_many({uri: result for uri, result in tracks.items() if result})
+        return tracks
+
+    def close(self):
+        self.cache.close()
+
+    def stats(self):
+        return dict(self.cache.stats(), lookups=self.lookups)
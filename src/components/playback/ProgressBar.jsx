@@ -1,5 +1,5 @@
 import React, { useEffect, useRef, useState } from "react";
-import { getTimePosition } from "services/mopidy";
+import { getLastPlaybackPosition, onPlaybackPosition } from "services/mopidy";
 import { useNowPlaying } from "hooks/nowPlaying";
 import burgee from "res/burgee_306.png";
 
@@ -13,7 +13,7 @@ function msToTime(ms) {
   return `${mm}:${String(ss).padStart(2, "0")}`;
 }
 
-const ProgressBar = ({ pollInterval = 500 }) => {
+const ProgressBar = () => {
   const { currentTrack, playbackState } = useNowPlaying();
   const [position, setPosition] = useState(0);
   const rafRef = useRef(null);
@@ -23,17 +23,14 @@ const ProgressBar = ({ pollInterval = 500 }) => {
   const [containerWidth, setContainerWidth] = useState(0);
   const [burgeeWidth, setBurgeeWidth] = useState(0);
 
-  // polling function to fetch authoritative position from Mopidy
-  const pollPosition = async () => {
-    try {
-      const pos = await getTimePosition();
-      if (typeof pos === "number") {
-        setPosition(pos);
-        lastTsRef.current = Date.now();
-      }
-    } catch (e) {
-      // ignore
-    }
+  // take the authoritative position broadcast by the server, moved on by
+  // however long ago it arrived if the track is playing
+  const syncPosition = (update) => {
+    if (!update || typeof update.position !== "number") return;
+    const now = Date.now();
+    const elapsed = update.state === "playing" ? now - update.receivedAt : 0;
+    setPosition(update.position + elapsed);
+    lastTsRef.current = now;
   };
 
   // rAF updater for smooth animation when playing
@@ -59,10 +56,9 @@ const ProgressBar = ({ pollInterval = 500 }) => {
   };
 
   useEffect(() => {
-    let interval = null;
     // whenever the track changes, resync
-    pollPosition();
-    interval = setInterval(pollPosition, pollInterval);
+    syncPosition(getLastPlaybackPosition());
+    const unsubscribe = onPlaybackPosition(syncPosition);
 
     const measure = () => {
       if (containerRef.current) setContainerWidth(containerRef.current.clientWidth || 0);
@@ -72,7 +68,7 @@ const ProgressBar = ({ pollInterval = 500 }) => {
     window.addEventListener("resize", measure);
 
     return () => {
-      if (interval) clearInterval(interval);
+      unsubscribe();
       window.removeEventListener("resize", measure);
     };
   }, [currentTrack && currentTrack.uri]);
@@ -1,6 +1,6 @@
 import { useQuery, useQueryClient } from "@tanstack/react-query";
 import { useEffect } from "react";
-import { getTracklist, onTracklistChanged, onVoteAdded } from "services/mopidy";
+import { getTracklist, onTracklistUpdated } from "services/mopidy";
 
 let subscriptionInitialised = false;
 
@@ -18,17 +18,14 @@ export const useTracklist = () => {
       return;
     }
 
-    const cleanupTracklistChanged = onTracklistChanged(async () => {
-      queryClient.invalidateQueries({ queryKey: ["tracklist"] });
-    });
-
-    const cleanupVoteAdded = onVoteAdded(async () => {
-      queryClient.invalidateQueries({ queryKey: ["tracklist"] });
+    // The server pushes our view of the tracklist after every change, so
+    // store it directly instead of refetching.
+    const cleanupTracklistUpdated = onTracklistUpdated((tracklistView) => {
+      queryClient.setQueryData(["tracklist"], tracklistView);
     });
 
     return () => {
-      cleanupTracklistChanged();
-      cleanupVoteAdded();
+      cleanupTracklistUpdated();
     };
   }, []);
 
@@ -11,7 +11,7 @@ import { StyledEngineProvider } from "@mui/material/styles";
 import { QueryClient, QueryClientProvider } from "@tanstack/react-query";
 import { ReactQueryDevtools } from "@tanstack/react-query-devtools";
 import { initialiseFingerprint } from "services/fingerprint";
-import { initialiseMopidy } from "services/mopidy";
+import { initialiseMopidy, onResync } from "services/mopidy";
 import { LoadingScreen } from "components/common/LoadingScreen";
 import Root from "./Root";
 import "./index.css";
@@ -30,6 +30,8 @@ const theme = createTheme({
 const initialise = async () => {
   await initialiseFingerprint();
   await initialiseMopidy();
+  // missed too many pibox events while disconnected; refetch everything
+  onResync(() => queryClient.invalidateQueries());
 
   const root = createRoot(document.getElementById("root"));
 
@@ -1,10 +1,6 @@
 import MopidyConnection from "mopidy";
 import { getFingerprint } from "./fingerprint";
 import { pibox } from "./pibox";
-// Avoid importing `BACKEND_PRIORITY_ORDER` from the Search component
-// to prevent a circular dependency between services/mopidy.js and
-// components/search/Search.jsx. Define the backend priority order
-// locally here.
 
 let mopidy = null;
 let piboxWebsocket = null;
@@ -13,14 +9,15 @@ let _piboxReconnectAttempts = 0;
 let _piboxReconnectTimer = null;
 let _piboxPingTimer = null;
 let _piboxPongTimer = null;
+let _piboxLastSeq = null; // sequence number of the last pibox event received
+let _piboxEpoch = null; // server process that numbered it; restarts renumber
+let _lastPlaybackPosition = null; // latest PLAYBACK_POSITION, stamped on arrival
 let PIBOX_PING_INTERVAL = 8000; // send ping every 8s
 let PIBOX_PONG_TIMEOUT = 4000; // expect pong within 4s (configurable via config API)
 
 const PIBOX_RECONNECT_BASE_MS = 1000;
 const PIBOX_RECONNECT_MAX_MS = 30000;
 
-const BACKEND_PRIORITY_ORDER = ["spotify", "soundcloud"];
-
 // Allow runtime update of PONG timeout from config
 export const setPiboxPongTimeout = (ms) => {
   if (typeof ms === "number" && ms >= 1000) {
@@ -60,6 +57,16 @@ const _dispatchPiboxEvent = (data) => {
     case "VOTE_ADDED":
       event = new CustomEvent("pibox:voteAdded", { detail: data.payload });
       break;
+    case "TRACKLIST_UPDATED":
+      event = new CustomEvent("pibox:tracklistUpdated", { detail: data.payload });
+      break;
+    case "PLAYBACK_POSITION":
+      _lastPlaybackPosition = { ...data.payload, receivedAt: Date.now() };
+      event = new CustomEvent("pibox:playbackPosition", { detail: _lastPlaybackPosition });
+      break;
+    case "RESYNC":
+      event = new CustomEvent("pibox:resync", { detail: data.seq });
+      break;
     default:
       console.debug("Default pibox websocket statement hit");
       break;
@@ -98,6 +105,8 @@ const createPiboxWebSocket = (websocketUrl) => {
 
     piboxWebsocket.onopen = () => {
       _clearPiboxReconnect();
+      _registerPiboxClient();
+      _resumePiboxEvents();
       _startPiboxHeartbeat();
       document.dispatchEvent(new CustomEvent("pibox:connected", { detail: true }));
     };
@@ -114,6 +123,10 @@ const createPiboxWebSocket = (websocketUrl) => {
           }
           return;
         }
+        if (data && typeof data.seq === "number") {
+          _piboxLastSeq = data.seq;
+          _piboxEpoch = data.epoch;
+        }
         _dispatchPiboxEvent(data);
       } catch (e) {
         console.debug("Invalid pibox websocket message", e);
@@ -141,6 +154,28 @@ const createPiboxWebSocket = (websocketUrl) => {
   }
 };
 
+// Identify this client so the server can push our own view of the tracklist
+const _registerPiboxClient = () => {
+  const fingerprint = getFingerprint();
+  if (!fingerprint || !piboxWebsocket || piboxWebsocket.readyState !== WebSocket.OPEN) return;
+  try {
+    piboxWebsocket.send(JSON.stringify({ type: "REGISTER", fingerprint }));
+  } catch (e) {
+    // ignore send failures; we register again on reconnect
+  }
+};
+
+// Ask the server to replay the events missed while disconnected; it answers
+// with RESYNC instead if it no longer has them all or has restarted since
+const _resumePiboxEvents = () => {
+  if (_piboxLastSeq === null || !piboxWebsocket || piboxWebsocket.readyState !== WebSocket.OPEN) return;
+  try {
+    piboxWebsocket.send(JSON.stringify({ type: "RESUME", lastSeq: _piboxLastSeq, epoch: _piboxEpoch }));
+  } catch (e) {
+    // ignore send failures; we resume again on reconnect
+  }
+};
+
 const _sendPiboxPing = () => {
   if (!piboxWebsocket || piboxWebsocket.readyState !== WebSocket.OPEN) return;
   try {
@@ -284,15 +319,55 @@ const _preferTidalSize = (url, size = 1280) => {
   return url;
 };
 
-export const getArtwork = (uri, size = 640) =>
-  new Promise((resolve) => {
-    mopidy.library.getImages({ uris: [uri] }).then((result) => {
-      const images = result[uri] || [];
-      const artworkUri = images.length ? images[0].uri : "";
-      const preferred = _preferTidalSize(artworkUri, size);
-      resolve(preferred || artworkUri);
-    }).catch(() => resolve(""));
-  });
+// Artwork requests made in the same tick are sent to the server as one
+// batch; the server answers from its image cache where it can
+const ARTWORK_BATCH_DELAY_MS = 10;
+const ARTWORK_BATCH_SIZE = 100;
+const _artworkRequests = new Map(); // uri -> promise of its images
+let _artworkBatch = new Map(); // uri -> resolve, waiting to be sent
+let _artworkTimer = null;
+
+const _flushArtworkBatch = async () => {
+  const batch = _artworkBatch;
+  _artworkBatch = new Map();
+  _artworkTimer = null;
+  const uris = [...batch.keys()];
+  for (let start = 0; start < uris.length; start += ARTWORK_BATCH_SIZE) {
+    const chunk = uris.slice(start, start + ARTWORK_BATCH_SIZE);
+    let images = {};
+    try {
+      const result = await pibox.post("/api/images", { uris: chunk });
+      images = (result.data && result.data.images) || {};
+    } catch (e) {
+      // resolve without artwork; the next request for these will retry
+    }
+    chunk.forEach((uri) => {
+      // don't remember missing artwork; it may only have failed this time
+      if (!images[uri] || !images[uri].length) _artworkRequests.delete(uri);
+      batch.get(uri)(images[uri] || []);
+    });
+  }
+};
+
+const _getImages = (uri) => {
+  if (!_artworkRequests.has(uri)) {
+    _artworkRequests.set(
+      uri,
+      new Promise((resolve) => {
+        _artworkBatch.set(uri, resolve);
+        if (!_artworkTimer) _artworkTimer = setTimeout(_flushArtworkBatch, ARTWORK_BATCH_DELAY_MS);
+      }),
+    );
+  }
+  return _artworkRequests.get(uri);
+};
+
+export const getArtwork = async (uri, size = 640) => {
+  const images = await _getImages(uri);
+  const artworkUri = images.length ? images[0].uri : "";
+  const preferred = _preferTidalSize(artworkUri, size);
+  return preferred || artworkUri;
+};
 
 export const getConfig = async () => {
   const result = await pibox.get("/config");
@@ -410,31 +485,17 @@ export const rebootSystem = async () => {
   throw new Error(err);
 };
 
-export const searchLibrary = (searchTerms) =>
-  new Promise((resolve) => {
-    mopidy.library
-      .search({
-        query: { any: searchTerms },
-        exact: false,
-      })
-      .then((result) => {
-        result.sort((a, b) => {
-          const [backendA] = a.uri.split(":");
-          const [backendB] = b.uri.split(":");
-          const resultA = BACKEND_PRIORITY_ORDER.indexOf(backendA);
-          return (
-            (resultA === -1 ? Number.MAX_VALUE : resultA) -
-            BACKEND_PRIORITY_ORDER.indexOf(backendB)
-          );
-        });
-        const results = result.reduce((tracks, backendResult) => {
-          tracks.push(...(backendResult.tracks || []));
-          return tracks;
-        }, []);
-        resolve(results);
-      })
-      .catch(() => resolve([]));
-  });
+// Searches go through the pibox server, which caches results, shares
+// identical searches in flight and orders them by backend priority
+export const searchLibrary = async (searchTerms) => {
+  const q = [].concat(searchTerms).join(" ");
+  try {
+    const result = await pibox.get(`/api/search?q=${encodeURIComponent(q)}`);
+    return (result.status === 200 && result.data?.tracks) || [];
+  } catch (e) {
+    return [];
+  }
+};
 
 export const voteToSkipTrack = async (uri) => {
   const result = await pibox.post("/api/vote", {
@@ -549,3 +610,25 @@ export const onVoteAdded = (callback) => {
   document.addEventListener("pibox:voteAdded", fn);
   return () => document.removeEventListener("pibox:voteAdded", fn);
 };
+
+export const onTracklistUpdated = (callback) => {
+  const fn = (event) => callback(event.detail);
+  document.addEventListener("pibox:tracklistUpdated", fn);
+  return () => document.removeEventListener("pibox:tracklistUpdated", fn);
+};
+
+// The server broadcasts the position on track start, pause, resume and seek
+// (plus a slow heartbeat while playing); extrapolate from receivedAt between
+export const getLastPlaybackPosition = () => _lastPlaybackPosition;
+
+export const onPlaybackPosition = (callback) => {
+  const fn = (event) => callback(event.detail);
+  document.addEventListener("pibox:playbackPosition", fn);
+  return () => document.removeEventListener("pibox:playbackPosition", fn);
+};
+
+export const onResync = (callback) => {
+  const fn = (event) => callback(event.detail);
+  document.addEventListener("pibox:resync", fn);
+  return () => document.removeEventListener("pibox:resync", fn);
+};
@@ -0,0 +1,94 @@
+"""Benchmark of the queue history cost at session start over a year of parties.
+
+The old ``pibox-queue-history.json`` was a list that every party appended
+its requests to, re-read in full at every start_session and scanned for
+suggestions. :class:`~mopidy_pibox.history.HistoryStore` keeps one record
+per track, loads once when pibox starts and is compacted as it grows.
+``Pibox.start_session`` then only rebuilds the suggestion weights from the
+records in memory, so its cost follows the number of distinct tracks
+rather than the number of parties. Loading the store is timed separately,
+as it is paid once per Mopidy start rather than per session.
+
+Run with ``python -m tests.benchmarks.bench_history``.
+"""
+
+import json
+import pathlib
+import random
+import tempfile
+import timeit
+
+from mopidy_pibox.history import LEGACY_HISTORY_FILE, HistoryStore
+from mopidy_pibox.pibox import Pibox
+
+PARTIES = [1, 13, 26, 52]
+REQUESTS_PER_PARTY = 300
+# most requests at a party are for songs that were requested before
+CATALOGUE_SIZE = 3000
+REPEAT = 5
+
+
+def _party(rng):
+    return [
+        f"dummy:track:{rng.randrange(CATALOGUE_SIZE)}"
+        for _ in range(REQUESTS_PER_PARTY)
+    ]
+
+
+def _legacy_start_session(path, played_tracks):
+    with open(path) as f:
+        history = json.load(f)
+    return [uri for uri in history if uri not in played_tracks]
+
+
+def main():
+    print(f"{REQUESTS_PER_PARTY} requests per party, best of {REPEAT} runs")
+    print(
+        f"{'parties':>8} {'legacy file (KB)':>17} {'legacy start (ms)':>18}"
+        f" {'store file (KB)':>16} {'pibox start (ms)':>17} {'store load (ms)':>16}"
+    )
+    for parties in PARTIES:
+        rng = random.Random(0)
+        with tempfile.TemporaryDirectory() as tmp:
+            data_dir = pathlib.Path(tmp)
+            legacy_path = data_dir / "legacy" / LEGACY_HISTORY_FILE
+            legacy_path.parent.mkdir()
+            legacy = []
+            store = HistoryStore(data_dir)
+            for _ in range(parties):
+                requests = _party(rng)
+                legacy += requests
+                store.record(requests)
+            if store.compacting is not None:
+                store.compacting.join()
+            with open(legacy_path, "w") as f:
+                json.dump(legacy, f)
+
+            legacy_start = min(
+                timeit.repeat(
+                    lambda: _legacy_start_session(legacy_path, set()),
+                    number=1,
+                    repeat=REPEAT,
+                )
+            )
+            pibox = Pibox(data_dir)
+            store_start = min(
+                timeit.repeat(
+                    lambda: pibox.start_session(1, [], shuffle=False),
+                    number=1,
+                    repeat=REPEAT,
+                )
+            )
+            store_load = min(
+                timeit.repeat(lambda: HistoryStore(data_dir), number=1, repeat=REPEAT)
+            )
+            print(
+                f"{parties:>8} {legacy_path.stat().st_size / 1024:>17.1f}"
+                f" {legacy_start * 1000:>18.2f}"
+                f" {store.path.stat().st_size / 1024:>16.1f}"
+                f" {store_start * 1000:>17.2f} {store_load * 1000:>16.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
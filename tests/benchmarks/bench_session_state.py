@@ -0,0 +1,61 @@
+"""Microbenchmark for the per-track-change playability filter.
+
+Every auto-queue filters the whole session playlist against the play
+history and the denylist. This compares the old flat-list state with
+:class:`~mopidy_pibox.state.SessionState` as the history grows.
+
+Run with ``python -m tests.benchmarks.bench_session_state``.
+"""
+
+import timeit
+
+from mopidy_pibox.state import SessionState
+
+PLAYLIST_SIZE = 5000
+HISTORY_SIZES = [0, 250, 1000, 2500, 5000]
+REPEAT = 5
+
+
+def _playlist():
+    return [f"dummy:track:{i}" for i in range(PLAYLIST_SIZE)]
+
+
+def _list_filter(playlist, played, denylist):
+    return [uri for uri in playlist if uri not in played and uri not in denylist]
+
+
+def _state_filter(playlist, state):
+    return [uri for uri in playlist if state.can_play(uri)]
+
+
+def main():
+    playlist = _playlist()
+    print(f"playlist size: {PLAYLIST_SIZE} tracks, best of {REPEAT} runs")
+    print(f"{'history':>8} {'lists (ms)':>12} {'SessionState (ms)':>18}")
+    for size in HISTORY_SIZES:
+        # history is drawn from outside the playlist so the filter still
+        # has to walk every playlist entry
+        history = [f"dummy:history:{i}" for i in range(size)]
+        denylist = ["dummy:denied"]
+
+        state = SessionState(denylist=denylist)
+        for uri in history:
+            state.played_tracks.add(uri)
+
+        legacy = min(
+            timeit.repeat(
+                lambda: _list_filter(playlist, history, denylist),
+                number=1,
+                repeat=REPEAT,
+            )
+        )
+        indexed = min(
+            timeit.repeat(
+                lambda: _state_filter(playlist, state), number=1, repeat=REPEAT
+            )
+        )
+        print(f"{size:>8} {legacy * 1000:>12.2f} {indexed * 1000:>18.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,8 @@ This backend implements the backend API in the simplest way possible.  It is
 used in tests of the frontends.
 """
 
+import time
+
 import pykka
 from mopidy import backend
 from mopidy.models import Playlist, Ref, SearchResult
@@ -38,6 +40,8 @@ class DummyLibraryProvider(backend.LibraryProvider):
         self.dummy_browse_result = {}
         self.dummy_find_exact_result = SearchResult()
         self.dummy_search_result = SearchResult()
+        # seconds each lookup takes, to stand in for a slow streaming service
+        self.dummy_lookup_delay = 0
 
     def browse(self, path):
         return self.dummy_browse_result.get(path, [])
@@ -49,6 +53,7 @@ class DummyLibraryProvider(backend.LibraryProvider):
         return self.dummy_get_images_result
 
     def lookup(self, uri):
+        time.sleep(self.dummy_lookup_delay)
         uri = Ref.track(uri=uri).uri
         return [t for t in self.dummy_library if uri == t.uri]
 
@@ -102,11 +107,16 @@ class DummyPlaylistsProvider(backend.PlaylistsProvider):
         super().__init__(backend)
         self._playlists = []
         self._allow_save = True
+        self._get_items_delays = {}
 
     def set_dummy_playlists(self, playlists):
         """For tests using the dummy provider through an actor proxy."""
         self._playlists = playlists
 
+    def set_dummy_get_items_delay(self, uri, seconds):
+        """Make ``get_items`` for ``uri`` block, like a slow remote backend."""
+        self._get_items_delays[uri] = seconds
+
     def set_allow_save(self, enabled):
         self._allow_save = enabled
 
@@ -114,6 +124,7 @@ class DummyPlaylistsProvider(backend.PlaylistsProvider):
         return [Ref.playlist(uri=pl.uri, name=pl.name) for pl in self._playlists]
 
     def get_items(self, uri):
+        time.sleep(self._get_items_delays.get(uri, 0))
         playlist = self.lookup(uri)
         if playlist is None:
             return
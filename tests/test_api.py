@@ -1,21 +1,50 @@
 from datetime import datetime
 import json
+import math
 import os
+import tempfile
+import threading
+import time
 from unittest import mock
+import tornado.gen
 import tornado.testing
 import tornado.web
 
-from mopidy.models import Track
+from mopidy import core
+from mopidy.models import Image, SearchResult, Track
+import pykka
 
 from mopidy_pibox import get_http_handlers
+from mopidy_pibox.cache import PersistentCache
 from mopidy_pibox.frontend import PiboxFrontend
 from mopidy_pibox.pibox import Pibox
+from tests import dummy_audio, dummy_backend
 
 
 def _mock_actor_return_value(fn, value):
     fn.return_value.get.return_value = value
 
 
+class _ImmediateFuture:
+    def __init__(self, value):
+        self.value = value
+
+    def get(self, timeout=None):
+        return self.value
+
+
+class _SlowFuture:
+    """Stands in for an actor future whose call takes ``delay`` seconds."""
+
+    def __init__(self, value, delay):
+        self.value = value
+        self.delay = delay
+
+    def get(self, timeout=None):
+        time.sleep(self.delay)
+        return self.value
+
+
 def _config():
     return {
         "core": {"max_tracklist_length": 5},
@@ -51,13 +80,23 @@ class TestPiboxHandlerBase(tornado.testing.AsyncHTTPTestCase):
 
 
 class TestTracklistHandler(TestPiboxHandlerBase):
+    queued_tracks = [
+        {"uri": "dummy:track1", "votes": 0, "voted": False},
+        {"uri": "dummy:track2", "votes": 1, "voted": True},
+    ]
+
     def test_get(self):
         fingerprint = "fingerprint"
-        queued_tracks = [
-            {"uri": "dummy:track1", "votes": 0, "voted": False},
-            {"uri": "dummy:track2", "votes": 1, "voted": True},
-        ]
-        _mock_actor_return_value(self.frontend.get_queued_tracks, queued_tracks)
+        _mock_actor_return_value(
+            self.frontend.get_tracklist_view,
+            json.dumps(
+                {
+                    "tracklist": self.queued_tracks,
+                    "error": None,
+                    "retry_after_seconds": 0,
+                }
+            ),
+        )
 
         response = self.fetch(
             "/api/tracklist", headers={"X-Pibox-Fingerprint": fingerprint}
@@ -65,16 +104,22 @@ class TestTracklistHandler(TestPiboxHandlerBase):
         body = json.loads(response.body)
 
         self.assertEqual(response.code, 200)
-        self.assertEqual(body["tracklist"], queued_tracks)
+        self.frontend.get_tracklist_view.assert_called_once_with(fingerprint)
+        self.assertEqual(body["tracklist"], self.queued_tracks)
+        self.assertEqual(body["retry_after_seconds"], 0)
 
     def test_post(self):
         fingerprint = "fingerprint"
-        queued_tracks = [
-            {"uri": "dummy:track1", "votes": 0, "voted": False},
-            {"uri": "dummy:track2", "votes": 1, "voted": True},
-        ]
-        _mock_actor_return_value(self.frontend.get_queued_tracks, queued_tracks)
-        _mock_actor_return_value(self.frontend.add_track_to_queue, (True, None))
+        _mock_actor_return_value(
+            self.frontend.get_tracklist_view,
+            json.dumps(
+                {
+                    "tracklist": self.queued_tracks,
+                    "error": None,
+                    "retry_after_seconds": 0,
+                }
+            ),
+        )
 
         response = self.fetch(
             "/api/tracklist",
@@ -84,8 +129,97 @@ class TestTracklistHandler(TestPiboxHandlerBase):
         )
         body = json.loads(response.body)
 
-        self.frontend.add_track_to_queue.assert_called_once_with("dummy:track1")
-        self.assertEqual(body["tracklist"], queued_tracks)
+        self.frontend.get_tracklist_view.assert_called_once_with(
+            fingerprint, "add", "dummy:track1"
+        )
+        self.assertEqual(body["tracklist"], self.queued_tracks)
+        self.assertIsNone(body["error"])
+
+    def test_delete(self):
+        fingerprint = "fingerprint"
+        _mock_actor_return_value(
+            self.frontend.get_tracklist_view,
+            json.dumps(
+                {"tracklist": [], "error": "NOT_OWNER", "retry_after_seconds": 0}
+            ),
+        )
+
+        response = self.fetch(
+            "/api/tracklist",
+            method="DELETE",
+            headers={"X-Pibox-Fingerprint": fingerprint},
+            body=json.dumps({"track": "dummy:track1"}),
+            allow_nonstandard_methods=True,
+        )
+        body = json.loads(response.body)
+
+        self.frontend.get_tracklist_view.assert_called_once_with(
+            fingerprint, "remove", "dummy:track1"
+        )
+        self.assertEqual(body["error"], "NOT_OWNER")
+
+
+class TestNonBlockingHandlers(tornado.testing.AsyncHTTPTestCase):
+    """Runs the handlers against a real frontend actor and a slow backend."""
+
+    # Workaround for https://github.com/pytest-dev/pytest/issues/12263.
+    def runTest(self):
+        pass
+
+    def get_app(self):
+        self.data_dir = tempfile.TemporaryDirectory()
+        config = _config()
+        config["core"]["data_dir"] = self.data_dir.name
+        audio = dummy_audio.create_proxy()
+        self.backend = dummy_backend.create_proxy(audio=audio)
+        self.backend.library.dummy_library = [Track(uri="dummy:track1", length=40000)]
+        self.core = core.Core.start(config, backends=[self.backend]).proxy()
+        self.frontend = PiboxFrontend.start(config=config, core=self.core).proxy()
+        static_directory_path = os.path.join(os.path.dirname(__file__), "fixtures")
+        return tornado.web.Application(
+            get_http_handlers(self.core, config, self.frontend, static_directory_path)
+        )
+
+    def tearDown(self):
+        super().tearDown()
+        pykka.ActorRegistry.stop_all()
+        self.data_dir.cleanup()
+
+    @tornado.testing.gen_test(timeout=10)
+    def test_slow_actor_call_only_delays_requests_that_need_that_actor(self):
+        slow_call_seconds = 1.0
+        self.backend.library.dummy_lookup_delay = slow_call_seconds
+
+        # the frontend actor waits on core, which waits on the slow lookup
+        slow_request = self.http_client.fetch(
+            self.get_url("/api/tracklist"),
+            method="POST",
+            headers={"X-Pibox-Fingerprint": "fingerprint"},
+            body=json.dumps({"track": "dummy:track1"}),
+        )
+        yield tornado.gen.sleep(slow_call_seconds / 10)
+        session_started = time.monotonic()
+        session_request = self.http_client.fetch(self.get_url("/api/session"))
+
+        # requests that don't need the actors are still served promptly
+        latencies = []
+        while not slow_request.done() or len(latencies) < 20:
+            started = time.monotonic()
+            response = yield self.http_client.fetch(self.get_url("/favicon.ico"))
+            latencies.append(time.monotonic() - started)
+            self.assertEqual(response.code, 200)
+        slow_response = yield slow_request
+
+        latencies.sort()
+        p99 = latencies[math.ceil(len(latencies) * 0.99) - 1]
+        self.assertEqual(slow_response.code, 200)
+        self.assertLess(p99, slow_call_seconds / 4)
+        self.assertLess(latencies[-1], slow_call_seconds / 2)
+
+        # but the session is read on the busy frontend actor, so it waits
+        session_response = yield session_request
+        self.assertEqual(session_response.code, 200)
+        self.assertGreater(time.monotonic() - session_started, slow_call_seconds / 2)
 
 
 class TestVoteHandler(TestPiboxHandlerBase):
@@ -222,6 +356,137 @@ class TestSuggestionsHandler(TestPiboxHandlerBase):
         self.assertEqual(body["suggestions"], suggestions)
 
 
+class TestImagesHandler(TestPiboxHandlerBase):
+    def test_post_resolves_only_uncached_uris_in_one_call(self):
+        self.core.library.get_images.side_effect = lambda uris: _ImmediateFuture(
+            {uri: (Image(uri=f"{uri}.jpg", width=640, height=640),) for uri in uris}
+        )
+
+        first = self.fetch(
+            "/api/images",
+            method="POST",
+            body=json.dumps({"uris": ["dummy:a", "dummy:b", "dummy:a"]}),
+        )
+        second = self.fetch(
+            "/api/images",
+            method="POST",
+            body=json.dumps({"uris": ["dummy:a", "dummy:c"]}),
+        )
+
+        self.assertEqual(first.code, 200)
+        self.assertEqual(
+            json.loads(first.body)["images"]["dummy:b"],
+            [{"uri": "dummy:b.jpg", "width": 640, "height": 640}],
+        )
+        self.assertEqual(set(json.loads(second.body)["images"]), {"dummy:a", "dummy:c"})
+        self.assertEqual(
+            [call.args[0] for call in self.core.library.get_images.call_args_list],
+            [["dummy:a", "dummy:b"], ["dummy:c"]],
+        )
+
+    def test_post_without_misses_makes_no_core_call(self):
+        self.core.library.get_images.side_effect = lambda uris: _ImmediateFuture(
+            {uri: (Image(uri=f"{uri}.jpg"),) for uri in uris}
+        )
+        for _ in range(2):
+            response = self.fetch(
+                "/api/images", method="POST", body=json.dumps({"uris": ["dummy:a"]})
+            )
+
+        self.assertEqual(
+            json.loads(response.body),
+            {
+                "images": {
+                    "dummy:a": [{"uri": "dummy:a.jpg", "width": None, "height": None}]
+                }
+            },
+        )
+        self.core.library.get_images.assert_called_once()
+
+    def test_post_asks_again_for_uris_without_images(self):
+        self.core.library.get_images.side_effect = lambda uris: _ImmediateFuture(
+            {uri: () for uri in uris}
+        )
+        for _ in range(2):
+            response = self.fetch(
+                "/api/images", method="POST", body=json.dumps({"uris": ["dummy:a"]})
+            )
+
+        self.assertEqual(json.loads(response.body), {"images": {"dummy:a": []}})
+        self.assertEqual(self.core.library.get_images.call_count, 2)
+
+    def test_post_uses_the_cache_off_the_ioloop(self):
+        self.core.library.get_images.side_effect = lambda uris: _ImmediateFuture(
+            {uri: (Image(uri=f"{uri}.jpg"),) for uri in uris}
+        )
+        threads = []
+
+        def record(original):
+            def call(cache, *args):
+                threads.append(threading.current_thread().name)
+                return original(cache, *args)
+
+            return call
+
+        with mock.patch.object(
+            PersistentCache, "get_many", record(PersistentCache.get_many)
+        ), mock.patch.object(
+            PersistentCache, "put_many", record(PersistentCache.put_many)
+        ):
+            response = self.fetch(
+                "/api/images", method="POST", body=json.dumps({"uris": ["dummy:a"]})
+            )
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual(len(threads), 2)
+        self.assertTrue(all(name.startswith("pibox-cache") for name in threads))
+
+
+class TestSearchHandler(TestPiboxHandlerBase):
+    @tornado.testing.gen_test
+    async def test_identical_searches_query_the_backends_once(self):
+        self.core.library.search.return_value = _SlowFuture(
+            [SearchResult(uri="spotify:search", tracks=[Track(uri="spotify:a")])],
+            delay=0.1,
+        )
+        client = self.http_client
+
+        responses = await tornado.gen.multi(
+            [
+                client.fetch(self.get_url("/api/search?q=Chorus")),
+                client.fetch(self.get_url("/api/search?q=chorus%20%20")),
+            ]
+        )
+        cached = await client.fetch(self.get_url("/api/search?q=CHORUS"))
+
+        self.core.library.search.assert_called_once_with(
+            query={"any": ["chorus"]}, exact=False
+        )
+        for response in [*responses, cached]:
+            self.assertEqual(json.loads(response.body)["tracks"][0]["uri"], "spotify:a")
+
+    def test_get_without_query(self):
+        response = self.fetch("/api/search")
+
+        self.assertEqual(response.code, 400)
+        self.core.library.search.assert_not_called()
+
+
+class TestStatsHandler(TestPiboxHandlerBase):
+    def test_get(self):
+        stats = {"playlistCache": {"size": 2, "hits": 4, "misses": 2}}
+        _mock_actor_return_value(self.frontend.get_stats, stats)
+
+        response = self.fetch("/api/stats")
+        body = json.loads(response.body)
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual(body["playlistCache"], stats["playlistCache"])
+        self.assertEqual(body["webSocket"]["clients"], 0)
+        self.assertEqual(body["images"]["size"], 0)
+        self.assertEqual(body["search"]["sharedSearches"], 0)
+
+
 class TestClientRoutingHandler(TestPiboxHandlerBase):
     def test_get_root(self):
         response = self.fetch("/")
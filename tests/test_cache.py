@@ -0,0 +1,121 @@
+from mopidy_pibox.cache import LRUCache, PersistentCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_get_counts_hits_and_misses():
+    cache = LRUCache()
+    cache.put("dummy:playlist1", ["dummy:a"])
+
+    assert cache.get("dummy:playlist1") == ["dummy:a"]
+    assert cache.get("dummy:playlist2") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = LRUCache(ttl=10, clock=clock)
+    cache.put("dummy:playlist1", ["dummy:a"])
+
+    clock.now = 10
+    assert cache.get("dummy:playlist1") == ["dummy:a"]
+
+    clock.now = 10.5
+    assert cache.get("dummy:playlist1") is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted_at_maxsize():
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+
+    cache.put("c", 3)
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+
+
+def test_invalidate_removes_single_entry():
+    cache = LRUCache()
+    cache.put("a", 1)
+    cache.put("b", 2)
+
+    cache.invalidate("a")
+
+    assert "a" not in cache
+    assert "b" in cache
+
+
+def test_persistent_cache_splits_found_and_missing_keys():
+    cache = PersistentCache()
+    cache.put_many({"dummy:a": [{"uri": "a.jpg"}]})
+
+    found, missing = cache.get_many(["dummy:a", "dummy:b"])
+
+    assert found == {"dummy:a": [{"uri": "a.jpg"}]}
+    assert missing == ["dummy:b"]
+
+
+def test_persistent_cache_survives_reopening(tmp_path):
+    cache = PersistentCache(path=tmp_path / "images", maxsize=10)
+    cache.put_many({"dummy:a": [{"uri": "a.jpg"}], "dummy:b": []})
+    cache.close()
+
+    cache = PersistentCache(path=tmp_path / "images", maxsize=10)
+    found, missing = cache.get_many(["dummy:a", "dummy:b", "dummy:c"])
+
+    assert found == {"dummy:a": [{"uri": "a.jpg"}], "dummy:b": []}
+    assert missing == ["dummy:c"]
+    assert cache.stats()["diskHits"] == 2
+    # promoted to memory, so the disk is not read again
+    cache.get_many(["dummy:a"])
+    assert cache.stats()["diskHits"] == 2
+
+
+def test_persistent_cache_entries_expire_across_reopening(tmp_path):
+    clock = FakeClock()
+    cache = PersistentCache(path=tmp_path / "tracks.sqlite", ttl=10, clock=clock)
+    cache.put_many({"dummy:a": 1})
+    cache.close()
+
+    clock.now = 5
+    cache = PersistentCache(path=tmp_path / "tracks.sqlite", ttl=10, clock=clock)
+    assert cache.get_many(["dummy:a"]) == ({"dummy:a": 1}, [])
+
+    # promoted to memory with its original age, so it still expires on time
+    clock.now = 11
+    assert cache.get_many(["dummy:a"]) == ({}, ["dummy:a"])
+
+
+def test_persistent_cache_trims_the_table_on_write(tmp_path):
+    clock = FakeClock()
+    cache = PersistentCache(path=tmp_path / "images", maxsize=2, ttl=10, clock=clock)
+    cache.put_many({"dummy:a": 1})
+    clock.now = 1
+    cache.put_many({"dummy:b": 2})
+    clock.now = 2
+    cache.put_many({"dummy:c": 3})
+
+    assert [
+        key for (key,) in cache._db.execute("SELECT key FROM cache ORDER BY key")
+    ] == [
+        "dummy:b",
+        "dummy:c",
+    ]
+
+    # expired rows go even while the table is below maxsize
+    clock.now = 13
+    cache.put_many({"dummy:d": 4})
+    assert [
+        key for (key,) in cache._db.execute("SELECT key FROM cache ORDER BY key")
+    ] == ["dummy:d"]
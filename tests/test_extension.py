@@ -30,3 +30,12 @@ def test_get_config_schema():
     assert "offline" in schema
     assert "default_skip_threshold" in schema
     assert "disable_analytics" in schema
+    assert "playlist_cache_ttl" in schema
+    assert "lookahead" in schema
+    assert "probe_depth" in schema
+    assert "ws_ping_interval_ms" in schema
+    assert "ws_coalesce_ms" in schema
+    assert "position_heartbeat_ms" in schema
+    assert "search_cache_ttl" in schema
+    assert "track_cache_ttl" in schema
+    assert "journal_flush_ms" in schema
@@ -1,15 +1,19 @@
+import json
 import random
+import tempfile
+import time
 import unittest
+from unittest import mock
 
 from mopidy import core, models
 import pykka
-from mopidy_pibox.frontend import PiboxFrontend
+from mopidy_pibox.frontend import MAX_START_ATTEMPTS, PiboxFrontend
 from tests import dummy_audio, dummy_backend
 
 
-def config():
+def config(data_dir="/tmp"):
     return {
-        "core": {"max_tracklist_length": 5, "data_dir": "/tmp"},
+        "core": {"max_tracklist_length": 5, "data_dir": data_dir},
         "pibox": {
             "enabled": True,
             "offline": False,
@@ -21,10 +25,14 @@ def config():
 class TestPiboxFrontend(unittest.TestCase):
     def setUp(self):
         random.seed(0)
+        # the frontend keeps history and caches in the data dir
+        self.data_dir = tempfile.TemporaryDirectory()
         self.audio = dummy_audio.create_proxy()
         self.backend = dummy_backend.create_proxy(audio=self.audio)
-        self.core = core.Core.start(config(), backends=[self.backend]).proxy()
-        self.frontend = PiboxFrontend(config=config(), core=self.core)
+        self.core = core.Core.start(
+            config(self.data_dir.name), backends=[self.backend]
+        ).proxy()
+        self.frontend = PiboxFrontend(config=config(self.data_dir.name), core=self.core)
 
         self.frontend.pussycat_list = [
             "dummy:pussycat1",
@@ -45,17 +53,16 @@ class TestPiboxFrontend(unittest.TestCase):
         ]
 
         self.backend.library.dummy_library = tracks
-        self.backend.playlists.set_dummy_playlists(
-            [
-                models.Playlist(name="name", uri="dummy:playlist1", tracks=tracks[:3]),
-                models.Playlist(
-                    name="name2", uri="dummy:playlist2", tracks=[tracks[3]]
-                ),
-            ]
-        )
+        self.playlists = [
+            models.Playlist(name="name", uri="dummy:playlist1", tracks=tracks[:3]),
+            models.Playlist(name="name2", uri="dummy:playlist2", tracks=[tracks[3]]),
+        ]
+        self.backend.playlists.set_dummy_playlists(self.playlists)
 
     def tearDown(self):
         pykka.ActorRegistry.stop_all()
+        self.frontend.track_cache.close()
+        self.data_dir.cleanup()
 
     def test_start_session_plays_song_from_session_playlist_if_autostart_enabled(self):
         self.__start_session(auto_start=True)
@@ -102,10 +109,9 @@ class TestPiboxFrontend(unittest.TestCase):
 
     def test_when_track_ends_plays_song_from_non_exhausted_session_playlists(self):
         self.__start_session()
+        self.frontend.pibox.played_tracks = ["dummy:a", "dummy:b", "dummy:c"]
 
-        self.__play_track("Dummy Track A", "dummy:a")
-        self.__play_track("Dummy Track B", "dummy:b")
-        self.__play_track("Dummy Track C", "dummy:c")
+        self.__play_track("Dummy Track Z", "dummy:z")
 
         current_track = self.core.playback.get_current_track().get()
         playback_state = self.core.playback.get_state().get()
@@ -125,6 +131,7 @@ class TestPiboxFrontend(unittest.TestCase):
     def test_add_track_to_queue_is_unsuccessful_if_already_queued(self):
         self.__start_session()
         self.core.tracklist.add(uris=["dummy:a"])
+        self.frontend.tracklist_changed()
 
         (success, error) = self.frontend.add_track_to_queue("dummy:a")
 
@@ -151,6 +158,7 @@ class TestPiboxFrontend(unittest.TestCase):
         self.__start_session()
 
         self.core.tracklist.add(uris=["dummy:a"])
+        self.frontend.tracklist_changed()
         queued_tracks = self.core.tracklist.get_tracks().get()
 
         self.frontend.add_vote_for_user_on_queued_track(
@@ -167,6 +175,7 @@ class TestPiboxFrontend(unittest.TestCase):
         self.__start_session()
 
         self.core.tracklist.add(uris=["dummy:a"])
+        self.frontend.tracklist_changed()
         queued_tracks = self.core.tracklist.get_tracks().get()
 
         self.frontend.add_vote_for_user_on_queued_track(
@@ -240,6 +249,7 @@ class TestPiboxFrontend(unittest.TestCase):
         self.__start_session()
 
         self.core.tracklist.add(uris=["dummy:a", "dummy:pussycat1", "dummy:c"])
+        self.frontend.tracklist_changed()
         self.__play_track("Dummy Track A", "dummy:a")
         self.__play_track("What's New Pussycat?", "dummy:pussycat1")
 
@@ -250,9 +260,10 @@ class TestPiboxFrontend(unittest.TestCase):
         assert playback_state == core.PlaybackState.PLAYING
 
     def test_get_suggestions_skips_queued_tracks(self):
+        self.frontend.pibox.history.record(["dummy:a", "dummy:b"])
         self.__start_session()
-        self.frontend.pibox.queued_history = ["dummy:a", "dummy:b"]
         self.core.tracklist.add(uris=["dummy:a"])
+        self.frontend.tracklist_changed()
 
         suggestions = self.frontend.get_suggestions(3)
 
@@ -260,17 +271,48 @@ class TestPiboxFrontend(unittest.TestCase):
         assert suggestions[0].uri == "dummy:b"
 
     def test_get_suggestions_limits_suggestions_to_requested_number(self):
+        self.frontend.pibox.history.record(["dummy:a", "dummy:b", "dummy:c"])
         self.__start_session()
-        self.frontend.pibox.queued_history = ["dummy:a", "dummy:b", "dummy:c"]
 
         suggestions = self.frontend.get_suggestions(1)
 
         assert len(suggestions) == 1
 
+    def test_get_suggestions_are_answered_from_prefetched_tracks(self):
+        self.frontend.pibox.history.record(["dummy:a", "dummy:b", "dummy:c"])
+        self.__start_session()
+        self.frontend.get_suggestions(1)
+        next_uri = self.frontend.next_suggestions[0]
+        # what the prefetch thread hands back through the actor proxy
+        self.frontend.cache_suggestion_tracks(
+            self.core.library.lookup(uris=[next_uri]).get()
+        )
+
+        with mock.patch.object(self.frontend, "core", mock.Mock()) as mock_core:
+            mock_core.library.lookup.return_value.get.return_value = {}
+            suggestions = self.frontend.get_suggestions(1)
+
+        assert [track.uri for track in suggestions] == [next_uri]
+        # at most the background prefetch for the next request is looked up
+        assert all(
+            next_uri not in call.kwargs["uris"]
+            for call in mock_core.library.lookup.call_args_list
+        )
+
+    def test_played_tracks_are_no_longer_suggested(self):
+        self.frontend.pibox.history.record(["dummy:a", "dummy:b"])
+        self.__start_session()
+
+        self.__play_track("Dummy Track A", "dummy:a")
+
+        assert "dummy:a" not in self.frontend.pibox.suggestions
+        assert "dummy:a" not in [t.uri for t in self.frontend.get_suggestions(3)]
+
     def test_get_queued_tracks_returns_tracklist_with_current_users_votes(self):
         self.__start_session(skip_threshold=3)
 
         self.core.tracklist.add(uris=["dummy:a", "dummy:b"])
+        self.frontend.tracklist_changed()
         queued_tracks = self.core.tracklist.get_tracks().get()
 
         self.frontend.add_vote_for_user_on_queued_track(
@@ -291,6 +333,7 @@ class TestPiboxFrontend(unittest.TestCase):
         self.__start_session(skip_threshold=3)
 
         self.core.tracklist.add(uris=["dummy:a", "dummy:b"])
+        self.frontend.tracklist_changed()
         queued_tracks = self.core.tracklist.get_tracks().get()
 
         self.frontend.add_vote_for_user_on_queued_track(
@@ -307,6 +350,493 @@ class TestPiboxFrontend(unittest.TestCase):
         assert tracklist[1]["votes"] == 0
         assert tracklist[1]["voted"] is False
 
+    def test_session_playlist_items_are_cached_between_fetches(self):
+        self.__start_session()
+        self.__play_track("Dummy Track Z", "dummy:z")
+
+        self.__start_session()
+
+        stats = self.frontend.get_stats()["playlistCache"]
+        assert stats["misses"] == 2
+        assert stats["hits"] == 2
+
+    def test_playlist_changed_invalidates_cached_playlist_items(self):
+        self.__start_session()
+
+        self.frontend.playlist_changed(
+            models.Playlist(name="name", uri="dummy:playlist1")
+        )
+        self.__start_session()
+
+        stats = self.frontend.get_stats()["playlistCache"]
+        assert stats["misses"] == 3
+        assert stats["hits"] == 1
+
+    def test_playlists_loaded_clears_playlist_cache(self):
+        self.__start_session()
+
+        self.frontend.playlists_loaded()
+
+        assert self.frontend.get_stats()["playlistCache"]["size"] == 0
+
+    def test_start_session_skips_playlists_that_time_out(self):
+        slow_playlist = models.Playlist(name="slow", uri="dummy:slow")
+        self.backend.playlists.set_dummy_playlists(self.playlists + [slow_playlist])
+        self.backend.playlists.set_dummy_get_items_delay("dummy:slow", 0.5)
+
+        with mock.patch("mopidy_pibox.frontend.MOPIDY_CALL_TIMEOUT", 0.2):
+            self.frontend.start_session(
+                skip_threshold=1,
+                playlists=[
+                    {"name": "Dummy Playlist", "uri": "dummy:playlist1"},
+                    {"name": "Dummy Playlist 2", "uri": "dummy:playlist2"},
+                    {"name": "Slow", "uri": "dummy:slow"},
+                ],
+                auto_start=False,
+                shuffle=False,
+            )
+
+        assert self.frontend.pibox.remaining_playlist_tracks == [
+            "dummy:a",
+            "dummy:b",
+            "dummy:c",
+            "dummy:d",
+        ]
+
+    def test_start_session_fetches_playlists_against_a_shared_deadline(self):
+        slow_playlists = [
+            models.Playlist(name="slow", uri="dummy:slow1"),
+            models.Playlist(name="slower", uri="dummy:slow2"),
+        ]
+        self.backend.playlists.set_dummy_playlists(self.playlists + slow_playlists)
+        self.backend.playlists.set_dummy_get_items_delay("dummy:slow1", 0.5)
+        self.backend.playlists.set_dummy_get_items_delay("dummy:slow2", 0.5)
+
+        with mock.patch("mopidy_pibox.frontend.MOPIDY_CALL_TIMEOUT", 0.2):
+            started_at = time.monotonic()
+            self.frontend.start_session(
+                skip_threshold=1,
+                playlists=[
+                    {"name": "Dummy Playlist", "uri": "dummy:playlist1"},
+                    {"name": "Dummy Playlist 2", "uri": "dummy:playlist2"},
+                    {"name": "Slow", "uri": "dummy:slow1"},
+                    {"name": "Slower", "uri": "dummy:slow2"},
+                ],
+                auto_start=False,
+                shuffle=False,
+            )
+            elapsed = time.monotonic() - started_at
+
+        # both slow playlists are skipped after one shared deadline rather
+        # than one timeout each
+        assert elapsed < 0.4
+        assert self.frontend.pibox.remaining_playlist_tracks == [
+            "dummy:a",
+            "dummy:b",
+            "dummy:c",
+            "dummy:d",
+        ]
+
+    def test_update_session_playlists_only_fetches_added_playlists(self):
+        self.frontend.start_session(
+            skip_threshold=1,
+            playlists=[{"name": "Dummy Playlist", "uri": "dummy:playlist1"}],
+            auto_start=False,
+            shuffle=True,
+        )
+        original_order = self.frontend.pibox.remaining_playlist_tracks
+        self.frontend.playlists_loaded()
+
+        self.frontend.update_session_playlists(
+            [
+                {"name": "Dummy Playlist", "uri": "dummy:playlist1"},
+                {"name": "Dummy Playlist 2", "uri": "dummy:playlist2"},
+            ]
+        )
+
+        remaining = self.frontend.pibox.remaining_playlist_tracks
+        assert self.frontend.get_stats()["playlistCache"]["size"] == 1
+        assert [uri for uri in remaining if uri != "dummy:d"] == original_order
+        assert "dummy:d" in remaining
+
+    def test_update_session_playlists_drops_removed_playlist_tracks(self):
+        self.__start_session(shuffle=False)
+
+        self.frontend.update_session_playlists(
+            [{"name": "Dummy Playlist 2", "uri": "dummy:playlist2"}]
+        )
+
+        assert self.frontend.pibox.remaining_playlist_tracks == ["dummy:d"]
+
+    def test_track_playback_started_prequeues_hidden_track_if_lookahead_enabled(
+        self,
+    ):
+        self.frontend.lookahead = True
+        self.__start_session(auto_start=True)
+
+        current_tl_track = self.core.playback.get_current_tl_track().get()
+        self.frontend.track_playback_started(tl_track=current_tl_track)
+
+        queued_uris = [t.uri for t in self.core.tracklist.get_tracks().get()]
+        tracklist = self.frontend.get_queued_tracks("dummy")
+
+        assert len(queued_uris) == 2
+        assert queued_uris[0] == "dummy:c"
+        assert [t["info"].uri for t in tracklist] == ["dummy:c"]
+
+    def test_user_queued_track_plays_before_prequeued_track(self):
+        self.frontend.lookahead = True
+        self.__start_session(auto_start=True)
+        current_tl_track = self.core.playback.get_current_tl_track().get()
+        self.frontend.track_playback_started(tl_track=current_tl_track)
+        prequeued_uri = self.frontend.prequeued_tl_track.track.uri
+        user_uri = next(
+            uri for uri in ["dummy:a", "dummy:b", "dummy:d"] if uri != prequeued_uri
+        )
+
+        (success, error) = self.frontend.add_track_to_queue(user_uri)
+
+        queued_uris = [t.uri for t in self.core.tracklist.get_tracks().get()]
+        assert success is True
+        assert queued_uris == ["dummy:c", user_uri, prequeued_uri]
+
+    def test_queueing_the_prequeued_track_replaces_it(self):
+        self.frontend.lookahead = True
+        self.__start_session(auto_start=True)
+        current_tl_track = self.core.playback.get_current_tl_track().get()
+        self.frontend.track_playback_started(tl_track=current_tl_track)
+        prequeued_uri = self.frontend.prequeued_tl_track.track.uri
+
+        (success, error) = self.frontend.add_track_to_queue(prequeued_uri)
+
+        queued_uris = [t.uri for t in self.core.tracklist.get_tracks().get()]
+        assert success is True
+        assert error is None
+        assert queued_uris.count(prequeued_uri) == 1
+        assert queued_uris[1] == prequeued_uri
+        assert self.frontend.prequeued_tl_track.track.uri != prequeued_uri
+
+    def test_track_playback_started_confirms_pending_playback_start(self):
+        self.__start_session(auto_start=True)
+        assert self.frontend.start_attempt == 1
+
+        current_tl_track = self.core.playback.get_current_tl_track().get()
+        self.frontend.track_playback_started(tl_track=current_tl_track)
+
+        assert self.frontend.start_attempt == 0
+        assert self.frontend.start_timer is None
+
+    def test_check_playback_started_tries_next_track_if_playback_failed(self):
+        self.__start_session(auto_start=True)
+        # the track failed to load and Mopidy dropped it from the tracklist
+        self.core.playback.stop().get()
+        self.core.tracklist.clear().get()
+        self.frontend.tracklist_changed()
+
+        self.frontend.check_playback_started(self.frontend.start_token)
+
+        current_track = self.core.playback.get_current_track().get()
+        assert current_track is not None
+        assert current_track.uri != "dummy:c"
+        assert self.frontend.start_attempt == 2
+
+    def test_check_playback_started_gives_up_after_max_attempts(self):
+        self.__start_session(auto_start=True)
+        self.core.playback.stop().get()
+        self.core.tracklist.clear().get()
+        self.frontend.tracklist_changed()
+        self.frontend.start_attempt = MAX_START_ATTEMPTS
+
+        self.frontend.check_playback_started(self.frontend.start_token)
+
+        assert self.core.tracklist.get_length().get() == 0
+        assert self.frontend.start_attempt == 0
+
+    def test_check_playback_started_ignores_superseded_checks(self):
+        self.__start_session(auto_start=True)
+        self.core.playback.stop().get()
+        self.core.tracklist.clear().get()
+        self.frontend.tracklist_changed()
+
+        self.frontend.check_playback_started(self.frontend.start_token - 1)
+
+        assert self.core.tracklist.get_length().get() == 0
+
+    def test_get_tracklist_view_applies_change_and_returns_user_view(self):
+        self.__start_session()
+
+        view = json.loads(self.frontend.get_tracklist_view("dummy", "add", "dummy:a"))
+
+        assert view["error"] is None
+        assert view["retry_after_seconds"] == 0
+        assert [t["info"]["uri"] for t in view["tracklist"]] == ["dummy:a"]
+        assert view["tracklist"][0]["added_by_me"] is True
+        assert view["tracklist"][0]["voted"] is False
+
+    def test_get_tracklist_view_reports_change_errors(self):
+        self.__start_session()
+        self.frontend.get_tracklist_view("dummy", "add", "dummy:a")
+
+        view = json.loads(
+            self.frontend.get_tracklist_view("other", "remove", "dummy:a")
+        )
+
+        assert view["error"] == "NOT_OWNER"
+        assert [t["info"]["uri"] for t in view["tracklist"]] == ["dummy:a"]
+        assert view["tracklist"][0]["added_by_me"] is False
+
+    def test_tracklist_views_share_one_snapshot_per_tracklist_change(self):
+        self.__start_session(skip_threshold=3)
+        self.frontend.add_track_to_queue("dummy:a", "owner")
+        builds = self.frontend.snapshot_builds
+
+        views = [
+            json.loads(self.frontend.get_tracklist_view(f"user{i}")) for i in range(20)
+        ]
+        self.frontend.add_vote_for_user_on_queued_track(
+            "user0", models.Track(uri="dummy:a")
+        )
+        voted_view = json.loads(self.frontend.get_tracklist_view("user0"))
+
+        assert self.frontend.snapshot_builds == builds + 2
+        assert all(view["version"] == views[0]["version"] for view in views)
+        assert voted_view["version"] > views[0]["version"]
+        assert voted_view["tracklist"][0]["votes"] == 1
+        assert voted_view["tracklist"][0]["voted"] is True
+
+    def test_vote_pushes_each_registered_user_their_view_from_one_snapshot(self):
+        self.__start_session(skip_threshold=3)
+        self.frontend.add_track_to_queue("dummy:a", "owner")
+        fingerprints = {f"user{i}" for i in range(20)}
+        builds = self.frontend.snapshot_builds
+
+        with mock.patch(
+            "mopidy_pibox.frontend.PiboxWebSocket.registered_fingerprints",
+            return_value=fingerprints,
+        ), mock.patch(
+            "mopidy_pibox.frontend.PiboxWebSocket.send_to_users"
+        ) as send_to_users:
+            self.frontend.add_vote_for_user_on_queued_track(
+                "user0", models.Track(uri="dummy:a")
+            )
+
+        assert self.frontend.snapshot_builds == builds + 1
+        send_to_users.assert_called_once()
+        subject, views = send_to_users.call_args[0]
+        assert subject == "TRACKLIST_UPDATED"
+        assert set(views) == fingerprints
+        assert json.loads(views["user0"])["tracklist"][0]["voted"] is True
+        assert json.loads(views["user1"])["tracklist"][0]["voted"] is False
+        assert json.loads(views["user1"])["tracklist"][0]["votes"] == 1
+
+    def test_unchanged_tracklist_is_not_pushed_again(self):
+        self.__start_session()
+        self.frontend.add_track_to_queue("dummy:a", "owner")
+
+        with mock.patch(
+            "mopidy_pibox.frontend.PiboxWebSocket.registered_fingerprints",
+            return_value={"owner"},
+        ), mock.patch(
+            "mopidy_pibox.frontend.PiboxWebSocket.send_to_users"
+        ) as send_to_users:
+            self.frontend.tracklist_changed()
+            self.frontend.tracklist_changed()
+
+        send_to_users.assert_called_once()
+
+    def test_playback_events_broadcast_the_position(self):
+        tl_track = models.TlTrack(tlid=1, track=models.Track(uri="dummy:a"))
+
+        with mock.patch("mopidy_pibox.frontend.PiboxWebSocket.send") as send:
+            self.frontend.track_playback_started(tl_track)
+            self.frontend.track_playback_paused(tl_track, 1234)
+            self.frontend.seeked(2000)
+            self.frontend.track_playback_resumed(tl_track, 2000)
+            self.frontend.playback_state_changed(
+                core.PlaybackState.PLAYING, core.PlaybackState.STOPPED
+            )
+
+        assert [call.args for call in send.call_args_list] == [
+            (
+                "PLAYBACK_POSITION",
+                {"state": "playing", "position": 0, "uri": "dummy:a"},
+            ),
+            (
+                "PLAYBACK_POSITION",
+                {"state": "paused", "position": 1234, "uri": "dummy:a"},
+            ),
+            (
+                "PLAYBACK_POSITION",
+                {"state": "paused", "position": 2000, "uri": "dummy:a"},
+            ),
+            (
+                "PLAYBACK_POSITION",
+                {"state": "playing", "position": 2000, "uri": "dummy:a"},
+            ),
+            ("PLAYBACK_POSITION", {"state": "stopped", "position": 0, "uri": None}),
+        ]
+
+    def test_position_is_extrapolated_for_connecting_clients(self):
+        tl_track = models.TlTrack(tlid=1, track=models.Track(uri="dummy:a"))
+        self.frontend.track_playback_resumed(tl_track, 5000)
+        self.frontend.position_anchored_at -= 2
+
+        with mock.patch("mopidy_pibox.frontend.PiboxWebSocket.send") as send:
+            position = self.frontend.get_playback_position()
+
+        assert 7000 <= position["position"] < 7500
+        assert position["uri"] == "dummy:a"
+        # each connecting client is sent it on its own socket
+        send.assert_not_called()
+
+    def test_position_heartbeat_runs_only_while_playing(self):
+        tl_track = models.TlTrack(tlid=1, track=models.Track(uri="dummy:a"))
+        self.frontend.position_heartbeat_ms = 60000
+
+        self.frontend.track_playback_started(tl_track)
+        assert self.frontend.position_timer is not None
+        self.frontend.track_playback_paused(tl_track, 1000)
+        assert self.frontend.position_timer is None
+
+    def test_position_heartbeat_asks_core_once_for_all_clients(self):
+        clients = {mock.Mock() for _ in range(20)}
+
+        with mock.patch(
+            "mopidy_pibox.frontend.PiboxWebSocket.clients", clients
+        ), mock.patch(
+            "mopidy_pibox.frontend.PiboxWebSocket.send"
+        ) as send, mock.patch.object(self.frontend, "core", mock.Mock()) as mock_core:
+            mock_core.playback.get_state.return_value.get.return_value = "playing"
+            mock_core.playback.get_time_position.return_value.get.return_value = 12345
+            self.frontend.check_playback_position()
+
+        mock_core.playback.get_time_position.assert_called_once()
+        send.assert_called_once()
+        assert send.call_args.args[1]["position"] == 12345
+        assert self.frontend.get_stats()["playbackPosition"]["broadcasts"] == 1
+
+    def test_tracklist_queries_are_answered_from_local_mirror(self):
+        self.core.tracklist.add(uris=["dummy:a"]).get()
+        self.frontend.tracklist_changed()
+
+        with mock.patch.object(self.frontend, "core", mock.Mock()) as mock_core:
+            (success, error) = self.frontend.add_track_to_queue("dummy:a")
+            tracklist = self.frontend.get_queued_tracks("dummy")
+
+        assert error == "ALREADY_QUEUED"
+        assert [t["info"].uri for t in tracklist] == ["dummy:a"]
+        mock_core.tracklist.filter.assert_not_called()
+        mock_core.tracklist.get_tl_tracks.assert_not_called()
+
+    def test_when_track_ends_before_tracklist_changed_queues_next_song(self):
+        self.__start_session(auto_start=True)
+        current_tl_track = self.core.playback.get_current_tl_track().get()
+        # core has consumed the track but its tracklist_changed event is
+        # still in the frontend's mailbox
+        self.core.tracklist.remove({"tlid": [current_tl_track.tlid]}).get()
+
+        self.frontend.track_playback_ended(
+            tl_track=current_tl_track, time_position=30000
+        )
+
+        queued_uris = [t.uri for t in self.core.tracklist.get_tracks().get()]
+        assert len(queued_uris) == 1
+        assert queued_uris[0] != current_tl_track.track.uri
+
+    def test_start_session_probes_upcoming_tracks_in_background(self):
+        self.frontend.probe_depth = 3
+        self.__start_session()
+
+        assert self.frontend.probe_in_flight is True
+
+    def test_probe_denylists_unresolved_tracks_before_they_are_queued(self):
+        self.frontend.probe_depth = 3
+        self.__start_session()
+        uris = [ref.uri for ref in self.frontend.pibox.upcoming_playlist_tracks(3)]
+        track = models.Track(uri=uris[1])
+
+        self.frontend.apply_probe_results(
+            uris, {uris[0]: [], uris[1]: [track], uris[2]: [track]}
+        )
+
+        assert uris[0] in self.frontend.pibox.denylist
+        assert self.frontend.pibox.next_playlist_track()[0].uri == uris[1]
+        assert self.frontend.probe_in_flight is False
+
+    def test_restored_session_resumes_playback_on_start(self):
+        journalled = config(self.data_dir.name)
+        journalled["pibox"]["journal_flush_ms"] = 1000
+        self.frontend = PiboxFrontend(config=journalled, core=self.core)
+        self.__start_session(shuffle=False)
+        self.frontend.pibox.add_played_track("dummy:a")
+        self.frontend.on_stop()
+        self.core.tracklist.clear().get()
+
+        restarted = PiboxFrontend(config=journalled, core=self.core)
+        restarted.on_start()
+        restarted.on_stop()
+
+        assert restarted.pibox.started is True
+        assert restarted.pibox.played_tracks == ["dummy:a"]
+        assert self.core.playback.get_current_track().get().uri == "dummy:b"
+
+    def test_restored_session_requeues_user_queued_tracks(self):
+        journalled = config(self.data_dir.name)
+        journalled["pibox"]["journal_flush_ms"] = 1000
+        journalled["pibox"]["queue_limit_per_user"] = 2
+        self.frontend = PiboxFrontend(config=journalled, core=self.core)
+        self.__start_session(shuffle=False)
+        self.frontend.add_track_to_queue("dummy:c", "user1")
+        self.frontend.add_track_to_queue("dummy:d", "user1")
+        self.frontend.on_stop()
+        self.core.tracklist.clear().get()
+        # dummy:d can no longer be found after the restart
+        self.backend.library.dummy_library = [
+            track
+            for track in self.backend.library.dummy_library.get()
+            if track.uri != "dummy:d"
+        ]
+
+        restarted = PiboxFrontend(config=journalled, core=self.core)
+        restarted.on_start()
+        restarted.on_stop()
+
+        assert [track.uri for track in self.core.tracklist.get_tracks().get()] == [
+            "dummy:c"
+        ]
+        assert restarted.pibox.user_queued_tracks == {"user1": ["dummy:c"]}
+        assert restarted.add_track_to_queue("dummy:b", "user1") == (True, None)
+        assert restarted.add_track_to_queue("dummy:a", "user1") == (
+            False,
+            "USER_QUEUE_LIMIT",
+        )
+
+    def test_probe_failure_leaves_tracks_playable(self):
+        self.frontend.probe_depth = 3
+        self.__start_session()
+        uris = [ref.uri for ref in self.frontend.pibox.upcoming_playlist_tracks(3)]
+
+        self.frontend.apply_probe_results(uris, None)
+
+        assert not any(uri in self.frontend.pibox.denylist for uri in uris)
+
+    def test_get_stats_reports_probe_depth_and_hit_rate(self):
+        self.frontend.probe_depth = 4
+        self.__start_session()
+        uris = [ref.uri for ref in self.frontend.pibox.upcoming_playlist_tracks(4)]
+        self.frontend.apply_probe_results(
+            uris, {uri: [models.Track(uri=uri)] for uri in uris}
+        )
+
+        self.__play_track("Dummy Track Z", "dummy:z")
+
+        stats = self.frontend.get_stats()["probe"]
+        assert stats["depth"] == 4
+        assert stats["probed"] == 4
+        assert stats["unavailable"] == 0
+        assert stats["picks"] == 1
+        assert stats["hitRate"] == 1.0
+
     def __start_session(self, auto_start=False, skip_threshold=1, shuffle=True):
         self.frontend.start_session(
             skip_threshold=skip_threshold,
@@ -323,6 +853,7 @@ class TestPiboxFrontend(unittest.TestCase):
 
         self.core.tracklist.remove({"uri": [uri]}).get()
         self.core.playback.stop().get()
+        self.frontend.tracklist_changed()
 
         tracklist_length = self.core.tracklist.get_length().get()
         self.frontend.track_playback_ended(
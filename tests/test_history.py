@@ -0,0 +1,105 @@
+import json
+from unittest import mock
+
+from mopidy_pibox import history
+from mopidy_pibox.history import HistoryStore
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_record_is_kept_across_reloads(tmp_path):
+    clock = FakeClock()
+    store = HistoryStore(tmp_path, clock=clock)
+    store.record(["dummy:a", "dummy:b"])
+    clock.now = 2000
+    store.record(["dummy:a"])
+
+    store = HistoryStore(tmp_path)
+
+    assert list(store) == ["dummy:a", "dummy:b"]
+    assert store.count("dummy:a") == 2
+    assert store.last_requested("dummy:a") == 2000
+    assert store.count("dummy:b") == 1
+    assert store.last_requested("dummy:b") == 1000
+
+
+def test_record_appends_without_rewriting(tmp_path):
+    store = HistoryStore(tmp_path)
+    store.record(["dummy:a"])
+    store.record(["dummy:a", "dummy:b"])
+
+    lines = (tmp_path / history.HISTORY_FILE).read_text().splitlines()
+
+    assert [json.loads(line)[0] for line in lines] == [
+        "dummy:a",
+        "dummy:a",
+        "dummy:b",
+    ]
+
+
+def test_log_is_compacted_to_one_line_per_track(tmp_path, monkeypatch):
+    monkeypatch.setattr(history, "MIN_COMPACT_LINES", 4)
+    store = HistoryStore(tmp_path)
+    store.record(["dummy:a", "dummy:b"])
+    assert store.compacting is None
+    store.record(["dummy:a", "dummy:b"])
+    store.compacting.join()
+
+    lines = (tmp_path / history.HISTORY_FILE).read_text().splitlines()
+
+    assert len(lines) == 2
+    assert store.compactions == 1
+    assert HistoryStore(tmp_path).count("dummy:a") == 2
+
+
+def test_partial_last_line_is_ignored(tmp_path):
+    store = HistoryStore(tmp_path)
+    store.record(["dummy:a"])
+    with open(tmp_path / history.HISTORY_FILE, "a") as f:
+        f.write('["dummy:b", 1')
+
+    assert list(HistoryStore(tmp_path)) == ["dummy:a"]
+
+
+def test_legacy_history_is_migrated(tmp_path):
+    legacy = tmp_path / history.LEGACY_HISTORY_FILE
+    legacy.write_text(json.dumps(["dummy:a", "dummy:b", "dummy:a"]))
+
+    store = HistoryStore(tmp_path)
+
+    assert store.count("dummy:a") == 2
+    assert not legacy.exists()
+    assert HistoryStore(tmp_path).count("dummy:b") == 1
+
+
+def test_legacy_history_is_kept_if_migration_fails(tmp_path):
+    legacy = tmp_path / history.LEGACY_HISTORY_FILE
+    legacy.write_text(json.dumps(["dummy:a"]))
+
+    with mock.patch("mopidy_pibox.history.os.replace", side_effect=OSError):
+        store = HistoryStore(tmp_path)
+
+    assert store.count("dummy:a") == 1
+    assert legacy.exists()
+    assert HistoryStore(tmp_path).count("dummy:a") == 1
+
+
+def test_weights_favour_frequent_and_recent_requests(tmp_path):
+    clock = FakeClock()
+    store = HistoryStore(tmp_path, clock=clock)
+    store.record(["dummy:old", "dummy:old"])
+    clock.now += history.RECENCY_HALF_LIFE_DAYS * 24 * 60 * 60
+    store.record(["dummy:new"])
+
+    weights = dict(store.weights())
+
+    assert weights["dummy:old"] == 1
+    assert weights["dummy:new"] == 1
+    store.record(["dummy:new"])
+    assert dict(store.weights())["dummy:new"] == 2
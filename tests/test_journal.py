@@ -0,0 +1,175 @@
+import json
+
+from mopidy.models import Ref
+
+from mopidy_pibox import journal
+from mopidy_pibox.journal import Journal
+from mopidy_pibox.pibox import Pibox
+
+PLAYLIST = {"name": "Dummy Playlist", "uri": "dummy:playlist1"}
+
+
+class FakeTrack:
+    def __init__(self, uri):
+        self.uri = uri
+
+
+def _start_session(data_dir, flush_interval=0):
+    pibox = Pibox(data_dir, journal=Journal(data_dir, flush_interval=flush_interval))
+    pibox.start_session(2, [PLAYLIST], shuffle=False)
+    pibox.set_playlist_items(
+        [(Ref.track(uri=f"dummy:{name}", name=name), PLAYLIST) for name in "abcd"]
+    )
+    return pibox
+
+
+def test_load_without_snapshot_returns_nothing(tmp_path):
+    assert Journal(tmp_path).load() == (None, [])
+
+
+def test_entries_are_replayed_onto_the_last_snapshot(tmp_path):
+    log = Journal(tmp_path, flush_interval=0)
+    log.snapshot({"played": []})
+    log.append("played", "dummy:a")
+    log.append("deny", "dummy:b")
+
+    assert Journal(tmp_path).load() == (
+        {"played": []},
+        [["played", "dummy:a"], ["deny", "dummy:b"]],
+    )
+
+
+def test_entries_are_buffered_until_flushed(tmp_path):
+    log = Journal(tmp_path, flush_interval=60)
+    log.snapshot({})
+    log.append("played", "dummy:a")
+    log.append("played", "dummy:b")
+
+    assert Journal(tmp_path).load() == ({}, [])
+
+    log.flush()
+
+    assert Journal(tmp_path).load()[1] == [
+        ["played", "dummy:a"],
+        ["played", "dummy:b"],
+    ]
+    assert log.flushes == 1
+
+
+def test_snapshot_truncates_the_journal(tmp_path):
+    log = Journal(tmp_path, flush_interval=0)
+    log.snapshot({"version": 1})
+    log.append("played", "dummy:a")
+    log.snapshot({"version": 2})
+
+    assert Journal(tmp_path).load() == ({"version": 2}, [])
+    assert len((tmp_path / journal.JOURNAL_FILE).read_text().splitlines()) == 1
+
+
+def test_journal_from_an_earlier_snapshot_is_not_replayed(tmp_path):
+    log = Journal(tmp_path, flush_interval=0)
+    log.snapshot({})
+    log.append("played", "dummy:a")
+    stale = (tmp_path / journal.JOURNAL_FILE).read_text()
+    # crash after the new snapshot was written but before the journal was
+    # truncated
+    log.snapshot({})
+    (tmp_path / journal.JOURNAL_FILE).write_text(stale)
+
+    assert Journal(tmp_path).load() == ({}, [])
+
+
+def test_torn_last_entry_is_ignored(tmp_path):
+    log = Journal(tmp_path, flush_interval=0)
+    log.snapshot({})
+    log.append("played", "dummy:a")
+    with open(tmp_path / journal.JOURNAL_FILE, "a") as f:
+        f.write('["played", "dum')
+
+    assert Journal(tmp_path).load()[1] == [["played", "dummy:a"]]
+
+
+def test_clear_forgets_the_session(tmp_path):
+    log = Journal(tmp_path, flush_interval=0)
+    log.snapshot({})
+    log.append("played", "dummy:a")
+    log.clear()
+
+    assert Journal(tmp_path).load() == (None, [])
+
+
+def test_session_is_restored_after_a_crash(tmp_path):
+    pibox = _start_session(tmp_path)
+    entry = pibox.next_playlist_track()
+    pibox.set_track_source(entry[0].uri, "playlist", entry[1])
+    pibox.add_played_track(entry[0].uri)
+    pibox.add_to_denylist("dummy:c")
+    pibox.add_manually_queued_track_for_user("user1", "dummy:x")
+    pibox.add_manually_queued_track("dummy:x")
+    pibox.add_vote_for_user_on_track("user2", FakeTrack("dummy:x"))
+
+    restored = Pibox(tmp_path, journal=Journal(tmp_path))
+
+    assert restored.restore() is True
+    assert restored.started is True
+    assert restored.start_time == pibox.start_time
+    assert restored.skip_threshold == 2
+    assert restored.playlists == [PLAYLIST]
+    assert restored.played_tracks == ["dummy:a"]
+    assert "dummy:c" in restored.denylist
+    assert restored.manually_queued_tracks == ["dummy:x"]
+    assert restored.user_queued_tracks == {"user1": ["dummy:x"]}
+    assert restored.votes == {"dummy:x": 1}
+    assert restored.has_user_voted_on_track("user2", FakeTrack("dummy:x"))
+    assert restored.user_vote_times == pibox.user_vote_times
+    assert restored.track_sources == pibox.track_sources
+    assert restored.next_playlist_track() == (
+        Ref.track(uri="dummy:b", name="b"),
+        "Dummy Playlist",
+    )
+    assert restored.remaining_playlist_tracks == ["dummy:d"]
+
+
+def test_restore_folds_the_journal_into_a_snapshot(tmp_path):
+    pibox = _start_session(tmp_path)
+    pibox.add_played_track("dummy:a")
+
+    Pibox(tmp_path, journal=Journal(tmp_path)).restore()
+
+    state, entries = Journal(tmp_path).load()
+    assert state["playedTracks"] == ["dummy:a"]
+    assert entries == []
+
+
+def test_journal_is_snapshotted_once_it_grows(tmp_path, monkeypatch):
+    monkeypatch.setattr(journal, "SNAPSHOT_EVERY", 3)
+    pibox = _start_session(tmp_path)
+    for uri in ["dummy:x", "dummy:y", "dummy:z"]:
+        pibox.add_to_denylist(uri)
+
+    state, entries = Journal(tmp_path).load()
+    assert state["denylist"][-3:] == ["dummy:x", "dummy:y", "dummy:z"]
+    assert entries == []
+
+
+def test_ended_session_is_not_restored(tmp_path):
+    pibox = _start_session(tmp_path)
+    pibox.end_session()
+
+    restored = Pibox(tmp_path, journal=Journal(tmp_path))
+
+    assert restored.restore() is False
+    assert restored.started is False
+
+
+def test_starting_a_session_snapshots_the_play_order(tmp_path):
+    _start_session(tmp_path)
+
+    snapshot = json.loads((tmp_path / journal.SNAPSHOT_FILE).read_text())
+    assert [ref["uri"] for ref, _ in snapshot["state"]["pool"]["entries"]] == [
+        "dummy:a",
+        "dummy:b",
+        "dummy:c",
+        "dummy:d",
+    ]
+    assert not (tmp_path / (journal.SNAPSHOT_FILE + ".tmp")).exists()
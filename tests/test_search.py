@@ -0,0 +1,75 @@
+import asyncio
+import json
+
+from mopidy.models import SearchResult, Track
+
+from mopidy_pibox.search import SearchCache, flatten_results, normalise_query
+
+
+def _result(uri, *track_uris):
+    return SearchResult(
+        uri=uri, tracks=[Track(uri=track_uri) for track_uri in track_uris]
+    )
+
+
+def test_normalise_query_ignores_case_and_spacing():
+    assert normalise_query("  Whats  New\tPUSSYCAT ") == "whats new pussycat"
+
+
+def test_flatten_results_lists_prioritised_backends_first():
+    results = [
+        _result("local:search", "local:a"),
+        _result("soundcloud:search", "soundcloud:a"),
+        _result("tidal:search", "tidal:a"),
+        _result("spotify:search", "spotify:a", "spotify:b"),
+    ]
+
+    assert [track.uri for track in flatten_results(results)] == [
+        "spotify:a",
+        "spotify:b",
+        "soundcloud:a",
+        "local:a",
+        "tidal:a",
+    ]
+
+
+def test_identical_concurrent_searches_share_one_fetch():
+    searches = SearchCache(maxsize=10)
+    calls = []
+
+    async def fetch(query):
+        calls.append(query)
+        await asyncio.sleep(0.01)
+        return [_result("spotify:search", "spotify:a")]
+
+    async def run():
+        return await asyncio.gather(
+            *(searches.search("chorus", fetch) for _ in range(5))
+        )
+
+    bodies = asyncio.run(run())
+    again = asyncio.run(searches.search("chorus", fetch))
+
+    assert calls == ["chorus"]
+    assert len(set(bodies)) == 1 and again == bodies[0]
+    assert json.loads(again)["tracks"][0]["uri"] == "spotify:a"
+    assert searches.in_flight == {}
+    assert searches.stats()["sharedSearches"] == 4
+    assert searches.stats()["hits"] == 1
+
+
+def test_failed_search_is_not_cached():
+    searches = SearchCache(maxsize=10)
+
+    async def fail(query):
+        raise RuntimeError("backend down")
+
+    async def fetch(query):
+        return []
+
+    try:
+        asyncio.run(searches.search("chorus", fail))
+    except RuntimeError:
+        pass
+
+    assert json.loads(asyncio.run(searches.search("chorus", fetch))) == {"tracks": []}
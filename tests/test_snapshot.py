@@ -0,0 +1,50 @@
+import json
+
+from mopidy.models import Track
+
+from mopidy_pibox.snapshot import TracklistSnapshot
+
+
+def _snapshot():
+    return TracklistSnapshot(
+        3,
+        [
+            (Track(uri="dummy:a", name="Dummy Track A"), 0),
+            (Track(uri="dummy:b", name="Dummy Track B"), 2),
+        ],
+    )
+
+
+def test_encode_view_splices_user_flags_into_shared_tracks():
+    snapshot = _snapshot()
+
+    body = snapshot.encode_view(
+        lambda track: track.uri == "dummy:b",
+        {"dummy:a"},
+        error=None,
+        retry_after_seconds=5,
+    )
+    view = json.loads(body)
+
+    assert view["version"] == 3
+    assert view["error"] is None
+    assert view["retry_after_seconds"] == 5
+    assert [t["info"]["uri"] for t in view["tracklist"]] == ["dummy:a", "dummy:b"]
+    assert [t["votes"] for t in view["tracklist"]] == [0, 2]
+    assert [t["voted"] for t in view["tracklist"]] == [False, True]
+    assert [t["added_by_me"] for t in view["tracklist"]] == [True, False]
+
+
+def test_encode_view_of_empty_snapshot():
+    view = json.loads(TracklistSnapshot(1, []).encode_view(lambda track: False, set()))
+
+    assert view == {"version": 1, "tracklist": []}
+
+
+def test_items_for_matches_encoded_view():
+    snapshot = _snapshot()
+
+    items = snapshot.items_for(lambda track: False, {"dummy:b"})
+
+    assert [item["info"].uri for item in items] == ["dummy:a", "dummy:b"]
+    assert [item["added_by_me"] for item in items] == [False, True]
@@ -0,0 +1,383 @@
+import json
+import threading
+import time
+from unittest import mock
+
+import pykka
+import tornado.gen
+import tornado.testing
+import tornado.web
+import tornado.websocket
+
+from mopidy_pibox.frontend import PiboxFrontend
+from mopidy_pibox.socket import PiboxWebSocket
+
+
+class TestPiboxWebSocket(tornado.testing.AsyncHTTPTestCase):
+    # Workaround for https://github.com/pytest-dev/pytest/issues/12263.
+    def runTest(self):
+        pass
+
+    def get_app(self):
+        self.frontend = mock.Mock(spec=PiboxFrontend)
+        self.frontend.get_playback_position.side_effect = lambda: _resolved(None)
+        return tornado.web.Application(
+            [
+                (
+                    r"/ws/?",
+                    PiboxWebSocket,
+                    {
+                        "frontend": self.frontend,
+                        "ping_interval_ms": 60000,
+                        "pong_timeout_ms": 1000,
+                    },
+                )
+            ]
+        )
+
+    def tearDown(self):
+        PiboxWebSocket.clients.clear()
+        PiboxWebSocket.io_loop = None
+        PiboxWebSocket.coalesced_messages = 0
+        PiboxWebSocket.dropped_clients = 0
+        PiboxWebSocket.reaped_clients = 0
+        PiboxWebSocket.stop_heartbeat()
+        PiboxWebSocket.coalesce_window = 0
+        PiboxWebSocket.pending_broadcasts.clear()
+        PiboxWebSocket.flush_timeout = None
+        PiboxWebSocket.merged_events = 0
+        PiboxWebSocket.seq = 0
+        PiboxWebSocket.replay_buffer.clear()
+        PiboxWebSocket.replay_buffer_size = 0
+        PiboxWebSocket.replayed_events = 0
+        PiboxWebSocket.resyncs = 0
+        super().tearDown()
+
+    async def _connect(self, fingerprint=None):
+        conn = await tornado.websocket.websocket_connect(
+            self.get_url("/ws").replace("http", "ws")
+        )
+        if fingerprint:
+            await conn.write_message(
+                json.dumps({"type": "REGISTER", "fingerprint": fingerprint})
+            )
+        # round trip a PING so the server has handled everything sent so far
+        await conn.write_message(json.dumps({"type": "PING", "ts": 1}))
+        await conn.read_message()
+        return conn
+
+    @tornado.testing.gen_test
+    async def test_register_requests_the_users_current_view(self):
+        await self._connect("fingerprint")
+
+        self.frontend.push_tracklist_view.assert_called_once_with("fingerprint")
+        self.frontend.get_playback_position.assert_called_once_with()
+        assert PiboxWebSocket.registered_fingerprints() == {"fingerprint"}
+
+    @tornado.testing.gen_test
+    async def test_register_sends_the_playback_position_to_that_client_only(self):
+        other = await self._connect("other")
+        position = {"state": "playing", "position": 7000, "uri": "dummy:a"}
+        self.frontend.get_playback_position.side_effect = lambda: _resolved(position)
+
+        conn = await tornado.websocket.websocket_connect(
+            self.get_url("/ws").replace("http", "ws")
+        )
+        await conn.write_message(
+            json.dumps({"type": "REGISTER", "fingerprint": "fingerprint"})
+        )
+
+        assert json.loads(await conn.read_message()) == {
+            "type": "PLAYBACK_POSITION",
+            "payload": position,
+        }
+        PiboxWebSocket.send("VOTE_ADDED", {})
+        assert json.loads(await other.read_message())["type"] == "VOTE_ADDED"
+        assert PiboxWebSocket.stats()["seq"] == 1
+
+    @tornado.testing.gen_test
+    async def test_send_to_users_delivers_each_user_their_own_payload(self):
+        first = await self._connect("first")
+        second = await self._connect("second")
+        await self._connect()
+
+        PiboxWebSocket.send_to_users(
+            "TRACKLIST_UPDATED",
+            {"first": '{"voted": true}', "second": '{"voted": false}'},
+        )
+
+        assert json.loads(await first.read_message()) == {
+            "type": "TRACKLIST_UPDATED",
+            "payload": {"voted": True},
+        }
+        assert json.loads(await second.read_message()) == {
+            "type": "TRACKLIST_UPDATED",
+            "payload": {"voted": False},
+        }
+        # views are sent afresh on REGISTER, so they are not kept for replay
+        assert PiboxWebSocket.stats()["seq"] == 0
+        assert len(PiboxWebSocket.replay_buffer) == 0
+
+    @tornado.testing.gen_test
+    async def test_send_encodes_once_and_is_safe_from_other_threads(self):
+        connections = [await self._connect() for _ in range(3)]
+
+        with mock.patch("mopidy_pibox.socket.json.dumps", wraps=json.dumps) as dumps:
+            sender = threading.Thread(
+                target=PiboxWebSocket.send, args=("VOTE_ADDED", {})
+            )
+            sender.start()
+            sender.join()
+            messages = [await conn.read_message() for conn in connections]
+
+        assert [call.args[0] for call in dumps.call_args_list].count({}) == 1
+        assert all(
+            json.loads(message)
+            == {
+                "type": "VOTE_ADDED",
+                "epoch": PiboxWebSocket.epoch,
+                "seq": 1,
+                "payload": {},
+            }
+            for message in messages
+        )
+
+    @tornado.testing.gen_test
+    async def test_unsent_messages_of_the_same_type_are_coalesced(self):
+        conn = await self._connect()
+        (handler,) = PiboxWebSocket.clients
+        # pretend a write is already in flight
+        handler.draining = True
+
+        handler.enqueue("VOTE_ADDED", '{"type": "VOTE_ADDED", "payload": 1}')
+        handler.enqueue("SESSION_STARTED", '{"type": "SESSION_STARTED", "payload": {}}')
+        handler.enqueue("VOTE_ADDED", '{"type": "VOTE_ADDED", "payload": 2}')
+        handler.draining = False
+        await handler._drain()
+
+        assert json.loads(await conn.read_message())["type"] == "SESSION_STARTED"
+        assert json.loads(await conn.read_message())["payload"] == 2
+        assert PiboxWebSocket.coalesced_messages == 1
+
+    @tornado.testing.gen_test
+    async def test_slow_client_is_disconnected_when_outbox_is_full(self):
+        conn = await self._connect()
+        (handler,) = PiboxWebSocket.clients
+        handler.draining = True
+
+        with mock.patch("mopidy_pibox.socket.MAX_OUTBOX_SIZE", 10):
+            handler.enqueue("TRACKLIST_UPDATED", '{"payload": "' + "x" * 20 + '"}')
+            assert PiboxWebSocket.dropped_clients == 0
+            handler.enqueue("VOTE_ADDED", '{"payload": "' + "x" * 20 + '"}')
+
+        assert await conn.read_message() is None
+        await tornado.gen.sleep(0.01)
+        assert PiboxWebSocket.dropped_clients == 1
+        assert handler not in PiboxWebSocket.clients
+
+    @tornado.testing.gen_test
+    async def test_a_single_message_larger_than_the_outbox_is_still_sent(self):
+        conn = await self._connect()
+        (handler,) = PiboxWebSocket.clients
+        handler.draining = True
+        message = '{"type": "SESSION_STARTED", "payload": "' + "x" * 20 + '"}'
+
+        with mock.patch("mopidy_pibox.socket.MAX_OUTBOX_SIZE", 10):
+            handler.enqueue("SESSION_STARTED", message)
+            handler.enqueue("VOTE_ADDED", "{}")
+        handler.draining = False
+        await handler._drain()
+
+        assert await conn.read_message() == message
+        assert await conn.read_message() == "{}"
+        assert PiboxWebSocket.dropped_clients == 0
+
+    @tornado.testing.gen_test
+    async def test_heartbeat_pings_clients_and_keeps_responsive_ones(self):
+        await self._connect()
+        (handler,) = PiboxWebSocket.clients
+        assert PiboxWebSocket.heartbeat is not None
+
+        PiboxWebSocket.check_clients()
+        assert handler.ping_sent_at is not None
+        # the client library answers pings automatically
+        for _ in range(100):
+            if handler.ping_sent_at is None:
+                break
+            await tornado.gen.sleep(0.01)
+        assert handler.ping_sent_at is None
+        PiboxWebSocket.check_clients()
+
+        assert handler in PiboxWebSocket.clients
+        assert PiboxWebSocket.reaped_clients == 0
+
+    @tornado.testing.gen_test
+    async def test_heartbeat_reaps_clients_that_miss_a_ping(self):
+        conn = await self._connect("fingerprint")
+        (handler,) = PiboxWebSocket.clients
+        handler.ping_sent_at = time.monotonic() - 2
+
+        PiboxWebSocket.check_clients()
+
+        assert PiboxWebSocket.clients == set()
+        assert PiboxWebSocket.registered_fingerprints() == set()
+        assert PiboxWebSocket.stats()["reapedClients"] == 1
+        assert await conn.read_message() is None
+
+    @tornado.testing.gen_test
+    async def test_bursts_of_the_same_event_are_merged_within_the_window(self):
+        conn = await self._connect()
+        PiboxWebSocket.coalesce_window = 0.05
+
+        for count in range(5):
+            PiboxWebSocket.send("VOTE_ADDED", {"count": count})
+        PiboxWebSocket.send("SESSION_PLAYLISTS_UPDATED", {})
+
+        first = json.loads(await conn.read_message())
+        second = json.loads(await conn.read_message())
+        assert first == {
+            "type": "VOTE_ADDED",
+            "epoch": PiboxWebSocket.epoch,
+            "seq": 1,
+            "payload": {"count": 4},
+        }
+        assert second["type"] == "SESSION_PLAYLISTS_UPDATED"
+        assert PiboxWebSocket.stats()["mergedEvents"] == 4
+
+    @tornado.testing.gen_test
+    async def test_merged_user_pushes_keep_every_users_latest_view(self):
+        first = await self._connect("first")
+        second = await self._connect("second")
+        PiboxWebSocket.coalesce_window = 0.05
+
+        PiboxWebSocket.send_to_users("TRACKLIST_UPDATED", {"first": "1", "second": "1"})
+        PiboxWebSocket.send_to_users("TRACKLIST_UPDATED", {"first": "2"})
+
+        assert json.loads(await first.read_message())["payload"] == 2
+        assert json.loads(await second.read_message())["payload"] == 1
+
+    @tornado.testing.gen_test(timeout=2)
+    async def test_immediate_send_flushes_held_events_first(self):
+        conn = await self._connect()
+        PiboxWebSocket.coalesce_window = 60
+
+        PiboxWebSocket.send("VOTE_ADDED", {})
+        PiboxWebSocket.send("SESSION_ENDED", {}, immediate=True)
+
+        assert json.loads(await conn.read_message())["type"] == "VOTE_ADDED"
+        assert json.loads(await conn.read_message())["type"] == "SESSION_ENDED"
+        assert PiboxWebSocket.pending_broadcasts == {}
+
+    @tornado.testing.gen_test
+    async def test_broadcasts_carry_increasing_sequence_numbers(self):
+        conn = await self._connect()
+
+        PiboxWebSocket.send("VOTE_ADDED", {})
+        PiboxWebSocket.send("SESSION_STARTED", {})
+
+        assert json.loads(await conn.read_message())["seq"] == 1
+        assert json.loads(await conn.read_message())["seq"] == 2
+        assert PiboxWebSocket.stats()["seq"] == 2
+
+    @tornado.testing.gen_test
+    async def test_resume_replays_only_the_missed_events(self):
+        await self._connect("first")
+        PiboxWebSocket.send("VOTE_ADDED", {"count": 1})
+        PiboxWebSocket.send("SESSION_PLAYLISTS_UPDATED", {})
+        PiboxWebSocket.send("VOTE_ADDED", {"count": 2})
+
+        conn = await self._connect("second")
+        await conn.write_message(
+            json.dumps({"type": "RESUME", "lastSeq": 1, "epoch": PiboxWebSocket.epoch})
+        )
+
+        assert json.loads(await conn.read_message()) == {
+            "type": "SESSION_PLAYLISTS_UPDATED",
+            "epoch": PiboxWebSocket.epoch,
+            "seq": 2,
+            "payload": {},
+        }
+        assert json.loads(await conn.read_message())["seq"] == 3
+        assert PiboxWebSocket.stats()["replayedEvents"] == 2
+
+    @tornado.testing.gen_test
+    async def test_resume_does_not_replay_the_playback_position(self):
+        await self._connect()
+        PiboxWebSocket.send("PLAYBACK_POSITION", {"position": 0}, immediate=True)
+        PiboxWebSocket.send("VOTE_ADDED", {})
+
+        conn = await self._connect()
+        await conn.write_message(
+            json.dumps({"type": "RESUME", "lastSeq": 0, "epoch": PiboxWebSocket.epoch})
+        )
+
+        assert json.loads(await conn.read_message()) == {
+            "type": "VOTE_ADDED",
+            "epoch": PiboxWebSocket.epoch,
+            "seq": 1,
+            "payload": {},
+        }
+        assert PiboxWebSocket.stats()["replayedEvents"] == 1
+
+    @tornado.testing.gen_test
+    async def test_resume_from_outside_the_buffer_asks_for_a_resync(self):
+        await self._connect()
+        with mock.patch("mopidy_pibox.socket.REPLAY_BUFFER_SIZE", 2):
+            for count in range(4):
+                PiboxWebSocket.send("VOTE_ADDED", {"count": count})
+            conn = await self._connect()
+
+            await conn.write_message(
+                json.dumps(
+                    {"type": "RESUME", "lastSeq": 1, "epoch": PiboxWebSocket.epoch}
+                )
+            )
+            assert json.loads(await conn.read_message()) == {
+                "type": "RESYNC",
+                "epoch": PiboxWebSocket.epoch,
+                "seq": 4,
+            }
+
+        assert PiboxWebSocket.stats()["resyncs"] == 1
+
+    @tornado.testing.gen_test
+    async def test_replay_buffer_is_bounded_by_size(self):
+        await self._connect()
+        with mock.patch("mopidy_pibox.socket.MAX_REPLAY_BUFFER_CHARS", 350):
+            for count in range(4):
+                PiboxWebSocket.send("VOTE_ADDED", {"padding": "x" * 50})
+            conn = await self._connect()
+
+            await conn.write_message(
+                json.dumps(
+                    {"type": "RESUME", "lastSeq": 1, "epoch": PiboxWebSocket.epoch}
+                )
+            )
+            assert json.loads(await conn.read_message())["type"] == "RESYNC"
+
+        assert [seq for seq, _subject, _messages in PiboxWebSocket.replay_buffer] == [
+            3,
+            4,
+        ]
+        assert 0 < PiboxWebSocket.stats()["replayBufferSize"] <= 350
+
+    @tornado.testing.gen_test
+    async def test_resume_after_a_server_restart_asks_for_a_resync(self):
+        await self._connect()
+        for count in range(3):
+            PiboxWebSocket.send("VOTE_ADDED", {"count": count})
+        conn = await self._connect()
+
+        # the client's last event was numbered by an earlier process
+        await conn.write_message(
+            json.dumps({"type": "RESUME", "lastSeq": 1, "epoch": "earlier"})
+        )
+
+        assert json.loads(await conn.read_message())["type"] == "RESYNC"
+        assert PiboxWebSocket.stats()["replayedEvents"] == 0
+
+
+def _resolved(value):
+    future = pykka.ThreadingFuture()
+    future.set(value)
+    return future
@@ -0,0 +1,258 @@
+import random
+
+from mopidy.models import Ref, TlTrack, Track
+
+from mopidy_pibox.state import (
+    OrderedSet,
+    PlaylistPool,
+    QueueOwnership,
+    SessionState,
+    SuggestionIndex,
+    TracklistMirror,
+)
+
+
+def _playlist(name="Dummy Playlist", uri="dummy:playlist1"):
+    return {"name": name, "uri": uri}
+
+
+def _tl_track(tlid, uri):
+    return TlTrack(tlid=tlid, track=Track(uri=uri))
+
+
+def _items(*uris, playlist=None):
+    playlist = playlist or _playlist()
+    return [(Ref.track(uri=uri), playlist) for uri in uris]
+
+
+def test_ordered_set_preserves_insertion_order():
+    uris = OrderedSet(["dummy:c", "dummy:a"])
+    uris.add("dummy:b")
+    uris.add("dummy:a")
+
+    assert list(uris) == ["dummy:c", "dummy:a", "dummy:b"]
+
+
+def test_ordered_set_discard_keeps_remaining_order():
+    uris = OrderedSet(["dummy:a", "dummy:b", "dummy:c"])
+
+    uris.discard("dummy:b")
+    uris.discard("dummy:z")
+
+    assert uris == ["dummy:a", "dummy:c"]
+    assert "dummy:b" not in uris
+
+
+def test_ordered_set_compares_equal_to_list_and_set():
+    uris = OrderedSet(["dummy:a", "dummy:b"])
+
+    assert uris == ["dummy:a", "dummy:b"]
+    assert uris != ["dummy:b", "dummy:a"]
+    assert uris == {"dummy:b", "dummy:a"}
+
+
+def test_session_state_can_play_excludes_played_and_denylisted():
+    state = SessionState(denylist=["dummy:denied"])
+    state.played_tracks.add("dummy:played")
+
+    assert state.can_play("dummy:fresh") is True
+    assert state.can_play("dummy:played") is False
+    assert state.can_play("dummy:denied") is False
+
+
+def test_session_state_tracks_voters_per_track():
+    state = SessionState()
+
+    state.add_voter("user1", "dummy:a")
+    state.add_voter("user1", "dummy:a")
+
+    assert state.has_voted_on("user1", "dummy:a") is True
+    assert state.has_voted_on("user2", "dummy:a") is False
+    assert state.has_voted_on("user1", "dummy:b") is False
+    assert list(state.has_voted["dummy:a"]) == ["user1"]
+
+
+def test_queue_ownership_indexes_tracks_by_user_and_users_by_track():
+    ownership = QueueOwnership()
+    ownership.add("user1", "dummy:b")
+    ownership.add("user1", "dummy:a")
+    ownership.add("user2", "dummy:a")
+
+    assert ownership.tracks("user1") == ["dummy:b", "dummy:a"]
+    assert ownership.owners("dummy:a") == ["user1", "user2"]
+    assert ownership.owns("user2", "dummy:a")
+    assert not ownership.owns("user2", "dummy:b")
+    assert ownership.count("user1") == 2
+    assert ownership.count("user3") == 0
+
+
+def test_queue_ownership_discard_track_removes_it_for_every_owner():
+    ownership = QueueOwnership({"user1": ["dummy:a", "dummy:b"], "user2": ["dummy:a"]})
+
+    ownership.discard_track("dummy:a")
+
+    assert "dummy:a" not in ownership
+    assert not ownership.owns("user1", "dummy:a")
+    assert ownership.to_json() == {"user1": ["dummy:b"]}
+    assert ownership.count("user2") == 0
+
+
+def test_playlist_pool_removes_duplicates_keeping_first_source():
+    pool = PlaylistPool(
+        _items("dummy:a", "dummy:b")
+        + _items("dummy:a", playlist=_playlist("Other", "dummy:playlist2"))
+    )
+
+    assert [(ref.uri, name) for ref, name in pool.entries] == [
+        ("dummy:a", "Dummy Playlist"),
+        ("dummy:b", "Dummy Playlist"),
+    ]
+
+
+def test_playlist_pool_next_entry_advances_cursor_and_skips_unplayable():
+    state = SessionState()
+    pool = PlaylistPool(_items("dummy:a", "dummy:b", "dummy:c"))
+    state.played_tracks.add("dummy:b")
+
+    assert pool.next_entry(state.can_play)[0].uri == "dummy:a"
+    assert pool.next_entry(state.can_play)[0].uri == "dummy:c"
+    assert pool.next_entry(state.can_play) is None
+
+
+def test_playlist_pool_upcoming_peeks_without_moving_cursor():
+    state = SessionState()
+    pool = PlaylistPool(_items("dummy:a", "dummy:b", "dummy:c", "dummy:d"))
+    pool.next_entry(state.can_play)
+    state.denylist.add("dummy:b")
+
+    assert [ref.uri for ref in pool.upcoming(2, state.can_play)] == [
+        "dummy:c",
+        "dummy:d",
+    ]
+    assert pool.next_entry(state.can_play)[0].uri == "dummy:c"
+
+
+def test_playlist_pool_remaining_is_derived_from_cursor():
+    state = SessionState()
+    pool = PlaylistPool(_items("dummy:a", "dummy:b", "dummy:c"))
+
+    pool.next_entry(state.can_play)
+    state.denylist.add("dummy:c")
+
+    assert pool.remaining(state.can_play) == ["dummy:b"]
+
+
+def test_playlist_pool_add_playlist_keeps_existing_order():
+    state = SessionState()
+    pool = PlaylistPool(_items("dummy:a", "dummy:b", "dummy:c"), shuffle_items=True)
+    original = [ref.uri for ref, _ in pool.entries]
+    pool.next_entry(state.can_play)
+
+    pool.add_playlist(
+        _playlist("Other", "dummy:playlist2"),
+        [Ref.track(uri="dummy:d"), Ref.track(uri="dummy:b")],
+    )
+
+    uris = [ref.uri for ref, _ in pool.entries]
+    assert uris[0] == original[0]
+    assert [uri for uri in uris if uri != "dummy:d"] == original
+    assert sorted(pool.remaining(state.can_play)) == sorted(original[1:] + ["dummy:d"])
+
+
+def test_playlist_pool_remove_playlist_drops_only_its_own_tracks():
+    other = _playlist("Other", "dummy:playlist2")
+    pool = PlaylistPool(
+        _items("dummy:a", "dummy:b") + _items("dummy:b", "dummy:c", playlist=other)
+    )
+
+    pool.remove_playlist("dummy:playlist1")
+
+    assert [(ref.uri, name) for ref, name in pool.entries] == [
+        ("dummy:b", "Other"),
+        ("dummy:c", "Other"),
+    ]
+
+
+def test_playlist_pool_push_back_returns_entry_to_cursor():
+    state = SessionState()
+    pool = PlaylistPool(_items("dummy:a", "dummy:b"))
+    entry = pool.next_entry(state.can_play)
+
+    pool.push_back(entry)
+
+    assert pool.next_entry(state.can_play) is entry
+
+
+def test_tracklist_mirror_tracks_order_and_uris():
+    mirror = TracklistMirror([_tl_track(1, "dummy:a"), _tl_track(2, "dummy:b")])
+
+    mirror.add([_tl_track(3, "dummy:c")], at_position=1)
+
+    assert [tl_track.tlid for tl_track in mirror] == [1, 3, 2]
+    assert "dummy:c" in mirror
+    assert mirror.index(2) == 2
+    assert len(mirror) == 3
+
+
+def test_tracklist_mirror_remove_counts_duplicate_uris():
+    mirror = TracklistMirror([_tl_track(1, "dummy:a"), _tl_track(2, "dummy:a")])
+
+    mirror.remove([_tl_track(1, "dummy:a")])
+
+    assert mirror.count("dummy:a") == 1
+    mirror.remove([_tl_track(2, "dummy:a")])
+    assert "dummy:a" not in mirror
+
+
+def test_tracklist_mirror_discard_requires_matching_tlid_and_uri():
+    mirror = TracklistMirror([_tl_track(1, "dummy:a")])
+
+    mirror.discard(_tl_track(1, "dummy:z"))
+    assert len(mirror) == 1
+
+    mirror.discard(_tl_track(1, "dummy:a"))
+    assert len(mirror) == 0
+
+
+def test_suggestion_index_samples_distinct_uris():
+    index = SuggestionIndex(
+        [(f"dummy:{i}", 1) for i in range(10)], rng=random.Random(0)
+    )
+
+    sample = index.sample(5)
+
+    assert len(sample) == 5
+    assert len(set(sample)) == 5
+
+
+def test_suggestion_index_favours_heavier_tracks():
+    index = SuggestionIndex(
+        [("dummy:popular", 50)] + [(f"dummy:{i}", 1) for i in range(50)],
+        rng=random.Random(0),
+    )
+
+    draws = [index.sample(1)[0] for _ in range(1000)]
+
+    assert 400 < draws.count("dummy:popular") < 600
+
+
+def test_suggestion_index_never_returns_discarded_or_rejected_uris():
+    index = SuggestionIndex([(f"dummy:{i}", 1) for i in range(4)], rng=random.Random(0))
+    index.discard("dummy:0")
+
+    sample = index.sample(4, lambda uri: uri != "dummy:1")
+
+    assert sorted(sample) == ["dummy:2", "dummy:3"]
+    assert len(index) == 3
+
+
+def test_suggestion_index_is_rebuilt_once_mostly_discarded():
+    index = SuggestionIndex(
+        [(f"dummy:{i}", 1) for i in range(10)], rng=random.Random(0)
+    )
+    for i in range(6):
+        index.discard(f"dummy:{i}")
+
+    assert sorted(index.sample(10)) == ["dummy:6", "dummy:7", "dummy:8", "dummy:9"]
+    assert index.rebuilds == 2
+    assert index.uris == ["dummy:6", "dummy:7", "dummy:8", "dummy:9"]
@@ -0,0 +1,55 @@
+from unittest import mock
+
+from mopidy.models import Track
+
+from mopidy_pibox.tracks import TrackCache
+
+
+def _core():
+    core = mock.Mock()
+    core.library.lookup.side_effect = lambda uris: mock.Mock(
+        get=mock.Mock(
+            return_value={
+                uri: [Track(uri=uri, name=uri)] if uri != "dummy:gone" else []
+                for uri in uris
+            }
+        )
+    )
+    return core
+
+
+def test_get_many_looks_up_only_misses_in_one_call():
+    core = _core()
+    tracks = TrackCache(core, maxsize=10)
+    tracks.get_many(["dummy:a"])
+
+    result = tracks.get_many(["dummy:a", "dummy:b", "dummy:gone", "dummy:b"])
+
+    assert [call.kwargs["uris"] for call in core.library.lookup.call_args_list] == [
+        ["dummy:a"],
+        ["dummy:b", "dummy:gone"],
+    ]
+    assert result["dummy:b"] == [Track(uri="dummy:b", name="dummy:b")]
+    assert result["dummy:gone"] == []
+    assert tracks.stats()["lookups"] == 2
+
+
+def test_tracks_are_kept_across_restarts(tmp_path):
+    tracks = TrackCache(_core(), path=tmp_path / "tracks.sqlite", maxsize=10)
+    tracks.get_many(["dummy:a", "dummy:gone"])
+    tracks.close()
+
+    core = _core()
+    tracks = TrackCache(core, path=tmp_path / "tracks.sqlite", maxsize=10)
+
+    assert tracks.get("dummy:a") == [Track(uri="dummy:a", name="dummy:a")]
+    core.library.lookup.assert_not_called()
+
+
+def test_unresolved_tracks_are_looked_up_again():
+    core = _core()
+    tracks = TrackCache(core, maxsize=10)
+    tracks.get_many(["dummy:gone"])
+
+    assert tracks.get("dummy:gone") == []
+    assert core.library.lookup.call_count == 2